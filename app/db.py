@@ -1,15 +1,168 @@
 import sqlite3
-import pandas as pd
 import os
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import List, Optional, Tuple
+
+from config.settings import settings
+from src.services.admission import AdmissionRejected, admission
+from src.services.generations import Generation, generations, open_readonly
+from src.services.metrics import DATAFRAME_BUILD, QUERY_ERRORS, QUERY_LATENCY, QUERY_ROWS
+from src.services.profiling import profile_stage
+from src.services.results import collect_rows, fetch_batches, query_rows, spill_rows
 
 # Define the path to your SQLite database
 DB_PATH = os.path.join(os.path.dirname(__file__), "../data.db")  # Adjust path if needed
 
+class ConnectionPool:
+    """
+    Small pool of reusable SQLite connections so requests skip the connect
+    cost. Connections are opened on the current database generation; idle
+    ones left on a superseded generation are closed when next borrowed.
+    """
+
+    def __init__(self, db_path: Optional[str] = None, size: int = 4):
+        # None follows the published generation (see src/services/generations.py)
+        self.db_path = db_path
+        self.size = size
+        # Idle (generation number, connection) pairs, most recently used last
+        self._idle: List[Tuple[int, sqlite3.Connection]] = []
+        self._opened = 0
+        # Guards _idle and _opened; notified whenever a connection or a free slot comes back
+        self._available = threading.Condition()
+
+    def _connect(self, path: str) -> sqlite3.Connection:
+        # Connections are handed between threadpool workers, one user at a time
+        if self.db_path is None:
+            return open_readonly(path, check_same_thread=False)
+        return sqlite3.connect(path, check_same_thread=False)
+
+    def _acquire(self, generation: Generation) -> sqlite3.Connection:
+        with self._available:
+            while not self._idle and self._opened >= self.size:
+                self._available.wait()
+            if self._idle:
+                number, conn = self._idle.pop()
+            else:
+                self._opened += 1
+                number, conn = None, None
+        if conn is None:
+            return self._open(generation)
+        if number != generation.number:
+            conn.close()
+            return self._open(generation)
+        return conn
+
+    def _open(self, generation: Generation) -> sqlite3.Connection:
+        try:
+            return self._connect(self.db_path or generation.path)
+        except sqlite3.Error:
+            self._discard()
+            raise
+
+    def _discard(self) -> None:
+        """Give up a connection's slot and wake a waiter to open a new one"""
+        with self._available:
+            self._opened -= 1
+            self._available.notify()
+
+    def _release(self, generation: Generation, conn: sqlite3.Connection) -> None:
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            self._discard()
+            return
+        with self._available:
+            self._idle.append((generation.number, conn))
+            self._available.notify()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection on the current generation for the duration of a with block"""
+        with self._generation() as generation:
+            conn = self._acquire(generation)
+            try:
+                yield conn
+            finally:
+                self._release(generation, conn)
+
+    def _generation(self):
+        if self.db_path is not None:
+            return nullcontext(Generation(0, self.db_path))
+        return generations.use()
+
+    def warm(self) -> int:
+        """Open every connection in the pool up front; returns how many are idle"""
+        conns = []
+        with self._generation() as generation:
+            try:
+                for _ in range(self.size):
+                    conn = self._acquire(generation)
+                    conns.append(conn)
+                    # Touch the schema so the first real query skips parsing it
+                    conn.execute("SELECT name FROM sqlite_master").fetchall()
+            finally:
+                for conn in conns:
+                    self._release(generation, conn)
+        return len(self._idle)
+
+    def ping(self) -> bool:
+        """Check that the database answers a trivial query"""
+        with self.connection() as conn:
+            return conn.execute("SELECT 1").fetchone()[0] == 1
+
+# Global connection pool instance
+pool = ConnectionPool(size=settings.DB_POOL_SIZE)
+
+@contextmanager
+def query_batches(query: str):
+    """Run a query on the configured engine and yield (column names, row batches) while its cursor is open"""
+    from src.services.database import get_db_service, normalize_sql
+    from src.services.partitions import route_query
+
+    if settings.DB_BACKEND != "sqlite":
+        service = get_db_service()
+        with service.backend.fetch(normalize_sql(query, service.backend.dialect, service.identifiers())) as result:
+            yield result
+        return
+
+    with pool.connection() as conn:
+        cursor = conn.execute(route_query(conn, normalize_sql(query, "sqlite")))
+        yield [description[0] for description in cursor.description or ()], fetch_batches(cursor)
+
 def execute_sql_query(query: str):
+    if settings.DB_BACKEND != "sqlite":
+        # Other engines are served by the pluggable backend in DatabaseService
+        from src.services.database import get_db_service
+        return get_db_service().execute_query(query)
+
+    try:
+        with admission.stage("sql"), profile_stage("sql"), QUERY_LATENCY.time(source="app"), \
+                query_batches(query) as (columns, batches):
+            # Rows past RESULT_ROW_CAP spill to disk instead of memory
+            rows, info = collect_rows(columns, batches)
+        QUERY_ROWS.observe(info.total_rows if info.total_rows is not None else len(rows), source="app")
+
+        # Same conversion pd.read_sql_query performs, timed separately from the query
+        with profile_stage("dataframe"), DATAFRAME_BUILD.time(source="app"):
+            return query_rows(columns, rows, info)
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        QUERY_ERRORS.inc(source="app")
+        return f"SQL Execution Error: {e}"
+
+def spill_sql_query(query: str):
+    """Run a query and write its whole result to the result store (for export); returns its ResultInfo or an error string"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        df = pd.read_sql_query(query, conn)
-        conn.close()
-        return df.to_dict(orient="records")
+        with admission.stage("sql"), profile_stage("sql"), QUERY_LATENCY.time(source="app"), \
+                query_batches(query) as (columns, batches):
+            info = spill_rows(columns, batches)
+        QUERY_ROWS.observe(info.total_rows, source="app")
+        return info
+    except AdmissionRejected:
+        raise
     except Exception as e:
+        QUERY_ERRORS.inc(source="app")
         return f"SQL Execution Error: {e}"
@@ -0,0 +1,159 @@
+import base64
+import json
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+
+# Response encodings offered on /ask and the streaming endpoints:
+# - json:      the original list-of-records payload, standard json module
+# - fast-json: the same payload through orjson when it is installed
+# - columnar:  column names and types once, one array per column
+# - arrow:     Arrow IPC stream of the result (requires pyarrow)
+FORMATS = ("json", "fast-json", "columnar", "arrow")
+
+MEDIA_TYPES = {
+    "json": "application/json",
+    "fast-json": "application/json",
+    "columnar": "application/vnd.ecommerce.columnar+json",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+# Accept-header media type -> format, in the order they are preferred
+_ACCEPT_FORMATS = [
+    ("application/vnd.apache.arrow.stream", "arrow"),
+    ("application/vnd.ecommerce.columnar+json", "columnar"),
+]
+
+def negotiate_format(http_request: Request) -> str:
+    """Pick the response encoding from ?format= or the Accept header"""
+    requested = http_request.query_params.get("format")
+    if requested:
+        if requested not in FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unknown format '{requested}', expected one of {list(FORMATS)}")
+        return requested
+
+    accept = http_request.headers.get("accept", "")
+    for media_type, fmt in _ACCEPT_FORMATS:
+        if media_type in accept:
+            return fmt
+    return "json"
+
+def _column_type(values: List[Any]) -> str:
+    """Narrowest JSON-friendly type that fits every non-null value of a column"""
+    kinds = {type(v) for v in values if v is not None and not (isinstance(v, float) and math.isnan(v))}
+    if not kinds:
+        return "null"
+    if kinds == {bool}:
+        return "bool"
+    if kinds <= {int}:
+        return "int64"
+    if kinds <= {int, float}:
+        return "float64"
+    if kinds == {str}:
+        return "string"
+    return "json"
+
+def to_columnar(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Convert list-of-records rows into column arrays, with names and types stated once"""
+    names = list(records[0].keys()) if records else []
+    data = []
+    types = []
+    for name in names:
+        values = [row.get(name) for row in records]
+        column_type = _column_type(values)
+        if column_type == "float64":
+            # NaN is not valid JSON; send it as null like the row format's consumers expect
+            values = [None if isinstance(v, float) and math.isnan(v) else v for v in values]
+        types.append(column_type)
+        data.append(values)
+    return {
+        "format": "columnar",
+        "columns": [{"name": n, "type": t} for n, t in zip(names, types)],
+        "row_count": len(records),
+        "data": data,
+    }
+
+def _columnarize(payload: Dict[str, Any], keys: Tuple[str, ...] = ("answer", "data")) -> Dict[str, Any]:
+    """Replace row lists in a response payload (including a table visualization) with columnar form"""
+    encoded = dict(payload)
+    for key in keys:
+        if isinstance(encoded.get(key), list):
+            encoded[key] = to_columnar(encoded[key])
+    visualization = encoded.get("visualization")
+    if isinstance(visualization, dict) and isinstance(visualization.get("content"), list):
+        encoded["visualization"] = {**visualization, "content": to_columnar(visualization["content"])}
+    return encoded
+
+def dumps_fast(obj: Any) -> bytes:
+    """Serialize to compact JSON bytes, using orjson when available"""
+    try:
+        import orjson
+    except ImportError:
+        return json.dumps(obj, separators=(",", ":"), default=str).encode("utf-8")
+    return orjson.dumps(obj, default=str, option=orjson.OPT_SERIALIZE_NUMPY)
+
+def to_arrow_ipc(records: List[Dict[str, Any]], metadata: Optional[Dict[str, Any]] = None) -> bytes:
+    """Encode rows as an Arrow IPC stream; other response fields travel as schema metadata"""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise HTTPException(status_code=406, detail="Arrow encoding requires pyarrow to be installed")
+
+    columnar = to_columnar(records)
+    arrays = {}
+    for col, values in zip(columnar["columns"], columnar["data"]):
+        # SQLite columns can mix types (e.g. COALESCE(num, 'N/A')), which Arrow cannot hold
+        if col["type"] == "json":
+            values = [None if v is None else str(v) for v in values]
+        arrays[col["name"]] = values
+    table = pa.Table.from_pydict(arrays)
+    if metadata:
+        table = table.replace_schema_metadata({k: json.dumps(v, default=str) for k, v in metadata.items()})
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def encode_payload(payload: Dict[str, Any], fmt: str, rows_key: str = "answer") -> bytes:
+    """Encode a full question response in the requested format"""
+    if fmt == "json":
+        return json.dumps(payload, default=str).encode("utf-8")
+    if fmt == "fast-json":
+        return dumps_fast(payload)
+    if fmt == "columnar":
+        return dumps_fast(_columnarize(payload))
+
+    rows = payload.get(rows_key)
+    metadata = {k: v for k, v in payload.items() if k != rows_key}
+    if not isinstance(rows, list):
+        # Error strings have no rows; keep them in the metadata
+        metadata[rows_key] = rows
+        rows = []
+    return to_arrow_ipc(rows, metadata)
+
+def encoded_response(payload: Dict[str, Any], fmt: str, rows_key: str = "answer", status_code: int = 200) -> Response:
+    return Response(content=encode_payload(payload, fmt, rows_key), status_code=status_code,
+                    media_type=MEDIA_TYPES[fmt], headers={"X-Result-Format": fmt})
+
+def encode_event(event: Dict[str, Any], fmt: str) -> str:
+    """
+    Encode one streaming event as text. Row lists in event data are made
+    columnar, or base64 Arrow IPC for the arrow format, since SSE and
+    WebSocket text frames cannot carry raw binary.
+    """
+    data = event.get("data")
+    if fmt in ("columnar", "arrow") and isinstance(data, dict) and isinstance(data.get("answer"), list):
+        if fmt == "columnar":
+            data = _columnarize(data)
+        else:
+            ipc = to_arrow_ipc(data["answer"])
+            data = {**data, "answer": {"format": "arrow", "encoding": "base64",
+                                       "data": base64.b64encode(ipc).decode("ascii")}}
+        event = {**event, "data": data}
+
+    if fmt == "json":
+        return json.dumps(event)
+    return dumps_fast(event).decode("utf-8")
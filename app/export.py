@@ -0,0 +1,194 @@
+"""
+Streaming CSV/Parquet export of question results
+
+Exports read a spilled result (see src/services/results.py) batch by batch
+and stream it as CSV chunks or Parquet row groups, so only one batch is in
+memory at a time. While streaming, the encoded bytes are also written next
+to the spill file; once an export file is complete it is served with
+Range support, so interrupted downloads can resume. A Range request for an
+export that has not been built yet builds it first.
+
+A result that stopped at RESULT_SPILL_MAX_ROWS is exported as far as it
+goes, with ``X-Result-Complete: false`` so it is not taken for the whole
+answer.
+"""
+import csv
+import io
+import os
+import uuid
+import zlib
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+from config.settings import settings
+from src.services.results import SpilledResult, result_store
+
+EXPORT_FORMATS = ("csv", "parquet")
+
+# Allowed compressions per format, default first. CSV is compressed as a
+# whole (gzip); Parquet compresses inside each column chunk.
+COMPRESSIONS = {
+    "csv": ("none", "gzip"),
+    "parquet": ("snappy", "zstd", "gzip", "none"),
+}
+
+MEDIA_TYPES = {
+    ("csv", "none"): "text/csv; charset=utf-8",
+    ("csv", "gzip"): "application/gzip",
+}
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+def resolve_options(fmt: str, compression: Optional[str]) -> str:
+    """Validate the format and return the compression to use"""
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown export format '{fmt}', expected one of {list(EXPORT_FORMATS)}")
+    compression = (compression or COMPRESSIONS[fmt][0]).lower()
+    if compression not in COMPRESSIONS[fmt]:
+        raise HTTPException(status_code=400, detail=f"Compression for {fmt} must be one of {list(COMPRESSIONS[fmt])}")
+    if fmt == "parquet":
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=501, detail="Parquet export requires pyarrow (pip install pyarrow)")
+    return compression
+
+def export_suffix(fmt: str, compression: str) -> str:
+    if fmt == "csv":
+        return "csv.gz" if compression == "gzip" else "csv"
+    return "parquet" if compression == "snappy" else f"{compression}.parquet"
+
+def csv_chunks(result: SpilledResult, compression: str) -> Iterator[bytes]:
+    """Header line, then one chunk per batch of rows"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compression == "gzip" else None
+
+    def encode(rows: List[tuple], header: bool = False) -> bytes:
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        if header:
+            writer.writerow(result.columns)
+        writer.writerows(rows)
+        data = buf.getvalue().encode("utf-8")
+        return compressor.compress(data) if compressor else data
+
+    yield encode([], header=True)
+    for batch in result.batches():
+        chunk = encode(batch)
+        if chunk:
+            yield chunk
+    if compressor:
+        yield compressor.flush()
+
+class _ChunkSink:
+    """Write-only file object collecting what ParquetWriter writes until it is drained"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+def _arrow_type(kinds: set):
+    import pyarrow as pa
+
+    kinds = kinds - {"null"}
+    if kinds == {"integer"}:
+        return pa.int64()
+    if kinds and kinds <= {"integer", "real"}:
+        return pa.float64()
+    if kinds == {"blob"}:
+        return pa.binary()
+    return pa.string()
+
+def parquet_chunks(result: SpilledResult, compression: str) -> Iterator[bytes]:
+    """One Parquet row group per EXPORT_ROW_GROUP_SIZE rows, streamed as it is written"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Column types from the whole result, so every row group has the same schema
+    types = [_arrow_type(kinds) for kinds in result.column_types()]
+    schema = pa.schema([pa.field(name, arrow_type) for name, arrow_type in zip(result.columns, types)])
+    as_text = [arrow_type == pa.string() for arrow_type in types]
+
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression=compression)
+    try:
+        for batch in result.batches(settings.EXPORT_ROW_GROUP_SIZE):
+            columns = []
+            for i, arrow_type in enumerate(types):
+                values = [row[i] for row in batch]
+                if as_text[i]:
+                    values = [None if v is None else str(v) for v in values]
+                columns.append(pa.array(values, type=arrow_type))
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+def export_chunks(result: SpilledResult, fmt: str, compression: str) -> Iterator[bytes]:
+    if fmt == "csv":
+        return csv_chunks(result, compression)
+    return parquet_chunks(result, compression)
+
+def _keep_while_streaming(chunks: Iterator[bytes], path: Path) -> Iterator[bytes]:
+    """Pass chunks through while writing them to ``path``, which only appears once complete"""
+    partial = Path(f"{path}.{uuid.uuid4().hex}.partial")
+    try:
+        with open(partial, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        os.replace(partial, path)
+    finally:
+        partial.unlink(missing_ok=True)
+
+def build_export(result: SpilledResult, fmt: str, compression: str) -> Path:
+    """Write the complete export file for a result, if it is not there yet"""
+    path = result_store.export_path(result.handle, export_suffix(fmt, compression))
+    if not path.exists():
+        for _ in _keep_while_streaming(export_chunks(result, fmt, compression), path):
+            pass
+    return path
+
+def export_response(result: SpilledResult, fmt: str, compression: str, http_request: Request) -> Response:
+    """Serve a finished export file (with Range support), or stream the export while keeping it"""
+    suffix = export_suffix(fmt, compression)
+    path = result_store.export_path(result.handle, suffix)
+    media_type = MEDIA_TYPES.get((fmt, compression), PARQUET_MEDIA_TYPE)
+    filename = f"result-{result.handle[:12]}.{suffix}"
+    headers = {"X-Result-Handle": result.handle, "X-Total-Rows": str(result.total_rows),
+               "X-Result-Complete": "true" if result.complete else "false"}
+
+    if not path.exists() and "range" in http_request.headers:
+        path = build_export(result, fmt, compression)
+    if path.exists():
+        return FileResponse(path, media_type=media_type, filename=filename, headers=headers)
+
+    headers.update({
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        # Ranges are served once the export file exists; a Range request builds it
+        "Accept-Ranges": "bytes",
+    })
+    return StreamingResponse(_keep_while_streaming(export_chunks(result, fmt, compression), path),
+                             media_type=media_type, headers=headers)
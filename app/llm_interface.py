@@ -2,51 +2,104 @@ import os
 import requests
 from dotenv import load_dotenv
 
+from config.settings import settings
+from src.services.admission import admission
+from src.services.cache import cache
+from src.services.metrics import LLM_ERRORS, LLM_LATENCY, SQL_CLEANING_FAILURES
+from src.services.eligibility import prompt_guidelines, prompt_tables
+from src.services.profiling import profile_stage
+
 load_dotenv()
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+GEMINI_URL = settings.GEMINI_URL
 
 HEADERS = {
     "Content-Type": "application/json"
 }
 
-def ask_llm(question: str) -> str:
-    if not GEMINI_API_KEY:
-        raise ValueError("GEMINI_API_KEY not set in environment variables")
+# Raw LLM responses live in the shared "llm" cache namespace, keyed by the
+# whole prompt so prompt changes miss. Only successful responses are cached;
+# warm-up replays the top questions into it.
+def _cache_key(question: str) -> str:
+    return build_prompt(" ".join(question.split()))
 
-    payload = {
-        "contents": [
-            {
-                "parts": [
-                    {
-                        "text": f"""
+def get_cached_sql(question: str):
+    """Return the cached LLM response for a question, or None"""
+    return cache.get("llm", _cache_key(question))
+
+def cache_sql(question: str, response: str) -> None:
+    cache.set("llm", _cache_key(question), response)
+
+def clear_sql_cache() -> None:
+    cache.clear("llm")
+
+def build_prompt(question: str) -> str:
+    """Build the SQL-generation prompt sent to Gemini"""
+    return f"""
 You are an AI that converts natural language questions into SQL queries.
 Only return the SQL query, nothing else.
 Use the following available tables:
 - ad_sales_metrics (columns: date, item_id, ad_sales, impressions, ad_spend, clicks, units_sold)
 - total_sales_metrics (columns: date, item_id, total_sales, total_units_ordered)
-- eligibility_table (columns: eligibility_datetime_utc, item_id, eligibility, message)
+- eligibility_table (columns: eligibility_datetime_utc, item_id, eligibility, message){prompt_tables()}
 
 Important guidelines:
 - For questions asking for "total sales" or "total amount", use SUM(total_sales) to get the aggregate total
 - For questions asking for individual sales by item/date, use SELECT without SUM
 - Use table `total_sales_metrics` for sales-related questions
-- Always use proper aggregate functions when asked for totals/sums
+- Always use proper aggregate functions when asked for totals/sums{prompt_guidelines()}
 
 Question: {question}
 """
 
+def clean_sql(raw_sql: str) -> str:
+    """Strip markdown code fences from an LLM response, counting responses that are not a query"""
+    sql_query = raw_sql.replace("```sql", "").replace("```", "").strip()
+
+    if raw_sql.startswith("Error from LLM"):
+        SQL_CLEANING_FAILURES.inc(reason="llm_error")
+    elif not sql_query:
+        SQL_CLEANING_FAILURES.inc(reason="empty")
+    elif sql_query.split(None, 1)[0].upper() not in ("SELECT", "WITH"):
+        SQL_CLEANING_FAILURES.inc(reason="not_select")
+    return sql_query
+
+def ask_llm(question: str) -> str:
+    cached = get_cached_sql(question)
+    if cached is not None:
+        return cached
+
+    if not GEMINI_API_KEY:
+        LLM_ERRORS.inc(source="app", reason="no_api_key")
+        raise ValueError("GEMINI_API_KEY not set in environment variables")
+
+    payload = {
+        "contents": [
+            {
+                "parts": [
+                    {
+                        "text": build_prompt(question)
                     }
                 ]
             }
         ]
     }
 
-    response = requests.post(f"{GEMINI_URL}?key={GEMINI_API_KEY}", headers=HEADERS, json=payload)
-    data = response.json()
+    with admission.stage("llm"):
+        try:
+            with profile_stage("llm"), LLM_LATENCY.time(source="app"):
+                response = requests.post(f"{GEMINI_URL}?key={GEMINI_API_KEY}", headers=HEADERS, json=payload)
+                data = response.json()
+        except Exception:
+            LLM_ERRORS.inc(source="app", reason="request")
+            raise
 
     try:
-        return data["candidates"][0]["content"]["parts"][0]["text"]
+        text = data["candidates"][0]["content"]["parts"][0]["text"]
     except Exception as e:
+        LLM_ERRORS.inc(source="app", reason="response_format")
         return f"Error from LLM: {data}"  # Better visibility into LLM errors
+
+    cache_sql(question, text)
+    return text
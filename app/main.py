@@ -1,56 +1,174 @@
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, HTTPException
-from fastapi.responses import HTMLResponse, StreamingResponse, FileResponse
+from fastapi.responses import HTMLResponse, StreamingResponse, FileResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from app.llm_interface import ask_llm
-from app.db import execute_sql_query
-from app.visualization import visualizer
+from app.db import spill_sql_query
+from app.pipeline import PipelineError, QueryContext, pipeline
 from app.streaming_service import streaming_service
+from app.db import pool
+from app.warmup import run_warmup
+from app.encoding import FORMATS, encode_event, encoded_response, negotiate_format
+from app.export import export_response, resolve_options
+from config.settings import settings
+from src.services.admission import PRIORITIES, AdmissionMiddleware, AdmissionRejected, admission, priority_scope
+from src.services.database import get_db_service
+from src.services.generations import current_generation
+from src.services.llm import get_llm_service
+from src.services.metrics import registry as metrics_registry, RESPONSE_BYTES
+from src.services.profiling import profile_request, profile_store
+from src.services.results import result_store, to_records
+from contextlib import asynccontextmanager
+from datetime import datetime
+import asyncio
+import hmac
 import json
+import logging
 import uuid
-from typing import Optional
+from typing import Dict, Optional
 
-app = FastAPI(title="Ecommerce AI Agent", description="AI-powered ecommerce analytics with visualizations and real-time streaming")
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the global services when the worker starts instead of at import time"""
+    get_db_service()
+    if settings.GEMINI_API_KEY:
+        get_llm_service()
+    else:
+        logger.warning("GEMINI_API_KEY not set; LLM service not initialized")
+
+    # Warm up in the background so /health can answer "starting" meanwhile
+    app.state.ready = not settings.WARMUP_ENABLED
+    app.state.warmup = None
+    warmup_task = None
+    if settings.WARMUP_ENABLED:
+        async def warm_up():
+            try:
+                app.state.warmup = await asyncio.to_thread(run_warmup)
+            finally:
+                app.state.ready = True
+        warmup_task = asyncio.create_task(warm_up())
+    yield
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+
+app = FastAPI(title="Ecommerce AI Agent", description="AI-powered ecommerce analytics with visualizations and real-time streaming", lifespan=lifespan)
+
+class ResponseBytesMiddleware:
+    """Record the size of every HTTP response body, including streamed ones, per route"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        size = 0
+
+        async def counting_send(message):
+            nonlocal size
+            if message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, counting_send)
+        finally:
+            # Label by route template so path parameters don't explode cardinality
+            route = scope.get("route")
+            RESPONSE_BYTES.observe(size, path=getattr(route, "path", "unmatched"))
+
+app.add_middleware(ResponseBytesMiddleware)
+# Outermost, so shed requests cost as little as possible
+app.add_middleware(AdmissionMiddleware)
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    """A pipeline stage shed the request after the endpoint admitted it"""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc), "retry_after": exc.retry_after},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 class QuestionRequest(BaseModel):
     question: str
     chart_type: Optional[str] = None
     include_visualization: bool = True
 
+class ExportRequest(BaseModel):
+    question: str
+    format: str = "csv"
+    compression: Optional[str] = None
+
+def require_admin(http_request: Request) -> None:
+    """Reject the request unless it carries the configured admin token"""
+    token = http_request.headers.get("X-Admin-Token", "")
+    if not settings.ADMIN_TOKEN or not hmac.compare_digest(token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+def profiling_mode(http_request: Request) -> Optional[str]:
+    """
+    Profiling requested through the X-Profile header or ?profile= flag:
+    "return" attaches the profile to the response, "store" writes it to the
+    profile ring. Only admins may ask for either.
+    """
+    mode = http_request.headers.get("X-Profile") or http_request.query_params.get("profile")
+    if not mode:
+        return None
+    mode = "return" if mode.lower() in ("1", "true", "return") else mode.lower()
+    if mode not in ("return", "store"):
+        raise HTTPException(status_code=400, detail="Profile mode must be 'return' or 'store'")
+    require_admin(http_request)
+    return mode
+
 @app.post("/ask")
-def ask_question(request: QuestionRequest):
+def ask_question(request: QuestionRequest, http_request: Request):
     """Standard synchronous endpoint for asking questions"""
-    question = request.question
-    raw_sql = ask_llm(question)
-
-    # ✅ Clean SQL from markdown formatting (e.g., ```sql ... ```)
-    sql_query = raw_sql.replace("```sql", "").replace("```", "").strip()
+    fmt = negotiate_format(http_request)
+    mode = profiling_mode(http_request)
+    with profile_request(mode, label="/ask") as profile:
+        response = _answer_question(request)
+    if profile is not None and mode == "return":
+        response["profile"] = profile.report()
+    elif profile is not None and mode == "store":
+        response["profile_id"] = profile.id
+    if fmt != "json":
+        return encoded_response(response, fmt)
+    return response
 
+def _run_pipeline(context: QueryContext, *steps) -> Optional[Dict[str, str]]:
+    """
+    Run the given pipeline steps (all stages by default). A failed stage is
+    answered in the response body as before the pipeline existed: the error
+    text replaces the answer, and the returned error payload names the stage.
+    """
     try:
-        answer = execute_sql_query(sql_query)
-        
-        # Generate visualization if requested and data is suitable
-        visualization = None
-        if request.include_visualization and isinstance(answer, list) and len(answer) > 0:
-            visualization = visualizer.generate_visualization(answer, question, request.chart_type)
-            
-    except Exception as e:
-        answer = f"SQL Execution Error: {e}"
-        visualization = None
+        for step in steps or (pipeline.run,):
+            step(context)
+    except PipelineError as e:
+        logger.warning(f"{e.stage} stage failed: {e}")
+        prefix = "Error from LLM" if e.stage in ("llm", "clean") else "SQL Execution Error"
+        context.answer = f"{prefix}: {e}"
+        context.visualization = None
+        return {"error": str(e), "stage": e.stage}
+    return None
 
-    return {
-        "question": question,
-        "sql_query": sql_query,
-        "answer": answer,
-        "visualization": visualization
-    }
+def _answer_question(request: QuestionRequest):
+    context = QueryContext(request.question, request.chart_type, request.include_visualization)
+    error = _run_pipeline(context)
+    return {**context.response(), **(error or {})}
 
 @app.post("/ask-stream")
-async def ask_question_stream(request: QuestionRequest):
+async def ask_question_stream(request: QuestionRequest, http_request: Request):
     """Streaming endpoint that simulates real-time processing"""
+    fmt = negotiate_format(http_request)
+
     async def generate_stream():
         async for event in streaming_service.stream_complete_response(request.question):
-            yield f"data: {json.dumps(event)}\n\n"
+            yield f"data: {encode_event(event, fmt)}\n\n"
     
     return StreamingResponse(generate_stream(), media_type="text/plain")
 
@@ -69,10 +187,38 @@ async def websocket_endpoint(websocket: WebSocket):
             
             if message.get("type") == "question":
                 question = message.get("question", "")
+                # Result encoding for this question: json, fast-json, columnar or arrow
+                fmt = message.get("format", "json")
+                if fmt not in FORMATS:
+                    await websocket.send_text(json.dumps({
+                        "event": "error",
+                        "data": {"error": f"Unknown format '{fmt}'"}
+                    }))
+                    continue
+                
+                # Interactive traffic queues ahead of HTTP callers, at the endpoint and in every stage
+                limiter = admission.endpoint_for("/ws")
+                try:
+                    admitted = await limiter.acquire_async(PRIORITIES["interactive"]) if limiter else None
+                except AdmissionRejected as e:
+                    await websocket.send_text(json.dumps({
+                        "event": "error",
+                        "data": {"error": str(e), "retry_after": e.retry_after}
+                    }))
+                    continue
                 
                 # Stream the response
-                async for event in streaming_service.stream_complete_response(question):
-                    await websocket.send_text(json.dumps(event))
+                sent_bytes = 0
+                try:
+                    with priority_scope(PRIORITIES["interactive"]):
+                        async for event in streaming_service.stream_complete_response(question):
+                            text = encode_event(event, fmt)
+                            sent_bytes += len(text)
+                            await websocket.send_text(text)
+                finally:
+                    if limiter:
+                        limiter.release(admitted)
+                RESPONSE_BYTES.observe(sent_bytes, path="/ws")
             
             elif message.get("type") == "ping":
                 await websocket.send_text(json.dumps({"type": "pong", "timestamp": "now"}))
@@ -87,27 +233,91 @@ async def websocket_endpoint(websocket: WebSocket):
         streaming_service.remove_connection(connection_id)
 
 @app.get("/visualize/{chart_type}")
-def get_visualization(chart_type: str, question: str):
+def get_visualization(chart_type: str, question: str, http_request: Request):
     """Endpoint to get specific visualization types"""
-    try:
-        raw_sql = ask_llm(question)
-        sql_query = raw_sql.replace("```sql", "").replace("```", "").strip()
-        answer = execute_sql_query(sql_query)
-        
-        if not isinstance(answer, list) or len(answer) == 0:
-            raise HTTPException(status_code=400, detail="No data available for visualization")
-        
-        visualization = visualizer.generate_visualization(answer, question, chart_type)
-        
-        return {
-            "question": question,
-            "sql_query": sql_query,
-            "data": answer,
-            "visualization": visualization
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    fmt = negotiate_format(http_request)
+    mode = profiling_mode(http_request)
+    with profile_request(mode, label="/visualize") as profile:
+        response = _visualize_question(chart_type, question)
+    if profile is not None and mode == "return":
+        response["profile"] = profile.report()
+    elif profile is not None and mode == "store":
+        response["profile_id"] = profile.id
+    if fmt != "json":
+        return encoded_response(response, fmt, rows_key="data")
+    return response
+
+def _visualize_question(chart_type: str, question: str):
+    context = QueryContext(question, chart_type)
+    error = _run_pipeline(context)
+    if error is not None:
+        return {**context.response(rows_key="data"), **error}
+    if not context.has_rows:
+        raise HTTPException(status_code=400, detail="No data available for visualization")
+    return context.response(rows_key="data")
+
+@app.get("/results/{handle}")
+def get_result_page(handle: str, http_request: Request, offset: int = 0, limit: Optional[int] = None):
+    """Page through a result that was too large to return inline"""
+    fmt = negotiate_format(http_request)
+    result = result_store.open(handle)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Result not found or expired")
+    limit = settings.RESULT_PAGE_SIZE if limit is None else limit
+    if offset < 0 or not 0 < limit <= max(settings.RESULT_ROW_CAP, settings.RESULT_PAGE_SIZE):
+        raise HTTPException(status_code=400, detail="Invalid offset or limit")
+
+    rows = to_records(result.columns, result.page(offset, limit))
+    next_offset = offset + len(rows)
+    response = {
+        "result_handle": handle,
+        "columns": result.columns,
+        "offset": offset,
+        "data": rows,
+        "total_rows": result.total_rows,
+        "complete": result.complete,
+        "next_offset": next_offset if next_offset < result.total_rows else None,
+    }
+    if fmt != "json":
+        return encoded_response(response, fmt, rows_key="data")
+    return response
+
+@app.post("/export")
+def export_question(request: ExportRequest, http_request: Request):
+    """Answer a question as a CSV or Parquet download; the X-Result-Handle header allows resuming it"""
+    compression = resolve_options(request.format, request.compression)
+    context = QueryContext(request.question, include_visualization=False)
+    error = _run_pipeline(context, pipeline.generate_sql)
+    if error is not None:
+        raise HTTPException(status_code=400, detail=context.answer)
+    info = spill_sql_query(context.sql_query)
+    if isinstance(info, str):
+        raise HTTPException(status_code=400, detail=info)
+    return export_response(result_store.open(info.handle), request.format, compression, http_request)
+
+@app.get("/export/{handle}")
+def export_result(handle: str, http_request: Request, format: str = "csv", compression: Optional[str] = None):
+    """Download a stored result as CSV or Parquet, with Range support for resuming"""
+    compression = resolve_options(format, compression)
+    result = result_store.open(handle)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Result not found or expired")
+    return export_response(result, format, compression, http_request)
+
+@app.get("/profiles")
+def list_profiles(http_request: Request):
+    """List stored request profiles, newest first (admin only)"""
+    require_admin(http_request)
+    return {"profiles": profile_store.list()}
+
+@app.get("/profiles/{profile_id}")
+def get_profile(profile_id: str, http_request: Request):
+    """Fetch one stored request profile (admin only)"""
+    require_admin(http_request)
+    report = profile_store.load(profile_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return report
 
 @app.get("/demo")
 def get_demo():
@@ -124,13 +334,43 @@ def read_root():
             "/ask-stream": "POST - Ask questions (streaming)",
             "/ws": "WebSocket - Real-time communication",
             "/visualize/{chart_type}": "GET - Get specific visualizations",
+            "/results/{handle}": "GET - Page through a large result",
+            "/export": "POST - Download a question's result as CSV or Parquet",
+            "/export/{handle}": "GET - Download a stored result as CSV or Parquet (resumable)",
             "/demo": "GET - Demo frontend",
-            "/health": "GET - Health check"
+            "/health": "GET - Health check",
+            "/metrics": "GET - Prometheus metrics",
+            "/profiles": "GET - Stored request profiles (admin)"
         },
         "chart_types": ["line", "bar", "pie", "scatter", "table"]
     }
 
 @app.get("/health")
 def health_check():
-    """Health check endpoint"""
-    return {"status": "healthy", "timestamp": "2025-01-23T15:06:38Z"}
+    """Readiness check: 503 until warm-up has finished or if the database is unreachable"""
+    body = {
+        "status": "healthy",
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "version": settings.API_VERSION,
+        "warmup": getattr(app.state, "warmup", None),
+        "generation": current_generation(),
+    }
+
+    if not getattr(app.state, "ready", False):
+        body["status"] = "starting"
+        return JSONResponse(status_code=503, content=body)
+
+    try:
+        pool.ping()
+    except Exception as e:
+        body["status"] = "unhealthy"
+        body["error"] = f"Database unavailable: {e}"
+        return JSONResponse(status_code=503, content=body)
+
+    return body
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Per-stage pipeline metrics in Prometheus text format"""
+    return PlainTextResponse(metrics_registry.render(), media_type=metrics_registry.CONTENT_TYPE)
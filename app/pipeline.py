@@ -0,0 +1,203 @@
+"""
+Question pipeline shared by /ask, /visualize, /export and the streaming endpoints
+
+A question passes through the stages llm (generate SQL), clean (strip
+markdown fences), execute and visualize; streamed questions also get an
+estimate stage. QueryPipeline runs them over a
+QueryContext, times each one and calls the hooks registered for a stage
+before it runs, after it completes and when it fails. A failed stage raises
+PipelineError naming the stage; admission rejections pass through unchanged.
+
+run() answers synchronously. stream() reports each stage as it starts,
+hands out a sampled estimate while an aggregate query is still running,
+then the result as soon as the query returns, rendering the chart in a
+worker thread meanwhile, so the rows reach the client before the chart.
+"""
+import asyncio
+import json
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+from app.db import execute_sql_query
+from app.llm_interface import ask_llm, clean_sql
+from app.visualization import visualizer
+from src.services.admission import AdmissionRejected
+from src.services.approximate import Estimate, estimate_query
+from src.services.cache import cache
+from src.services.metrics import PIPELINE_STAGE
+from src.services.results import result_metadata
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("llm", "clean", "estimate", "execute", "visualize")
+HOOK_EVENTS = ("before", "after", "error")
+
+class PipelineError(Exception):
+    """A pipeline stage raised; the original exception is the cause"""
+
+    def __init__(self, stage: str, error: Exception):
+        super().__init__(str(error))
+        self.stage = stage
+        self.error = error
+
+class QueryContext:
+    """One question and everything the stages produced for it"""
+
+    def __init__(self, question: str, chart_type: Optional[str] = None, include_visualization: bool = True):
+        self.question = question
+        self.chart_type = chart_type
+        self.include_visualization = include_visualization
+        self.raw_sql: Optional[str] = None
+        self.sql_query: Optional[str] = None
+        # Rows (QueryRows) or an error message from execution
+        self.answer: Any = None
+        # Sampled estimate of an aggregate answer, from stream() only
+        self.estimate: Optional[Estimate] = None
+        self.visualization: Optional[Dict[str, Any]] = None
+        self.error: Optional[Exception] = None
+        self.timings: Dict[str, float] = {}
+
+    @property
+    def has_rows(self) -> bool:
+        return isinstance(self.answer, list) and len(self.answer) > 0
+
+    @property
+    def wants_visualization(self) -> bool:
+        return self.include_visualization and self.has_rows
+
+    def response(self, rows_key: str = "answer", visualization: bool = True) -> Dict[str, Any]:
+        response = {"question": self.question, "sql_query": self.sql_query, rows_key: self.answer}
+        if visualization:
+            response["visualization"] = self.visualization
+        response.update(result_metadata(self.answer))
+        return response
+
+Hook = Callable[[str, QueryContext], None]
+
+class QueryPipeline:
+    """The question stages with per-stage hooks"""
+
+    def __init__(self):
+        self._hooks: Dict[str, Dict[str, List[Hook]]] = {event: {stage: [] for stage in STAGES} for event in HOOK_EVENTS}
+
+    def add_hook(self, event: str, stage: str, hook: Hook) -> None:
+        """Call ``hook(stage, context)`` before a stage runs, after it completes or when it fails"""
+        if event not in HOOK_EVENTS or stage not in STAGES:
+            raise ValueError(f"Unknown hook {event}/{stage}; events are {HOOK_EVENTS}, stages {STAGES}")
+        self._hooks[event][stage].append(hook)
+
+    def remove_hook(self, event: str, stage: str, hook: Hook) -> None:
+        self._hooks[event][stage].remove(hook)
+
+    def _call_hooks(self, event: str, stage: str, context: QueryContext) -> None:
+        for hook in self._hooks[event][stage]:
+            hook(stage, context)
+
+    @contextmanager
+    def _stage(self, stage: str, context: QueryContext) -> Iterator[None]:
+        self._call_hooks("before", stage, context)
+        start = time.perf_counter()
+        try:
+            yield
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            context.timings[stage] = time.perf_counter() - start
+            context.error = e
+            self._call_hooks("error", stage, context)
+            raise PipelineError(stage, e) from e
+        elapsed = context.timings[stage] = time.perf_counter() - start
+        PIPELINE_STAGE.observe(elapsed, stage=stage)
+        self._call_hooks("after", stage, context)
+
+    def generate_sql(self, context: QueryContext) -> None:
+        with self._stage("llm", context):
+            context.raw_sql = ask_llm(context.question)
+        with self._stage("clean", context):
+            context.sql_query = clean_sql(context.raw_sql)
+
+    def estimate(self, context: QueryContext) -> None:
+        # None when the query or its tables do not qualify; the exact answer follows either way
+        with self._stage("estimate", context):
+            context.estimate = estimate_query(context.sql_query)
+
+    def execute(self, context: QueryContext) -> None:
+        # SQL errors come back as the answer text rather than failing the stage
+        with self._stage("execute", context):
+            generation = cache.generation()
+            answer = cache.get("results", context.sql_query)
+            if answer is None:
+                answer = execute_sql_query(context.sql_query)
+                # Complete results only; spilled ones are served from their spill file
+                if isinstance(answer, list) and not result_metadata(answer):
+                    cache.set("results", context.sql_query, answer, generation)
+            context.answer = answer
+
+    def visualize(self, context: QueryContext) -> None:
+        if not context.wants_visualization:
+            return
+        with self._stage("visualize", context):
+            # The chart follows from the rows (the SQL on this generation), the question and the chart type
+            key = json.dumps([context.sql_query, context.question, context.chart_type])
+            generation = cache.generation()
+            visualization = cache.get("charts", key)
+            if visualization is None:
+                visualization = visualizer.generate_visualization(context.answer, context.question, context.chart_type)
+                cache.set("charts", key, visualization, generation)
+            context.visualization = visualization
+
+    def run(self, context: QueryContext) -> QueryContext:
+        """Run every stage in order"""
+        self.generate_sql(context)
+        self.execute(context)
+        self.visualize(context)
+        return context
+
+    async def stream(self, context: QueryContext) -> AsyncIterator[str]:
+        """
+        Run the stages from a coroutine, yielding each stage name ("llm",
+        "execute", "visualize") as it starts, "estimate" if a sampled
+        estimate is ready before the exact answer, then "result" once the
+        answer is ready and "visualization" once the chart is. The chart
+        renders while the caller handles "result". Blocking stages run in
+        worker threads, which carry the request's admission priority.
+        """
+        yield "llm"
+        await asyncio.to_thread(self.generate_sql, context)
+        yield "execute"
+        exact = asyncio.ensure_future(asyncio.to_thread(self.execute, context))
+        estimate = asyncio.ensure_future(asyncio.to_thread(self.estimate, context))
+        try:
+            done, _ = await asyncio.wait({exact, estimate}, return_when=asyncio.FIRST_COMPLETED)
+            # Once the exact answer is in, a pending estimate is no longer wanted
+            if exact not in done:
+                try:
+                    estimate.result()
+                except PipelineError as e:
+                    logger.warning(f"Estimate failed, waiting for the exact answer: {e}")
+                if context.estimate is not None and not exact.done():
+                    yield "estimate"
+            await exact
+        finally:
+            for task in (exact, estimate):
+                if not task.done():
+                    task.cancel()
+        if not context.wants_visualization:
+            yield "result"
+            return
+
+        render = asyncio.ensure_future(asyncio.to_thread(self.visualize, context))
+        try:
+            yield "visualize"
+            yield "result"
+            await render
+            yield "visualization"
+        finally:
+            if not render.done():
+                # The caller went away; the render thread finishes on its own
+                render.cancel()
+
+# Global query pipeline instance
+pipeline = QueryPipeline()
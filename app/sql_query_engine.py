@@ -1,17 +1,22 @@
 import sqlite3
 
+from src.services.metrics import QUERY_ERRORS, QUERY_LATENCY, QUERY_ROWS
+
 DB_PATH = "db/ecommerce.db"
 
 def execute_sql(sql: str):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute(sql)
-        rows = cursor.fetchall()
-        columns = [description[0] for description in cursor.description]
-        conn.close()
+        with QUERY_LATENCY.time(source="engine"):
+            conn = sqlite3.connect(DB_PATH)
+            cursor = conn.cursor()
+            cursor.execute(sql)
+            rows = cursor.fetchall()
+            columns = [description[0] for description in cursor.description]
+            conn.close()
+        QUERY_ROWS.observe(len(rows), source="engine")
 
         result = [dict(zip(columns, row)) for row in rows]
         return result if result else "No data found."
     except Exception as e:
+        QUERY_ERRORS.inc(source="engine")
         return f"SQL Execution Error: {e}"
@@ -4,79 +4,33 @@ from typing import AsyncGenerator, Dict, Any, List
 from datetime import datetime
 import uuid
 
+from app.pipeline import PipelineError, QueryContext, pipeline
+from config.settings import settings
+from src.services.admission import AdmissionRejected
+from src.services.metrics import STREAM_EVENTS
+from src.services.results import result_metadata, result_store, to_records
+
+# Progress event sent as each pipeline stage starts
+STAGE_PROGRESS = {
+    "llm": ("generating_sql", "Converting to SQL query...", 25),
+    "execute": ("executing_query", "Executing database query...", 75),
+    "visualize": ("generating_visualization", "Creating visualization...", 90),
+}
+
 class StreamingService:
     """Handles event streaming for real-time interaction simulation"""
     
     def __init__(self):
         self.active_connections = {}
     
-    async def simulate_processing_steps(self, question: str, session_id: str) -> AsyncGenerator[Dict[str, Any], None]:
-        """Simulate real-time processing steps for a question"""
-        
-        # Step 1: Question received
-        yield {
-            "event": "question_received",
-            "session_id": session_id,
-            "timestamp": datetime.utcnow().isoformat(),
-            "data": {
-                "question": question,
-                "status": "processing"
-            }
-        }
-        
-        await asyncio.sleep(0.5)  # Simulate processing time
-        
-        # Step 2: Analyzing question
-        yield {
-            "event": "analyzing_question",
-            "session_id": session_id,
-            "timestamp": datetime.utcnow().isoformat(),
-            "data": {
-                "message": "Analyzing your question...",
-                "progress": 25
-            }
-        }
-        
-        await asyncio.sleep(0.8)
-        
-        # Step 3: Generating SQL
-        yield {
-            "event": "generating_sql",
-            "session_id": session_id,
-            "timestamp": datetime.utcnow().isoformat(),
-            "data": {
-                "message": "Converting to SQL query...",
-                "progress": 50
-            }
-        }
-        
-        await asyncio.sleep(0.6)
-        
-        # Step 4: Executing query
-        yield {
-            "event": "executing_query",
-            "session_id": session_id,
-            "timestamp": datetime.utcnow().isoformat(),
-            "data": {
-                "message": "Executing database query...",
-                "progress": 75
-            }
-        }
-        
-        await asyncio.sleep(0.4)
-        
-        # Step 5: Generating visualization
-        yield {
-            "event": "generating_visualization",
+    def _event(self, event: str, session_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        STREAM_EVENTS.inc(event=event)
+        return {
+            "event": event,
             "session_id": session_id,
             "timestamp": datetime.utcnow().isoformat(),
-            "data": {
-                "message": "Creating visualization...",
-                "progress": 90
-            }
+            "data": data
         }
-        
-        await asyncio.sleep(0.3)
     
     async def stream_response_chunks(self, response_data: Dict[str, Any], session_id: str) -> AsyncGenerator[Dict[str, Any], None]:
         """Stream response data in chunks for realistic typing effect"""
@@ -113,62 +67,91 @@ class StreamingService:
                 }
                 await asyncio.sleep(0.05)
     
+    async def stream_spilled_rows(self, response_data: Dict[str, Any], session_id: str) -> AsyncGenerator[Dict[str, Any], None]:
+        """Stream the rows of a spilled result that did not fit in the inline answer"""
+        handle = response_data.get("result_handle")
+        result = result_store.open(handle) if handle else None
+        if result is None:
+            return
+        
+        offset = len(response_data.get("answer") or [])
+        while offset < result.total_rows:
+            rows = await asyncio.to_thread(result.page, offset, settings.RESULT_PAGE_SIZE)
+            if not rows:
+                break
+            yield {
+                "event": "result_rows",
+                "session_id": session_id,
+                "timestamp": datetime.utcnow().isoformat(),
+                "data": {
+                    "offset": offset,
+                    "answer": to_records(result.columns, rows),
+                    "complete": offset + len(rows) >= result.total_rows
+                }
+            }
+            offset += len(rows)
+    
     async def stream_complete_response(self, question: str) -> AsyncGenerator[Dict[str, Any], None]:
-        """Complete streaming response simulation"""
+        """
+        Stream a question through the pipeline: progress as each stage starts,
+        a sampled estimate with error bounds while an aggregate query runs,
+        the result (and any spilled rows) as soon as the query returns, then
+        the chart once it has rendered, then a summary with stage timings
+        """
         session_id = str(uuid.uuid4())
-        
-        # Simulate processing steps
-        async for step_event in self.simulate_processing_steps(question, session_id):
-            yield step_event
-        
-        # Import here to avoid circular imports
-        from app.llm_interface import ask_llm
-        from app.db import execute_sql_query
-        from app.visualization import visualizer
+        context = QueryContext(question)
+        yield self._event("question_received", session_id, {"question": question, "status": "processing"})
         
         try:
-            # Get LLM response
-            raw_sql = ask_llm(question)
-            sql_query = raw_sql.replace("```sql", "").replace("```", "").strip()
-            
-            # Execute query
-            query_result = execute_sql_query(sql_query)
+            async for stage in pipeline.stream(context):
+                if stage in STAGE_PROGRESS:
+                    event, message, progress = STAGE_PROGRESS[stage]
+                    yield self._event(event, session_id, {"message": message, "progress": progress})
+                elif stage == "estimate":
+                    yield self._event("estimate", session_id, {
+                        "question": question,
+                        "sql_query": context.sql_query,
+                        **context.estimate.to_dict()
+                    })
+                elif stage == "result":
+                    result = context.response(visualization=False)
+                    yield self._event("query_result", session_id, result)
+                    # Rows past the inline cap follow page by page from the spill file
+                    async for rows_event in self.stream_spilled_rows(result, session_id):
+                        STREAM_EVENTS.inc(event=rows_event["event"])
+                        yield rows_event
+                elif stage == "visualization":
+                    yield self._event("visualization", session_id, {"visualization": context.visualization})
             
-            # Generate visualization if data is suitable
-            visualization = None
-            if isinstance(query_result, list) and len(query_result) > 0:
-                visualization = visualizer.generate_visualization(query_result, question)
-            
-            # Final response
-            final_response = {
+            yield self._event("response_complete", session_id, {
                 "question": question,
-                "sql_query": sql_query,
-                "answer": query_result,
-                "visualization": visualization
-            }
-            
-            # Stream the final response
-            yield {
-                "event": "response_complete",
-                "session_id": session_id,
-                "timestamp": datetime.utcnow().isoformat(),
-                "data": final_response
-            }
+                "sql_query": context.sql_query,
+                "timings": {stage: round(seconds, 4) for stage, seconds in context.timings.items()},
+                **result_metadata(context.answer)
+            })
             
             # Stream response chunks for typing effect
-            async for chunk_event in self.stream_response_chunks(final_response, session_id):
+            async for chunk_event in self.stream_response_chunks(context.response(), session_id):
+                STREAM_EVENTS.inc(event=chunk_event["event"])
                 yield chunk_event
                 
+        except AdmissionRejected as e:
+            yield self._event("error", session_id, {
+                "error": str(e),
+                "message": "The server is busy; please retry shortly",
+                "retry_after": e.retry_after
+            })
+        except PipelineError as e:
+            yield self._event("error", session_id, {
+                "error": str(e),
+                "stage": e.stage,
+                "message": "An error occurred while processing your request"
+            })
         except Exception as e:
-            yield {
-                "event": "error",
-                "session_id": session_id,
-                "timestamp": datetime.utcnow().isoformat(),
-                "data": {
-                    "error": str(e),
-                    "message": "An error occurred while processing your request"
-                }
-            }
+            yield self._event("error", session_id, {
+                "error": str(e),
+                "message": "An error occurred while processing your request"
+            })
     
     def add_connection(self, connection_id: str, websocket):
         """Add a WebSocket connection"""
@@ -1,26 +1,156 @@
-import matplotlib.pyplot as plt
-import plotly.graph_objects as go
-import plotly.express as px
-import pandas as pd
-import seaborn as sns
 import io
 import base64
+import threading
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 import json
 
-# Set matplotlib backend for server environments
-plt.switch_backend('Agg')
+from src.services.admission import admission
+from src.services.metrics import CHART_RENDER, DATAFRAME_BUILD
+from src.services.profiling import profile_stage
+
+# Chart libraries (matplotlib, seaborn, plotly, pandas) are imported on first
+# use rather than at module import so that importing app.main stays cheap.
+_matplotlib_lock = threading.Lock()
+_pyplot = None
+
+def _get_pyplot():
+    """Import matplotlib/seaborn on first use and apply the server-side styles"""
+    global _pyplot
+    if _pyplot is None:
+        with _matplotlib_lock:
+            if _pyplot is None:
+                import matplotlib
+                # Set matplotlib backend for server environments
+                matplotlib.use('Agg')
+                import matplotlib.pyplot as plt
+                import seaborn as sns
+
+                # Set seaborn style for better-looking plots
+                sns.set_style("whitegrid")
+                plt.style.use('seaborn-v0_8')
+                _pyplot = plt
+    return _pyplot
+
+def _to_dataframe(data: List[Dict]):
+    """Build a DataFrame from query rows, recording the build time"""
+    import pandas as pd
+
+    with DATAFRAME_BUILD.time(source="visualization"):
+        return pd.DataFrame(data)
+
+class ColumnProfile:
+    """Type, cardinality and range of one result column"""
+
+    def __init__(self, name: str, dtype: str, is_numeric: bool, is_text: bool, is_date: bool,
+                 cardinality: int, null_count: int, minimum: Any = None, maximum: Any = None):
+        self.name = name
+        self.dtype = dtype
+        self.is_numeric = is_numeric
+        self.is_text = is_text
+        self.is_date = is_date
+        self.cardinality = cardinality
+        self.null_count = null_count
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+class DataProfile:
+    """
+    Column profile of one query result, computed in a single vectorized pass
+    and shared by chart selection and every renderer so the result is only
+    ever converted to a DataFrame once.
+    """
+
+    # Share of sampled text values that must parse as dates for a column to count as one
+    DATE_SAMPLE_SIZE = 50
+    DATE_PARSE_THRESHOLD = 0.9
+    # ISO8601 parsing alone also accepts bare years, so codes like "2024" would count as dates
+    DATE_PATTERN = r"^\d{4}-\d{2}-\d{2}"
+
+    def __init__(self, df, columns: List[ColumnProfile]):
+        self.df = df
+        self.columns = columns
+        self.row_count = len(df)
+
+    @property
+    def numeric_columns(self) -> List[str]:
+        return [c.name for c in self.columns if c.is_numeric]
+
+    @property
+    def text_columns(self) -> List[str]:
+        return [c.name for c in self.columns if c.is_text]
+
+    @property
+    def date_columns(self) -> List[str]:
+        return [c.name for c in self.columns if c.is_date]
+
+    @property
+    def column_names(self) -> List[str]:
+        return [c.name for c in self.columns]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"row_count": self.row_count, "columns": [c.to_dict() for c in self.columns]}
+
+def profile_data(data) -> DataProfile:
+    """
+    Profile query rows in one pass: a DataFrame, QueryRows carrying the
+    DataFrame they were built from, or plain records (converted here)
+    """
+    import pandas as pd
+    from pandas.api.types import is_bool_dtype, is_numeric_dtype, is_object_dtype, is_string_dtype
+
+    if isinstance(data, pd.DataFrame):
+        df = data
+    elif getattr(data, "frame", None) is not None:
+        df = data.frame
+    else:
+        df = _to_dataframe(data)
+
+    numeric = [c for c in df.columns if is_numeric_dtype(df[c]) and not is_bool_dtype(df[c])]
+    cardinality = df.nunique(dropna=True)
+    nulls = df.isna().sum()
+    bounds = df[numeric].agg(["min", "max"]) if numeric and len(df) else None
+
+    columns = []
+    for name in df.columns:
+        series = df[name]
+        is_text = is_object_dtype(series) or is_string_dtype(series)
+        is_date = "date" in str(name).lower()
+        minimum = maximum = None
+
+        if name in numeric and bounds is not None:
+            minimum, maximum = bounds.at["min", name], bounds.at["max", name]
+        elif is_text:
+            sample = series.dropna().head(DataProfile.DATE_SAMPLE_SIZE)
+            text = sample.astype(str)
+            parsed = pd.to_datetime(text.where(text.str.match(DataProfile.DATE_PATTERN)), errors="coerce", format="ISO8601")
+            if len(sample) and parsed.notna().mean() >= DataProfile.DATE_PARSE_THRESHOLD:
+                is_date = True
+            if is_date:
+                dates = pd.to_datetime(series, errors="coerce", format="ISO8601")
+                if dates.notna().any():
+                    minimum, maximum = dates.min().isoformat(), dates.max().isoformat()
+
+        columns.append(ColumnProfile(
+            name=name,
+            dtype=str(series.dtype),
+            is_numeric=name in numeric,
+            is_text=is_text,
+            is_date=is_date,
+            cardinality=int(cardinality[name]),
+            null_count=int(nulls[name]),
+            minimum=minimum.item() if hasattr(minimum, "item") else minimum,
+            maximum=maximum.item() if hasattr(maximum, "item") else maximum,
+        ))
+    return DataProfile(df, columns)
 
 class VisualizationGenerator:
     """Handles generation of various types of visualizations for ecommerce data"""
     
-    def __init__(self):
-        # Set seaborn style for better-looking plots
-        sns.set_style("whitegrid")
-        plt.style.use('seaborn-v0_8')
-    
-    def determine_chart_type(self, data: List[Dict], query: str) -> str:
+    def determine_chart_type(self, data: List[Dict], query: str, profile: Optional[DataProfile] = None) -> str:
         """Intelligently determine the best chart type based on data and query"""
         query_lower = query.lower()
         
@@ -28,9 +158,9 @@ class VisualizationGenerator:
             return "none"
         
         # Analyze data structure
-        columns = list(data[0].keys())
-        has_date = any('date' in col.lower() for col in columns)
-        has_numeric = any(isinstance(data[0].get(col), (int, float)) for col in columns)
+        profile = profile or profile_data(data)
+        has_date = bool(profile.date_columns)
+        has_numeric = bool(profile.numeric_columns)
         
         # Chart type logic
         if 'trend' in query_lower or 'over time' in query_lower or has_date:
@@ -46,15 +176,25 @@ class VisualizationGenerator:
         else:
             return "table"
     
-    def generate_line_chart(self, data: List[Dict], title: str = "Line Chart") -> str:
+    def _category_and_value(self, profile: DataProfile):
+        """First text column and first numeric column, falling back to the first/last columns"""
+        names = profile.column_names
+        categorical_col = profile.text_columns[0] if profile.text_columns else names[0]
+        numeric_col = profile.numeric_columns[0] if profile.numeric_columns else names[-1]
+        return categorical_col, numeric_col
+    
+    def generate_line_chart(self, data: List[Dict], title: str = "Line Chart", profile: Optional[DataProfile] = None) -> str:
         """Generate a line chart for time series data"""
-        df = pd.DataFrame(data)
+        import plotly.graph_objects as go
+
+        profile = profile or profile_data(data)
+        df = profile.df
         
         fig = go.Figure()
         
         # Find date and numeric columns
-        date_col = next((col for col in df.columns if 'date' in col.lower()), df.columns[0])
-        numeric_cols = df.select_dtypes(include=['number']).columns
+        date_col = profile.date_columns[0] if profile.date_columns else profile.column_names[0]
+        numeric_cols = profile.numeric_columns
         
         for col in numeric_cols:
             fig.add_trace(go.Scatter(
@@ -75,16 +215,17 @@ class VisualizationGenerator:
         
         return fig.to_html(include_plotlyjs='cdn')
     
-    def generate_bar_chart(self, data: List[Dict], title: str = "Bar Chart") -> str:
+    def generate_bar_chart(self, data: List[Dict], title: str = "Bar Chart", profile: Optional[DataProfile] = None) -> str:
         """Generate a bar chart for categorical data"""
-        df = pd.DataFrame(data)
+        import plotly.express as px
+
+        profile = profile or profile_data(data)
         
         # Find categorical and numeric columns
-        categorical_col = df.select_dtypes(include=['object']).columns[0] if len(df.select_dtypes(include=['object']).columns) > 0 else df.columns[0]
-        numeric_col = df.select_dtypes(include=['number']).columns[0] if len(df.select_dtypes(include=['number']).columns) > 0 else df.columns[-1]
+        categorical_col, numeric_col = self._category_and_value(profile)
         
         fig = px.bar(
-            df, 
+            profile.df, 
             x=categorical_col, 
             y=numeric_col,
             title=title,
@@ -95,16 +236,17 @@ class VisualizationGenerator:
         fig.update_layout(template='plotly_white')
         return fig.to_html(include_plotlyjs='cdn')
     
-    def generate_pie_chart(self, data: List[Dict], title: str = "Pie Chart") -> str:
+    def generate_pie_chart(self, data: List[Dict], title: str = "Pie Chart", profile: Optional[DataProfile] = None) -> str:
         """Generate a pie chart for distribution data"""
-        df = pd.DataFrame(data)
+        import plotly.express as px
+
+        profile = profile or profile_data(data)
         
         # Find categorical and numeric columns
-        categorical_col = df.select_dtypes(include=['object']).columns[0] if len(df.select_dtypes(include=['object']).columns) > 0 else df.columns[0]
-        numeric_col = df.select_dtypes(include=['number']).columns[0] if len(df.select_dtypes(include=['number']).columns) > 0 else df.columns[-1]
+        categorical_col, numeric_col = self._category_and_value(profile)
         
         fig = px.pie(
-            df, 
+            profile.df, 
             values=numeric_col, 
             names=categorical_col,
             title=title
@@ -113,10 +255,13 @@ class VisualizationGenerator:
         fig.update_layout(template='plotly_white')
         return fig.to_html(include_plotlyjs='cdn')
     
-    def generate_scatter_plot(self, data: List[Dict], title: str = "Scatter Plot") -> str:
+    def generate_scatter_plot(self, data: List[Dict], title: str = "Scatter Plot", profile: Optional[DataProfile] = None) -> str:
         """Generate a scatter plot for correlation analysis"""
-        df = pd.DataFrame(data)
-        numeric_cols = df.select_dtypes(include=['number']).columns
+        import plotly.express as px
+
+        profile = profile or profile_data(data)
+        df = profile.df
+        numeric_cols = profile.numeric_columns
         
         if len(numeric_cols) >= 2:
             fig = px.scatter(
@@ -138,9 +283,10 @@ class VisualizationGenerator:
         fig.update_layout(template='plotly_white')
         return fig.to_html(include_plotlyjs='cdn')
     
-    def generate_matplotlib_chart(self, data: List[Dict], chart_type: str = "bar") -> str:
+    def generate_matplotlib_chart(self, data: List[Dict], chart_type: str = "bar", profile: Optional[DataProfile] = None) -> str:
         """Generate matplotlib chart and return as base64 encoded image"""
-        df = pd.DataFrame(data)
+        plt = _get_pyplot()
+        df = (profile or profile_data(data)).df
         
         plt.figure(figsize=(10, 6))
         
@@ -168,37 +314,47 @@ class VisualizationGenerator:
         image_base64 = base64.b64encode(buf.read()).decode('utf-8')
         return f"data:image/png;base64,{image_base64}"
     
-    def generate_visualization(self, data: List[Dict], query: str, chart_type: Optional[str] = None) -> Dict[str, Any]:
+    def generate_visualization(self, data: List[Dict], query: str, chart_type: Optional[str] = None,
+                               profile: Optional[DataProfile] = None) -> Dict[str, Any]:
         """Main method to generate appropriate visualization"""
         if not data:
             return {"type": "none", "content": "No data to visualize", "message": "No results found"}
         
-        # Determine chart type
-        determined_type = chart_type or self.determine_chart_type(data, query)
-        
-        try:
-            if determined_type == "line":
-                html_content = self.generate_line_chart(data, f"Analysis: {query}")
-                return {"type": "line", "content": html_content, "format": "html"}
-            elif determined_type == "bar":
-                html_content = self.generate_bar_chart(data, f"Analysis: {query}")
-                return {"type": "bar", "content": html_content, "format": "html"}
-            elif determined_type == "pie":
-                html_content = self.generate_pie_chart(data, f"Distribution: {query}")
-                return {"type": "pie", "content": html_content, "format": "html"}
-            elif determined_type == "scatter":
-                html_content = self.generate_scatter_plot(data, f"Correlation: {query}")
-                return {"type": "scatter", "content": html_content, "format": "html"}
-            else:
-                # Return table format
-                return {"type": "table", "content": data, "format": "json"}
-        except Exception as e:
-            # Fallback to matplotlib
+        with admission.stage("render"):
+            determined_type = chart_type
             try:
-                image_b64 = self.generate_matplotlib_chart(data, "bar")
-                return {"type": "image", "content": image_b64, "format": "base64"}
-            except:
-                return {"type": "table", "content": data, "format": "json", "error": str(e)}
+                # Determine chart type; one profiling pass drives both chart selection and the renderer
+                if chart_type is None or chart_type in ("line", "bar", "pie", "scatter"):
+                    profile = profile or profile_data(data)
+                determined_type = chart_type or self.determine_chart_type(data, query, profile)
+            
+                # Unknown chart types render as a table; keep them out of the metric labels
+                render_label = determined_type if determined_type in ("line", "bar", "pie", "scatter") else "table"
+            
+                with profile_stage("visualization"), CHART_RENDER.time(chart_type=render_label):
+                    if determined_type == "line":
+                        html_content = self.generate_line_chart(data, f"Analysis: {query}", profile)
+                        return {"type": "line", "content": html_content, "format": "html"}
+                    elif determined_type == "bar":
+                        html_content = self.generate_bar_chart(data, f"Analysis: {query}", profile)
+                        return {"type": "bar", "content": html_content, "format": "html"}
+                    elif determined_type == "pie":
+                        html_content = self.generate_pie_chart(data, f"Distribution: {query}", profile)
+                        return {"type": "pie", "content": html_content, "format": "html"}
+                    elif determined_type == "scatter":
+                        html_content = self.generate_scatter_plot(data, f"Correlation: {query}", profile)
+                        return {"type": "scatter", "content": html_content, "format": "html"}
+                    else:
+                        # Return table format
+                        return {"type": "table", "content": data, "format": "json"}
+            except Exception as e:
+                # Fallback to matplotlib
+                try:
+                    with profile_stage("visualization_fallback"), CHART_RENDER.time(chart_type="matplotlib"):
+                        image_b64 = self.generate_matplotlib_chart(data, "bar", profile)
+                    return {"type": "image", "content": image_b64, "format": "base64"}
+                except:
+                    return {"type": "table", "content": data, "format": "json", "error": str(e)}
 
 # Global instance
 visualizer = VisualizationGenerator()
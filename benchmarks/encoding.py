@@ -0,0 +1,94 @@
+"""
+Response encoding benchmark
+
+Encodes /ask-shaped payloads built from ad_sales_metrics at several result
+sizes in every format from app.encoding, plus the current default path
+(FastAPI's jsonable_encoder followed by json.dumps), and reports encoded
+bytes, gzip-compressed bytes and median encode time.
+
+Usage:
+    python -m benchmarks.encoding --rows 100,1000,10000 --output encoding.json
+"""
+import argparse
+import gzip
+import json
+import sqlite3
+import statistics
+import time
+from typing import Any, Callable, Dict, List
+
+from config.settings import settings
+
+def load_records(rows: int) -> List[Dict[str, Any]]:
+    """Fetch ``rows`` records from ad_sales_metrics, repeating the table if it is smaller"""
+    import pandas as pd
+
+    with sqlite3.connect(settings.DB_PATH) as conn:
+        (table_rows,) = conn.execute("SELECT COUNT(*) FROM ad_sales_metrics").fetchone()
+        copies = max(1, -(-rows // table_rows))
+        repeat = " UNION ALL ".join(f"SELECT {i} AS copy" for i in range(copies))
+        df = pd.read_sql_query(f"SELECT a.* FROM ad_sales_metrics a, ({repeat}) LIMIT {rows}", conn)
+    return df.to_dict(orient="records")
+
+def encoders() -> Dict[str, Callable[[Dict[str, Any]], bytes]]:
+    from fastapi.encoders import jsonable_encoder
+    from app.encoding import FORMATS, encode_payload
+
+    # What a plain dict return from the endpoint costs today
+    result = {"current": lambda payload: json.dumps(jsonable_encoder(payload)).encode("utf-8")}
+    for fmt in FORMATS:
+        result[fmt] = lambda payload, fmt=fmt: encode_payload(payload, fmt)
+    return result
+
+def run_benchmark(sizes: List[int], repeats: int) -> Dict[str, Any]:
+    results: Dict[str, Any] = {"repeats": repeats, "sizes": []}
+    available = encoders()
+    for size in sizes:
+        records = load_records(size)
+        payload = {"question": "benchmark", "sql_query": "SELECT * FROM ad_sales_metrics",
+                   "answer": records, "visualization": None}
+        entry = {"rows": len(records), "formats": {}}
+        for name, encode in available.items():
+            try:
+                timings = []
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    body = encode(payload)
+                    timings.append(time.perf_counter() - start)
+            except Exception as e:
+                entry["formats"][name] = {"error": str(e)}
+                continue
+            entry["formats"][name] = {
+                "bytes": len(body),
+                "gzip_bytes": len(gzip.compress(body, compresslevel=6)),
+                "encode_ms": statistics.median(timings) * 1000,
+            }
+        results["sizes"].append(entry)
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare response encodings by size and encode time")
+    parser.add_argument("--rows", default="100,1000,10000", help="Comma-separated result sizes")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = run_benchmark([int(r) for r in args.rows.split(",")], args.repeats)
+    for entry in results["sizes"]:
+        current = entry["formats"]["current"]
+        print(f"\n{entry['rows']} rows")
+        for name, stats in entry["formats"].items():
+            if "error" in stats:
+                print(f"  {name:10s} unavailable: {stats['error']}")
+                continue
+            print(f"  {name:10s} {stats['bytes']:>11,d} B ({stats['bytes'] / current['bytes']:5.0%})  "
+                  f"gzip {stats['gzip_bytes']:>10,d} B  encode {stats['encode_ms']:8.2f} ms "
+                  f"({current['encode_ms'] / stats['encode_ms']:5.1f}x)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Analytical engine benchmark: SQLite vs DuckDB over Parquet
+
+Builds scaled copies of the metrics tables (every copy gets its own item_id
+range, so per-item groups grow with the scale) and times the typical RoAS,
+CPC and total-sales queries through each DatabaseBackend, checking that both
+engines return the same answer.
+
+Usage:
+    python -m benchmarks.engines --scales 1,100,1000 --output engines.json
+"""
+import argparse
+import json
+import math
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from config.settings import settings
+from src.services.database import DuckDBBackend, SQLiteBackend, export_to_parquet, normalize_sql
+
+TABLES = ["ad_sales_metrics", "total_sales_metrics"]
+
+# Each copy of the data is shifted into its own item_id range
+ITEM_ID_STRIDE = 100000
+
+QUERIES = {
+    "roas": "SELECT SUM(ad_sales) / SUM(ad_spend) AS roas FROM ad_sales_metrics",
+    "cpc_by_item": (
+        "SELECT item_id, SUM(ad_spend) / SUM(clicks) AS cpc FROM ad_sales_metrics "
+        "WHERE clicks > 0 GROUP BY item_id ORDER BY cpc DESC, item_id LIMIT 10"
+    ),
+    "total_sales": "SELECT SUM(total_sales) AS total_sales FROM total_sales_metrics",
+    "daily_sales": "SELECT date, SUM(total_sales) AS total_sales FROM total_sales_metrics GROUP BY date ORDER BY date",
+}
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA src.table_info('{table}')")]
+
+def build_sqlite(source_db: str, target: Path, scale: int) -> None:
+    conn = sqlite3.connect(target)
+    conn.execute("ATTACH DATABASE ? AS src", (source_db,))
+    for table in TABLES:
+        columns = _columns(conn, table)
+        select = ", ".join(f"item_id + c * {ITEM_ID_STRIDE} AS item_id" if c == "item_id" else c for c in columns)
+        conn.execute(f"DROP TABLE IF EXISTS main.{table}")
+        conn.execute(
+            f"CREATE TABLE main.{table} AS "
+            f"WITH RECURSIVE copies(c) AS (SELECT 0 UNION ALL SELECT c + 1 FROM copies WHERE c < {scale - 1}) "
+            f"SELECT {select} FROM src.{table}, copies"
+        )
+    conn.commit()
+    conn.execute("DETACH DATABASE src")
+    conn.close()
+
+def build_parquet(base_dir: Path, target_dir: Path, scale: int) -> None:
+    import duckdb
+
+    target_dir.mkdir(parents=True, exist_ok=True)
+    duck = duckdb.connect()
+    try:
+        for table in TABLES:
+            source = base_dir / f"{table}.parquet"
+            columns = [row[0] for row in duck.execute(f"DESCRIBE SELECT * FROM read_parquet('{source}')").fetchall()]
+            select = ", ".join(f"item_id + c * {ITEM_ID_STRIDE} AS item_id" if c == "item_id" else c for c in columns)
+            duck.execute(
+                f"COPY (SELECT {select} FROM read_parquet('{source}'), range({scale}) t(c)) "
+                f"TO '{target_dir / (table + '.parquet')}' (FORMAT PARQUET)"
+            )
+    finally:
+        duck.close()
+
+def same_rows(left: List[tuple], right: List[tuple]) -> bool:
+    """Compare results with a relative tolerance; the engines sum floats in different orders"""
+    if len(left) != len(right):
+        return False
+    for a_row, b_row in zip(left, right):
+        for a, b in zip(a_row, b_row):
+            if isinstance(a, float) or isinstance(b, float):
+                if not math.isclose(a, b, rel_tol=1e-9):
+                    return False
+            elif str(a) != str(b):
+                return False
+    return True
+
+def time_query(backend, query: str, repeats: int) -> Dict[str, Any]:
+    query = normalize_sql(query, backend.dialect)
+    timings, rows = [], []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        _, rows = backend.execute(query)
+        timings.append(time.perf_counter() - start)
+    return {"median_ms": statistics.median(timings) * 1000, "min_ms": min(timings) * 1000, "rows": rows}
+
+def run_benchmark(scales: List[int], repeats: int, work_dir: Path, source_db: str) -> Dict[str, Any]:
+    base_parquet = work_dir / "base"
+    export_to_parquet(source_db, str(base_parquet), TABLES)
+
+    results: Dict[str, Any] = {"repeats": repeats, "scales": []}
+    for scale in scales:
+        sqlite_path = work_dir / f"scale_{scale}.db"
+        parquet_dir = work_dir / f"scale_{scale}"
+
+        start = time.perf_counter()
+        build_sqlite(source_db, sqlite_path, scale)
+        build_parquet(base_parquet, parquet_dir, scale)
+        build_seconds = time.perf_counter() - start
+
+        backends = {"sqlite": SQLiteBackend(str(sqlite_path)), "duckdb": DuckDBBackend(str(parquet_dir))}
+        (ad_rows,) = backends["sqlite"].execute("SELECT COUNT(*) FROM ad_sales_metrics")[1][0]
+        entry: Dict[str, Any] = {
+            "scale": scale,
+            "ad_sales_rows": ad_rows,
+            "build_seconds": build_seconds,
+            "sqlite_bytes": sqlite_path.stat().st_size,
+            "parquet_bytes": sum(p.stat().st_size for p in parquet_dir.glob("*.parquet")),
+            "queries": {},
+        }
+        for name, query in QUERIES.items():
+            timings = {engine: time_query(backend, query, repeats) for engine, backend in backends.items()}
+            entry["queries"][name] = {
+                "sqlite_ms": timings["sqlite"]["median_ms"],
+                "duckdb_ms": timings["duckdb"]["median_ms"],
+                "speedup": timings["sqlite"]["median_ms"] / timings["duckdb"]["median_ms"],
+                "results_match": same_rows(timings["sqlite"]["rows"], timings["duckdb"]["rows"]),
+            }
+        for backend in backends.values():
+            backend.close()
+        results["scales"].append(entry)
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the SQLite and DuckDB backends at several data scales")
+    parser.add_argument("--scales", default="1,100,1000", help="Comma-separated data multipliers")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--db", default=settings.DB_PATH, help="Source SQLite database")
+    parser.add_argument("--work-dir", help="Keep generated datasets here instead of a temporary directory")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    scales = [int(s) for s in args.scales.split(",")]
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = Path(args.work_dir or tmp)
+        work_dir.mkdir(parents=True, exist_ok=True)
+        results = run_benchmark(scales, args.repeats, work_dir, str(Path(args.db).resolve()))
+
+    for entry in results["scales"]:
+        print(f"\n{entry['scale']}x ({entry['ad_sales_rows']:,d} ad rows; sqlite {entry['sqlite_bytes'] / 1e6:.1f} MB, "
+              f"parquet {entry['parquet_bytes'] / 1e6:.1f} MB)")
+        for name, stats in entry["queries"].items():
+            match = "" if stats["results_match"] else "  RESULTS DIFFER"
+            print(f"  {name:12s} sqlite {stats['sqlite_ms']:9.2f} ms   duckdb {stats['duckdb_ms']:9.2f} ms   "
+                  f"{stats['speedup']:6.1f}x{match}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Local stand-in for the Gemini generateContent API
+
+Answers every request with canned SQL chosen from the question embedded in
+the prompt, after a configurable delay, so benchmarks never hit the network.
+
+Usage:
+    python -m benchmarks.fake_gemini --port 8765 --latency-ms 300 --jitter-ms 50
+    GEMINI_URL=http://127.0.0.1:8765/generateContent uvicorn app.main:app
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Tuple
+
+# (keywords that must all appear in the question, SQL returned in a markdown fence)
+CANNED_SQL: List[Tuple[Tuple[str, ...], str]] = [
+    (("roas",), "SELECT SUM(ad_sales) / SUM(ad_spend) AS roas FROM ad_sales_metrics"),
+    (("cpc",), "SELECT item_id, SUM(ad_spend) / SUM(clicks) AS cpc FROM ad_sales_metrics "
+               "WHERE clicks > 0 GROUP BY item_id ORDER BY cpc DESC LIMIT 1"),
+    (("trend",), "SELECT date, SUM(total_sales) AS total_sales FROM total_sales_metrics GROUP BY date ORDER BY date"),
+    (("ineligible",), "SELECT item_id, message FROM eligibility_table WHERE eligibility = 0 LIMIT 50"),
+    (("compare",), "SELECT item_id, SUM(ad_sales) AS ad_sales FROM ad_sales_metrics "
+                   "GROUP BY item_id ORDER BY ad_sales DESC LIMIT 10"),
+    (("all", "ad"), "SELECT * FROM ad_sales_metrics"),
+    (("total", "sales"), "SELECT SUM(total_sales) AS total_sales FROM total_sales_metrics"),
+]
+DEFAULT_SQL = "SELECT * FROM total_sales_metrics LIMIT 20"
+
+_QUESTION_RE = re.compile(r"Question:\s*(.*)", re.DOTALL)
+
+def sql_for_prompt(prompt: str) -> str:
+    """Pick the canned SQL whose keywords all appear in the prompt's question"""
+    match = _QUESTION_RE.search(prompt)
+    question = (match.group(1) if match else prompt).lower()
+    for keywords, sql in CANNED_SQL:
+        if all(keyword in question for keyword in keywords):
+            return sql
+    return DEFAULT_SQL
+
+class FakeGeminiServer:
+    """Threaded HTTP server that mimics the generateContent response shape"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 latency_ms: float = 300.0, jitter_ms: float = 0.0, error_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1beta/models/fake:generateContent"
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                with server._lock:
+                    server.request_count += 1
+
+                delay = server.latency_ms + random.uniform(-server.jitter_ms, server.jitter_ms)
+                time.sleep(max(delay, 0) / 1000)
+
+                if random.random() < server.error_rate:
+                    body = {"error": {"code": 503, "message": "fake overload"}}
+                    status = 503
+                else:
+                    try:
+                        prompt = payload["contents"][0]["parts"][0]["text"]
+                    except (KeyError, IndexError):
+                        prompt = ""
+                    text = f"```sql\n{sql_for_prompt(prompt)}\n```"
+                    body = {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}]}
+                    status = 200
+
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "FakeGeminiServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a fake Gemini generateContent server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeGeminiServer(args.host, args.port, args.latency_ms, args.jitter_ms, args.error_rate)
+    print(f"Fake Gemini listening on {server.url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+"""
+End-to-end load benchmark for the Ecommerce AI Agent
+
+Starts a fake Gemini server and the application under uvicorn, then drives
+/ask, /ask-stream, /ws and /visualize/{chart_type} at each concurrency level
+and reports throughput, p50/p95/p99 latency per stage and payload sizes.
+
+Stages are "total" for every request plus "first_byte" for HTTP endpoints and
+the arrival time of each event type for the streaming endpoints.
+
+Usage:
+    python -m benchmarks.load --concurrency 1,8,32 --requests 64 --output load.json
+    python -m benchmarks.load --endpoints ask,ws --llm-latency-ms 800 --baseline load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+import websockets
+
+from benchmarks.fake_gemini import FakeGeminiServer
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+QUESTIONS = [
+    "What is my total sales?",
+    "Calculate the RoAS (Return on Ad Spend).",
+    "Which product had the highest CPC (Cost Per Click)?",
+    "Show the sales trend over time",
+    "Compare ad sales for the top items",
+    "Which items are ineligible?",
+]
+
+ENDPOINTS = ["ask", "ask-stream", "ws", "visualize"]
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Linear-interpolated percentile of an unsorted sample list"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class RequestResult:
+    """Outcome of one request: stage timings in seconds and bytes received"""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.bytes = 0
+        self.ok = True
+        self.error: Optional[str] = None
+
+async def _run_ask(client: httpx.AsyncClient, base_url: str, question: str) -> RequestResult:
+    result = RequestResult()
+    start = time.perf_counter()
+    async with client.stream("POST", f"{base_url}/ask", json={"question": question}) as response:
+        async for chunk in response.aiter_bytes():
+            if "first_byte" not in result.stages:
+                result.stages["first_byte"] = time.perf_counter() - start
+            result.bytes += len(chunk)
+        result.ok = response.status_code == 200
+    result.stages["total"] = time.perf_counter() - start
+    return result
+
+async def _run_visualize(client: httpx.AsyncClient, base_url: str, question: str) -> RequestResult:
+    result = RequestResult()
+    start = time.perf_counter()
+    async with client.stream("GET", f"{base_url}/visualize/bar", params={"question": question}) as response:
+        async for chunk in response.aiter_bytes():
+            if "first_byte" not in result.stages:
+                result.stages["first_byte"] = time.perf_counter() - start
+            result.bytes += len(chunk)
+        # 400 means the query returned no rows, which is a valid outcome
+        result.ok = response.status_code in (200, 400)
+    result.stages["total"] = time.perf_counter() - start
+    return result
+
+async def _run_ask_stream(client: httpx.AsyncClient, base_url: str, question: str) -> RequestResult:
+    result = RequestResult()
+    start = time.perf_counter()
+    async with client.stream("POST", f"{base_url}/ask-stream", json={"question": question}) as response:
+        async for line in response.aiter_lines():
+            result.bytes += len(line) + 1
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[len("data: "):]).get("event", "unknown")
+            if "first_byte" not in result.stages:
+                result.stages["first_byte"] = time.perf_counter() - start
+            # Record the first arrival of each event type
+            result.stages.setdefault(event, time.perf_counter() - start)
+            if event == "error":
+                result.ok = False
+        result.ok = result.ok and response.status_code == 200
+    result.stages["total"] = time.perf_counter() - start
+    return result
+
+async def _run_ws(base_url: str, question: str, idle_timeout: float) -> RequestResult:
+    """Send one question over a fresh socket and read events until the stream ends"""
+    result = RequestResult()
+    ws_url = base_url.replace("http://", "ws://") + "/ws"
+    start = time.perf_counter()
+    async with websockets.connect(ws_url, max_size=None) as ws:
+        await ws.send(json.dumps({"type": "question", "question": question}))
+        seen_complete = False
+        text_answer = False
+        while True:
+            try:
+                # After response_complete only short typing-effect chunks follow
+                timeout = idle_timeout if seen_complete else None
+                raw = await asyncio.wait_for(ws.recv(), timeout)
+            except asyncio.TimeoutError:
+                break
+            elapsed = time.perf_counter() - start
+            result.bytes += len(raw)
+            message = json.loads(raw)
+            event = message.get("event", "unknown")
+            data = message.get("data", {})
+            result.stages.setdefault(event, elapsed)
+            result.stages["total"] = elapsed
+            if event == "error":
+                result.ok = False
+                break
+            if event == "query_result":
+                answer = data.get("answer")
+                text_answer = isinstance(answer, str) and bool(answer)
+            if event == "response_complete":
+                seen_complete = True
+            # The stream ends with the last SQL chunk, or the last answer chunk for text answers
+            if data.get("complete") and (event == "answer_chunk" or (event == "sql_chunk" and not text_answer)):
+                break
+    return result
+
+async def run_level(base_url: str, endpoint: str, concurrency: int, total: int,
+                    ws_idle_timeout: float) -> Dict[str, Any]:
+    """Issue ``total`` requests to one endpoint with ``concurrency`` in flight"""
+    results: List[RequestResult] = []
+    counter = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=None, limits=limits) as client:
+        async def worker():
+            for i in counter:
+                question = QUESTIONS[i % len(QUESTIONS)]
+                try:
+                    if endpoint == "ask":
+                        results.append(await _run_ask(client, base_url, question))
+                    elif endpoint == "visualize":
+                        results.append(await _run_visualize(client, base_url, question))
+                    elif endpoint == "ask-stream":
+                        results.append(await _run_ask_stream(client, base_url, question))
+                    else:
+                        results.append(await _run_ws(base_url, question, ws_idle_timeout))
+                except Exception as e:
+                    failed = RequestResult()
+                    failed.ok = False
+                    failed.error = f"{type(e).__name__}: {e}"
+                    results.append(failed)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - start
+
+    stages: Dict[str, List[float]] = defaultdict(list)
+    for result in results:
+        for stage, seconds in result.stages.items():
+            stages[stage].append(seconds)
+
+    ok = [r for r in results if r.ok]
+    sizes = [r.bytes for r in ok]
+    errors = [r.error for r in results if r.error]
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "error_samples": errors[:5],
+        "wall_seconds": wall,
+        "throughput_rps": len(ok) / wall if wall else 0.0,
+        "stages_ms": {
+            stage: {
+                "p50": percentile(samples, 50) * 1000,
+                "p95": percentile(samples, 95) * 1000,
+                "p99": percentile(samples, 99) * 1000,
+                "count": len(samples),
+            }
+            for stage, samples in sorted(stages.items())
+        },
+        "payload_bytes": {
+            "mean": sum(sizes) / len(sizes) if sizes else 0,
+            "max": max(sizes) if sizes else 0,
+            "total": sum(sizes),
+        },
+    }
+
+class AppServer:
+    """Runs the application under uvicorn in a child process"""
+
+    def __init__(self, gemini_url: str, workers: int = 1, env: Optional[Dict[str, str]] = None):
+        self.port = _free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.workers = workers
+        self.env = {
+            **os.environ,
+            "GEMINI_URL": gemini_url,
+            "GEMINI_API_KEY": "fake-key",
+            **(env or {}),
+        }
+        self.proc: Optional[subprocess.Popen] = None
+
+    def start(self, ready_timeout: float = 60.0) -> "AppServer":
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+             "--port", str(self.port), "--workers", str(self.workers), "--log-level", "warning"],
+            cwd=ROOT_DIR, env=self.env,
+        )
+        deadline = time.time() + ready_timeout
+        while time.time() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {self.proc.returncode}")
+            try:
+                if httpx.get(f"{self.base_url}/health", timeout=1).status_code == 200:
+                    return self
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise RuntimeError("Application did not become healthy in time")
+
+    def stop(self) -> None:
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """Return throughput and p95 deltas for levels present in both runs"""
+    base_levels = {(r["endpoint"], r["concurrency"]): r for r in baseline.get("levels", [])}
+    lines = []
+    for level in current["levels"]:
+        base = base_levels.get((level["endpoint"], level["concurrency"]))
+        if not base:
+            continue
+        now_p95 = level["stages_ms"].get("total", {}).get("p95", 0.0)
+        base_p95 = base["stages_ms"].get("total", {}).get("p95", 0.0)
+        lines.append(
+            f"{level['endpoint']:10s} c={level['concurrency']:<4d} "
+            f"rps {base['throughput_rps']:8.2f} -> {level['throughput_rps']:8.2f}   "
+            f"p95 {base_p95:9.1f} -> {now_p95:9.1f} ms"
+        )
+    return lines
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load-test the API against a fake Gemini server")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="Comma-separated subset of " + ",".join(ENDPOINTS))
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=32, help="Requests per endpoint and level")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0, help="Fake Gemini response delay")
+    parser.add_argument("--llm-jitter-ms", type=float, default=50.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--llm-cache", action="store_true",
+                        help="Keep the shared caches (LLM SQL, results, charts) enabled, starting empty")
+    parser.add_argument("--cache-backend", default="sqlite", choices=["memory", "sqlite"],
+                        help="CACHE_BACKEND with --llm-cache; sqlite shares one cache across --workers")
+    parser.add_argument("--ws-idle-timeout", type=float, default=2.0,
+                        help="Seconds of silence after response_complete that end a /ws request")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--baseline", help="Compare against a previous JSON result")
+    args = parser.parse_args()
+
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    levels = [int(c) for c in args.concurrency.split(",")]
+
+    gemini = FakeGeminiServer(latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms,
+                              error_rate=args.llm_error_rate).start()
+    env = {"WARMUP_QUESTIONS": "", "WARMUP_ENABLED": "true"}
+    if not args.llm_cache:
+        env["CACHE_ENABLED"] = "false"
+    else:
+        env["CACHE_BACKEND"] = args.cache_backend
+        env["CACHE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="load-cache-"), "cache.db")
+    app_server = AppServer(gemini.url, args.workers, env).start()
+
+    report: Dict[str, Any] = {
+        "config": {
+            "endpoints": endpoints,
+            "concurrency": levels,
+            "requests": args.requests,
+            "llm_latency_ms": args.llm_latency_ms,
+            "llm_jitter_ms": args.llm_jitter_ms,
+            "llm_error_rate": args.llm_error_rate,
+            "workers": args.workers,
+            "llm_cache": args.llm_cache,
+            "cache_backend": args.cache_backend if args.llm_cache else None,
+        },
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "levels": [],
+    }
+    try:
+        for endpoint in endpoints:
+            for concurrency in levels:
+                level = asyncio.run(run_level(app_server.base_url, endpoint, concurrency,
+                                              args.requests, args.ws_idle_timeout))
+                report["levels"].append(level)
+                total = level["stages_ms"].get("total", {})
+                print(f"{endpoint:10s} c={concurrency:<4d} {level['throughput_rps']:8.2f} req/s  "
+                      f"p50 {total.get('p50', 0):8.1f}  p95 {total.get('p95', 0):8.1f}  "
+                      f"p99 {total.get('p99', 0):8.1f} ms  "
+                      f"{level['payload_bytes']['mean']:10.0f} B/resp  errors {level['errors']}")
+    finally:
+        app_server.stop()
+        gemini.stop()
+    report["llm_requests"] = gemini.request_count
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            print("\nChange vs baseline:")
+            for line in compare(report, json.load(f)):
+                print(f"  {line}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Result memory benchmark: peak RSS of answering a query as results grow
+
+Runs one query per result size through app.db.execute_sql_query and encodes
+the /ask response, with the row cap on (rows past RESULT_ROW_CAP spill to
+disk) and off. Every measurement runs in a fresh subprocess, since peak RSS
+only ever grows within a process; the reported figure is the growth over
+the process's RSS right after imports.
+
+Usage:
+    python -m benchmarks.memory --rows 10000,100000,1000000 --output memory.json
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+def _query(rows: int) -> str:
+    # Enough copies of ad_sales_metrics to produce ``rows`` rows
+    return (
+        "WITH RECURSIVE copies(c) AS (SELECT 0 UNION ALL SELECT c + 1 FROM copies WHERE c < 10000) "
+        f"SELECT a.*, copies.c AS copy FROM ad_sales_metrics a, copies LIMIT {rows}"
+    )
+
+def _peak_kb() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def measure(rows: int) -> Dict[str, Any]:
+    """Run in the child process: answer one query the way /ask does"""
+    from app.db import execute_sql_query
+    from src.services.results import result_metadata
+
+    baseline = _peak_kb()
+    start = time.perf_counter()
+    answer = execute_sql_query(_query(rows))
+    if isinstance(answer, str):
+        raise RuntimeError(answer)
+    body = json.dumps({"question": "benchmark", "sql_query": _query(rows), "answer": answer,
+                       "visualization": None, **result_metadata(answer)}, default=str)
+    return {
+        "rows": rows,
+        "inline_rows": len(answer),
+        "spilled": bool(result_metadata(answer).get("spilled")),
+        "response_bytes": len(body),
+        "seconds": time.perf_counter() - start,
+        "peak_rss_growth_mb": (_peak_kb() - baseline) / 1024,
+    }
+
+def run_child(rows: int, cap: int, spill_dir: str) -> Dict[str, Any]:
+    env = dict(os.environ, RESULT_ROW_CAP=str(cap), RESULT_SPILL_DIR=spill_dir, WARMUP_ENABLED="false")
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.memory", "--child", str(rows)],
+        env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def run_benchmark(sizes: List[int], cap: int) -> Dict[str, Any]:
+    results: Dict[str, Any] = {"row_cap": cap, "sizes": []}
+    with tempfile.TemporaryDirectory() as spill_dir:
+        for rows in sizes:
+            results["sizes"].append({
+                "rows": rows,
+                "capped": run_child(rows, cap, spill_dir),
+                "uncapped": run_child(rows, 0, spill_dir),
+            })
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Peak RSS of large query results with and without the row cap")
+    parser.add_argument("--rows", default="10000,100000,1000000", help="Comma-separated result sizes")
+    parser.add_argument("--cap", type=int, default=10000, help="RESULT_ROW_CAP for the capped runs")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(measure(args.child)))
+        return
+
+    results = run_benchmark([int(r) for r in args.rows.split(",")], args.cap)
+    print(f"Row cap {results['row_cap']:,d}")
+    for entry in results["sizes"]:
+        capped, uncapped = entry["capped"], entry["uncapped"]
+        print(f"  {entry['rows']:>9,d} rows   capped {capped['peak_rss_growth_mb']:8.1f} MB "
+              f"({capped['seconds']:6.2f} s, spilled={capped['spilled']})   "
+              f"uncapped {uncapped['peak_rss_growth_mb']:8.1f} MB ({uncapped['seconds']:6.2f} s)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Cold-start benchmark for the Ecommerce AI Agent
+
+Spawns fresh interpreters the way a new uvicorn worker would and measures:
+- wall time to import the application module
+- wall time to import it and run the FastAPI lifespan startup
+- wall time until the lifespan warm-up has finished and the worker is ready
+- peak RSS of each child process
+- the slowest imports reported by ``python -X importtime``
+
+Usage:
+    python -m benchmarks.startup --runs 10 --output startup.json
+    python -m benchmarks.startup --baseline startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+_LIFESPAN = (
+    "import asyncio\n"
+    "import app.main as m\n"
+    "async def _run():\n"
+    "    async with m.lifespan(m.app):\n"
+    "        while not m.app.state.ready:\n"
+    "            await asyncio.sleep(0.01)\n"
+    "asyncio.run(_run())\n"
+)
+
+# name -> (code, extra environment)
+TARGETS = {
+    "import": ("import app.main", {}),
+    "startup": (_LIFESPAN, {"WARMUP_ENABLED": "false"}),
+    "ready": (_LIFESPAN, {"WARMUP_ENABLED": "true"}),
+}
+
+def _run_child(code: str, extra_args: Optional[List[str]] = None, env: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Run code in a fresh interpreter and return wall time, peak RSS and stderr"""
+    args = [sys.executable] + (extra_args or []) + ["-c", code]
+    child_env = {**os.environ, **(env or {})}
+    start = time.perf_counter()
+    proc = subprocess.Popen(args, cwd=ROOT_DIR, env=child_env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = proc.stderr.read().decode("utf-8", errors="replace")
+    _, status, rusage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Child process failed ({proc.returncode}):\n{stderr}")
+
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+    rss_kb = rusage.ru_maxrss / 1024 if sys.platform == "darwin" else rusage.ru_maxrss
+    return {"seconds": elapsed, "rss_mb": rss_kb / 1024, "stderr": stderr}
+
+def parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    """Parse ``-X importtime`` output into a list of per-module timings"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            head, cumulative_us, name = line.split("|", 2)
+            self_us = head.split(":", 1)[1]
+        except ValueError:
+            continue
+        modules.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip())) // 2,
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+        })
+    return modules
+
+def _summarize(samples: List[float]) -> Dict[str, float]:
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "max": max(samples),
+    }
+
+def run_benchmark(runs: int = 5, top: int = 15) -> Dict[str, Any]:
+    """Run every target ``runs`` times and collect the importtime breakdown"""
+    results: Dict[str, Any] = {"python": sys.version.split()[0], "runs": runs, "targets": {}}
+
+    for name, (code, env) in TARGETS.items():
+        timings = [_run_child(code, env=env) for _ in range(runs)]
+        results["targets"][name] = {
+            "seconds": _summarize([t["seconds"] for t in timings]),
+            "rss_mb": _summarize([t["rss_mb"] for t in timings]),
+        }
+
+    importtime = parse_importtime(_run_child(TARGETS["import"][0], ["-X", "importtime"])["stderr"])
+    top_level = [m for m in importtime if m["depth"] <= 1]
+    results["importtime"] = {
+        "total_ms": sum(m["self_ms"] for m in importtime),
+        "module_count": len(importtime),
+        "slowest_cumulative": sorted(top_level, key=lambda m: m["cumulative_ms"], reverse=True)[:top],
+        "slowest_self": sorted(importtime, key=lambda m: m["self_ms"], reverse=True)[:top],
+    }
+    return results
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """Return human-readable deltas between two benchmark results"""
+    lines = []
+    for name, stats in current["targets"].items():
+        base = baseline.get("targets", {}).get(name)
+        if not base:
+            continue
+        for metric in ("seconds", "rss_mb"):
+            now, before = stats[metric]["median"], base[metric]["median"]
+            change = (now - before) / before * 100 if before else 0.0
+            lines.append(f"{name:8s} {metric:8s} {before:10.3f} -> {now:10.3f} ({change:+.1f}%)")
+    return lines
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure application cold-start time and memory")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per target")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest imports to report")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--baseline", help="Compare against a previous JSON result")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.runs, args.top)
+
+    for name, stats in results["targets"].items():
+        print(f"{name:8s} median {stats['seconds']['median'] * 1000:8.1f} ms   "
+              f"peak RSS {stats['rss_mb']['median']:7.1f} MB")
+    print(f"\nSlowest imports (cumulative, {results['importtime']['module_count']} modules):")
+    for module in results["importtime"]["slowest_cumulative"]:
+        print(f"  {module['cumulative_ms']:9.1f} ms  {module['module']}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            print("\nChange vs baseline:")
+            for line in compare(results, json.load(f)):
+                print(f"  {line}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+Offline text-to-SQL quality and latency evaluation
+
+Replays recorded LLM responses for every question in corpus.json through each
+prompt variant and checks:
+- result equivalence against the expected result set
+- execution time of the generated SQL
+- prompt size
+- rows scanned (estimated from EXPLAIN QUERY PLAN) and SQLite VM steps
+
+Recordings are keyed by the SHA-256 of the full prompt, so changing a prompt
+makes its recordings go missing until they are re-recorded. Nothing touches
+the network unless --record is given.
+
+Usage:
+    python -m benchmarks.text_to_sql.evaluate --output eval.json
+    python -m benchmarks.text_to_sql.evaluate --variant ask_llm --baseline eval.json
+    python -m benchmarks.text_to_sql.evaluate --record            # needs GEMINI_API_KEY
+    python -m benchmarks.text_to_sql.evaluate --update-expected   # after changing corpus.json
+"""
+import argparse
+import hashlib
+import json
+import math
+import re
+import sqlite3
+import statistics
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from config.settings import settings
+
+SUITE_DIR = Path(__file__).resolve().parent
+CORPUS_PATH = SUITE_DIR / "corpus.json"
+RECORDINGS_DIR = SUITE_DIR / "recordings"
+
+# Step granularity for the SQLite progress handler used to count VM steps
+VM_STEP_INTERVAL = 100
+
+def _ask_llm_prompt(question: str) -> str:
+    from app.llm_interface import build_prompt
+    return build_prompt(question)
+
+def _llm_service_prompt(question: str) -> str:
+    from src.services.llm import LLMService
+    return LLMService(api_key="offline")._build_sql_prompt(question)
+
+# Prompt variant name -> prompt builder
+PROMPT_VARIANTS: Dict[str, Callable[[str], str]] = {
+    "ask_llm": _ask_llm_prompt,
+    "llm_service": _llm_service_prompt,
+}
+
+def prompt_key(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+def load_json(path: Path, default: Any) -> Any:
+    if not path.exists():
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+def save_json(path: Path, data: Any) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+
+def _normalize_value(value: Any) -> Any:
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        # Aggregates over REAL columns differ in the last bits between plans
+        return round(value, 6)
+    return value
+
+def normalize_rows(rows: Sequence[Sequence[Any]], ordered: bool) -> List[tuple]:
+    """Compare by value only; column aliases chosen by the LLM do not matter"""
+    normalized = [tuple(_normalize_value(v) for v in row) for row in rows]
+    return normalized if ordered else sorted(normalized, key=repr)
+
+def run_query(conn: sqlite3.Connection, sql: str, repeats: int = 3) -> Dict[str, Any]:
+    """Execute SQL, returning rows, median execution time and VM step count"""
+    steps = 0
+
+    def count_steps():
+        nonlocal steps
+        steps += VM_STEP_INTERVAL
+        return 0
+
+    timings = []
+    rows: List[tuple] = []
+    columns: List[str] = []
+    for i in range(repeats):
+        if i == 0:
+            conn.set_progress_handler(count_steps, VM_STEP_INTERVAL)
+        start = time.perf_counter()
+        cursor = conn.execute(sql)
+        rows = cursor.fetchall()
+        timings.append(time.perf_counter() - start)
+        if i == 0:
+            conn.set_progress_handler(None, 0)
+            columns = [d[0] for d in cursor.description or ()]
+    return {"rows": rows, "columns": columns, "seconds": statistics.median(timings), "vm_steps": steps}
+
+_PLAN_TABLE_RE = re.compile(r"^(SCAN|SEARCH)\s+(?:TABLE\s+)?(\w+)", re.IGNORECASE)
+
+def estimate_rows_scanned(conn: sqlite3.Connection, sql: str, table_rows: Dict[str, int]) -> Dict[str, Any]:
+    """
+    Estimate rows read from EXPLAIN QUERY PLAN: a full SCAN reads the whole
+    table, an index SEARCH is counted as a scan of at most the table.
+    """
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    scans, searches, rows_scanned = [], [], 0
+    for row in plan:
+        match = _PLAN_TABLE_RE.match(row[-1])
+        if not match or match.group(2) not in table_rows:
+            continue
+        kind, table = match.group(1).upper(), match.group(2)
+        (scans if kind == "SCAN" else searches).append(table)
+        if kind == "SCAN":
+            rows_scanned += table_rows[table]
+    return {"rows_scanned": rows_scanned, "full_scans": scans, "index_searches": searches}
+
+def record_response(prompt: str) -> str:
+    """Call the live LLM for a prompt (only used with --record)"""
+    import requests
+
+    if not settings.GEMINI_API_KEY:
+        raise ValueError("GEMINI_API_KEY is required to record LLM responses")
+    payload = {"contents": [{"parts": [{"text": prompt}]}]}
+    response = requests.post(f"{settings.GEMINI_URL}?key={settings.GEMINI_API_KEY}",
+                             headers={"Content-Type": "application/json"}, json=payload, timeout=60)
+    response.raise_for_status()
+    return response.json()["candidates"][0]["content"]["parts"][0]["text"]
+
+def evaluate_variant(variant: str, corpus: List[Dict[str, Any]], conn: sqlite3.Connection,
+                     table_rows: Dict[str, int], record: bool = False, repeats: int = 3) -> Dict[str, Any]:
+    """Evaluate one prompt variant over the whole corpus"""
+    from app.llm_interface import clean_sql
+
+    build_prompt = PROMPT_VARIANTS[variant]
+    recordings_path = RECORDINGS_DIR / f"{variant}.json"
+    recordings = load_json(recordings_path, {})
+    recorded_new = False
+
+    cases = []
+    for case in corpus:
+        prompt = build_prompt(case["question"])
+        key = prompt_key(prompt)
+        result: Dict[str, Any] = {
+            "id": case["id"],
+            "question": case["question"],
+            "prompt_chars": len(prompt),
+            # Rough token estimate; good enough to compare variants
+            "prompt_tokens_est": math.ceil(len(prompt) / 4),
+        }
+
+        if key not in recordings and record:
+            recordings[key] = {"question": case["question"], "response": record_response(prompt)}
+            recorded_new = True
+        if key not in recordings:
+            result["status"] = "missing_recording"
+            cases.append(result)
+            continue
+
+        sql = clean_sql(recordings[key]["response"])
+        result["sql"] = sql
+        try:
+            execution = run_query(conn, sql, repeats)
+            result.update(estimate_rows_scanned(conn, sql, table_rows))
+        except sqlite3.Error as e:
+            result["status"] = "sql_error"
+            result["error"] = str(e)
+            cases.append(result)
+            continue
+
+        ordered = case.get("ordered", False)
+        expected = normalize_rows(case["expected"]["rows"], ordered)
+        actual = normalize_rows(execution["rows"], ordered)
+        result.update({
+            "status": "pass" if actual == expected else "mismatch",
+            "exec_ms": execution["seconds"] * 1000,
+            "vm_steps": execution["vm_steps"],
+            "result_rows": len(execution["rows"]),
+        })
+        if result["status"] == "mismatch":
+            result["expected_preview"] = case["expected"]["rows"][:3]
+            result["actual_preview"] = [list(r) for r in execution["rows"][:3]]
+        cases.append(result)
+
+    if recorded_new:
+        save_json(recordings_path, recordings)
+
+    executed = [c for c in cases if "exec_ms" in c]
+    statuses = [c["status"] for c in cases]
+    return {
+        "variant": variant,
+        "summary": {
+            "questions": len(cases),
+            "passed": statuses.count("pass"),
+            "mismatched": statuses.count("mismatch"),
+            "sql_errors": statuses.count("sql_error"),
+            "missing_recordings": statuses.count("missing_recording"),
+            "accuracy": statuses.count("pass") / len(cases) if cases else 0.0,
+            "exec_ms_p50": statistics.median([c["exec_ms"] for c in executed]) if executed else 0.0,
+            "exec_ms_total": sum(c["exec_ms"] for c in executed),
+            "prompt_chars_mean": statistics.mean([c["prompt_chars"] for c in cases]) if cases else 0,
+            "rows_scanned_total": sum(c.get("rows_scanned", 0) for c in executed),
+            "vm_steps_total": sum(c.get("vm_steps", 0) for c in executed),
+        },
+        "cases": cases,
+    }
+
+def update_expected(corpus: List[Dict[str, Any]], conn: sqlite3.Connection) -> None:
+    """Recompute every expected result set from its reference SQL"""
+    for case in corpus:
+        execution = run_query(conn, case["reference_sql"], repeats=1)
+        case["expected"] = {"columns": execution["columns"], "rows": [list(r) for r in execution["rows"]]}
+    save_json(CORPUS_PATH, corpus)
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    base_variants = {v["variant"]: v["summary"] for v in baseline.get("variants", [])}
+    lines = []
+    for variant in current["variants"]:
+        base = base_variants.get(variant["variant"])
+        if not base:
+            continue
+        now = variant["summary"]
+        lines.append(
+            f"{variant['variant']:12s} accuracy {base['accuracy']:.2f} -> {now['accuracy']:.2f}   "
+            f"exec p50 {base['exec_ms_p50']:.2f} -> {now['exec_ms_p50']:.2f} ms   "
+            f"prompt {base['prompt_chars_mean']:.0f} -> {now['prompt_chars_mean']:.0f} chars   "
+            f"rows scanned {base['rows_scanned_total']} -> {now['rows_scanned_total']}"
+        )
+    return lines
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Evaluate text-to-SQL prompts against recorded LLM responses")
+    parser.add_argument("--variant", action="append", choices=sorted(PROMPT_VARIANTS),
+                        help="Prompt variant to evaluate (repeatable, default: all)")
+    parser.add_argument("--db", default=settings.DB_PATH, help="SQLite database to run the SQL against")
+    parser.add_argument("--repeats", type=int, default=3, help="Executions per query for timing")
+    parser.add_argument("--record", action="store_true", help="Call the live LLM for missing recordings")
+    parser.add_argument("--update-expected", action="store_true", help="Recompute expected results from reference SQL")
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    parser.add_argument("--baseline", help="Compare against a previous JSON report")
+    args = parser.parse_args(argv)
+
+    corpus = load_json(CORPUS_PATH, [])
+    # Read-only so a bad generated statement can never modify the data
+    conn = sqlite3.connect(f"file:{Path(args.db).resolve()}?mode=ro", uri=True)
+    tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    table_rows = {t: conn.execute(f'SELECT COUNT(*) FROM "{t}"').fetchone()[0] for t in tables}
+
+    if args.update_expected:
+        update_expected(corpus, conn)
+        print(f"Updated expected results for {len(corpus)} questions")
+
+    report = {"database": str(args.db), "variants": []}
+    for variant in args.variant or sorted(PROMPT_VARIANTS):
+        result = evaluate_variant(variant, corpus, conn, table_rows, args.record, args.repeats)
+        report["variants"].append(result)
+        summary = result["summary"]
+        print(f"{variant:12s} {summary['passed']}/{summary['questions']} passed  "
+              f"({summary['mismatched']} mismatched, {summary['sql_errors']} errors, "
+              f"{summary['missing_recordings']} missing)  exec p50 {summary['exec_ms_p50']:.2f} ms  "
+              f"prompt {summary['prompt_chars_mean']:.0f} chars  rows scanned {summary['rows_scanned_total']}")
+        for case in result["cases"]:
+            if case["status"] != "pass":
+                print(f"    {case['status']:18s} {case['id']}: {case['question']}")
+    conn.close()
+
+    if args.baseline:
+        print("\nChange vs baseline:")
+        for line in compare(report, load_json(Path(args.baseline), {})):
+            print(f"  {line}")
+
+    if args.output:
+        save_json(Path(args.output), report)
+        print(f"\nReport written to {args.output}")
+
+if __name__ == "__main__":
+    main()
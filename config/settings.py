@@ -2,12 +2,23 @@
 Configuration settings for the Ecommerce AI Agent
 """
 import os
-from typing import Optional
+import tempfile
+from typing import List, Optional
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+def _parse_limits(value: str) -> dict:
+    """Parse "name=limit:queue,..." (or any "name=a:b" pairs) into {name: (limit, queue)}"""
+    limits = {}
+    for entry in value.split(","):
+        if "=" in entry:
+            name, spec = entry.rsplit("=", 1)
+            limit, _, queue = spec.partition(":")
+            limits[name.strip()] = (int(limit), int(queue or 0))
+    return limits
+
 class Settings:
     """Application settings and configuration"""
     
@@ -24,10 +35,60 @@ class Settings:
     # Database Configuration
     DATABASE_URL: str = "sqlite:///./data.db"
     DB_PATH: str = os.path.join(os.path.dirname(__file__), "../data.db")
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "4"))
+    # setup_db.py publishes each data load as a new generation file here; DB_PATH is used until the first one
+    DB_GENERATIONS_DIR: str = os.getenv("DB_GENERATIONS_DIR", os.path.join(os.path.dirname(__file__), "../generations"))
+    # Superseded generations kept for other worker processes to drain
+    DB_GENERATIONS_RETAIN: int = int(os.getenv("DB_GENERATIONS_RETAIN", "1"))
+    # Analytical engine: "sqlite" (DB_PATH), "duckdb" (Parquet files in PARQUET_DIR)
+    # or "sharded" (item_id shards in SHARD_DIR, see src/services/sharding.py)
+    DB_BACKEND: str = os.getenv("DB_BACKEND", "sqlite").lower()
+    PARQUET_DIR: str = os.getenv("PARQUET_DIR", os.path.join(os.path.dirname(__file__), "../parquet"))
+    DUCKDB_THREADS: Optional[int] = int(os.getenv("DUCKDB_THREADS")) if os.getenv("DUCKDB_THREADS") else None
+    SHARD_DIR: str = os.getenv("SHARD_DIR", os.path.join(os.path.dirname(__file__), "../shards"))
+    SHARD_COUNT: int = int(os.getenv("SHARD_COUNT", "4"))
+    # Comma-separated shard worker URLs (or shard file paths), in shard order; empty reads SHARD_DIR locally
+    SHARD_NODES: List[str] = [n.strip() for n in os.getenv("SHARD_NODES", "").split(",") if n.strip()]
+    # Run queries the planner cannot split on the unsharded database instead of failing
+    SHARD_FALLBACK: bool = os.getenv("SHARD_FALLBACK", "true").lower() in ("1", "true", "yes")
+    SHARD_TIMEOUT: float = float(os.getenv("SHARD_TIMEOUT", "30"))
+    # Rows returned inline per query (0 = no cap); larger results spill to RESULT_SPILL_DIR
+    # and are paged through /results/{handle}. RESULT_SPILL_MAX_ROWS = 0 truncates at the cap instead.
+    RESULT_ROW_CAP: int = int(os.getenv("RESULT_ROW_CAP", "10000"))
+    RESULT_SPILL_MAX_ROWS: int = int(os.getenv("RESULT_SPILL_MAX_ROWS", "5000000"))
+    RESULT_SPILL_DIR: str = os.getenv("RESULT_SPILL_DIR", os.path.join(tempfile.gettempdir(), "ecommerce-agent-results"))
+    RESULT_TTL_SECONDS: int = int(os.getenv("RESULT_TTL_SECONDS", "3600"))
+    RESULT_FETCH_BATCH: int = int(os.getenv("RESULT_FETCH_BATCH", "1000"))
+    RESULT_PAGE_SIZE: int = int(os.getenv("RESULT_PAGE_SIZE", "1000"))
+    # Rows per Parquet row group in /export downloads
+    EXPORT_ROW_GROUP_SIZE: int = int(os.getenv("EXPORT_ROW_GROUP_SIZE", "65536"))
+    # Rewrite date-filtered queries to read only the matching monthly partitions (see src/services/partitions.py)
+    PARTITION_ROUTING: bool = os.getenv("PARTITION_ROUTING", "true").lower() in ("1", "true", "yes")
+    # Approximate answers (see src/services/approximate.py): each generation keeps a sample of the
+    # metric tables stratified by item_id, and aggregate queries over tables with at least
+    # APPROXIMATE_MIN_ROWS rows stream an estimate with error bounds before the exact answer
+    APPROXIMATE_ENABLED: bool = os.getenv("APPROXIMATE_ENABLED", "true").lower() in ("1", "true", "yes")
+    APPROXIMATE_MIN_ROWS: int = int(os.getenv("APPROXIMATE_MIN_ROWS", "100000"))
+    APPROXIMATE_CONFIDENCE: float = float(os.getenv("APPROXIMATE_CONFIDENCE", "0.95"))
+    SAMPLE_RATE: float = float(os.getenv("SAMPLE_RATE", "0.01"))
+    SAMPLE_MIN_ROWS: int = int(os.getenv("SAMPLE_MIN_ROWS", "1"))
+    SAMPLE_REPLICATES: int = int(os.getenv("SAMPLE_REPLICATES", "10"))
     
     # LLM Configuration
     GEMINI_API_KEY: Optional[str] = os.getenv("GEMINI_API_KEY")
-    GEMINI_URL: str = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+    GEMINI_URL: str = os.getenv("GEMINI_URL", "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent")
+    LLM_CACHE_SIZE: int = int(os.getenv("LLM_CACHE_SIZE", "256"))
+    
+    # Cache Configuration (see src/services/cache.py)
+    # Shared by every worker: LLM-generated SQL, query results and rendered charts.
+    # Backend "memory" (per process), "sqlite" (CACHE_PATH, shared on the host) or "network" (CACHE_URL)
+    CACHE_ENABLED: bool = os.getenv("CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+    CACHE_BACKEND: str = os.getenv("CACHE_BACKEND", "sqlite").lower()
+    CACHE_PATH: str = os.getenv("CACHE_PATH", os.path.join(tempfile.gettempdir(), "ecommerce-agent-cache.db"))
+    CACHE_URL: str = os.getenv("CACHE_URL", "http://127.0.0.1:9200")
+    CACHE_TIMEOUT: float = float(os.getenv("CACHE_TIMEOUT", "2"))
+    # Per-namespace limits as "namespace=max_entries:max_megabytes" (0 entries disables a namespace)
+    CACHE_LIMITS: dict = _parse_limits(os.getenv("CACHE_LIMITS", f"llm={LLM_CACHE_SIZE}:16,results=512:128,charts=256:64"))
     
     # Data Configuration
     DATA_DIR: str = os.path.join(os.path.dirname(__file__), "../data")
@@ -37,6 +98,36 @@ class Settings:
     DEFAULT_CHART_WIDTH: int = 800
     DEFAULT_CHART_HEIGHT: int = 600
     
+    # Warm-up Configuration (runs in the FastAPI lifespan before /health reports ready)
+    WARMUP_ENABLED: bool = os.getenv("WARMUP_ENABLED", "true").lower() in ("1", "true", "yes")
+    WARMUP_CHART_TYPES: list = os.getenv("WARMUP_CHART_TYPES", "line,bar,pie,scatter").split(",")
+    # Top questions replayed into the caches, separated by "|"
+    WARMUP_QUESTIONS: list = [q.strip() for q in os.getenv(
+        "WARMUP_QUESTIONS",
+        "What is my total sales?|Calculate the RoAS (Return on Ad Spend).|Which product had the highest CPC (Cost Per Click)?"
+    ).split("|") if q.strip()]
+    
+    # Profiling Configuration
+    # Token required in the X-Admin-Token header to request a profile; profiling on demand is disabled when unset
+    ADMIN_TOKEN: Optional[str] = os.getenv("ADMIN_TOKEN")
+    # Profile 1 in N requests into the on-disk ring (0 disables sampling)
+    PROFILE_SAMPLE_RATE: int = int(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    PROFILE_DIR: str = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(__file__), "../profiles"))
+    PROFILE_RING_SIZE: int = int(os.getenv("PROFILE_RING_SIZE", "50"))
+    PROFILE_SAMPLE_INTERVAL_MS: float = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+    PROFILE_TRACEMALLOC_FRAMES: int = 1
+    PROFILE_TOP_STACKS: int = 50
+    PROFILE_TOP_ALLOCATIONS: int = 25
+    
+    # Admission Configuration
+    # Concurrent requests and queued waiters per endpoint path prefix and per pipeline stage,
+    # as "name=limit:queue" (limit 0 means unlimited); overflow is shed with 429 and Retry-After
+    ADMISSION_ENABLED: bool = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+    ENDPOINT_LIMITS: dict = _parse_limits(os.getenv("ENDPOINT_LIMITS", "/ask=16:64,/ask-stream=16:64,/visualize=8:32,/export=4:16,/ws=32:64"))
+    STAGE_LIMITS: dict = _parse_limits(os.getenv("STAGE_LIMITS", "llm=8:32,sql=8:64,render=4:32"))
+    # Seconds a caller may wait in a queue before it is shed
+    ADMISSION_QUEUE_TIMEOUT: float = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+    
     # CORS Configuration
     ALLOWED_ORIGINS: list = ["*"]
     ALLOWED_METHODS: list = ["*"]
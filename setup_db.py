@@ -1,24 +1,24 @@
-import os
-import sqlite3
-import pandas as pd
+import argparse
+import logging
+
+from src.services.generations import build_generation, generations
 
 # Paths
 DATA_DIR = "data"
-DB_PATH = "data.db"  # Already present
-
-# Connect to the database (or create it if it doesn't exist)
-conn = sqlite3.connect(DB_PATH)
 
-# Loop through all CSV files in the data folder
-for filename in os.listdir(DATA_DIR):
-    if filename.endswith(".csv"):
-        file_path = os.path.join(DATA_DIR, filename)
-        table_name = filename.replace(".csv", "")
+# Readers keep using the live database while the new generation is built next
+# to it; they only switch over once it has been loaded, indexed and validated
+parser = argparse.ArgumentParser(description="Load the CSVs into a new database generation and publish it")
+parser.add_argument("--data-dir", default=DATA_DIR)
+parser.add_argument("--partition", action="store_true", help="Split the metrics tables into monthly partitions")
+parser.add_argument("--no-publish", action="store_true", help="Build and validate the generation without switching to it")
+args = parser.parse_args()
 
-        df = pd.read_csv(file_path)
-        df.to_sql(table_name, conn, if_exists="replace", index=False)
+logging.basicConfig(level=logging.INFO, format="%(message)s")
 
-        print(f"✅ Loaded {filename} as table '{table_name}'")
+generation = build_generation(args.data_dir, partition=args.partition)
+print(f"✅ Built and validated generation {generation.number} at {generation.path}")
 
-conn.close()
-print("🎉 All CSVs loaded into data.db")
+if not args.no_publish:
+    generations.publish(generation)
+    print(f"🎉 Generation {generation.number} is now live")
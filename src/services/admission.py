@@ -0,0 +1,296 @@
+"""
+Admission control: concurrency limits with bounded priority wait queues
+
+Each limiter admits up to ``limit`` callers at once and queues up to
+``queue_size`` more, highest priority first. A caller arriving at a full
+queue is shed straight away with AdmissionRejected (a 429 with Retry-After
+at the HTTP edge) unless it outranks a queued caller, in which case the
+lowest-priority queued caller is shed instead. Callers that wait longer
+than the queue timeout are shed too.
+
+Endpoints are limited by AdmissionMiddleware before any work starts;
+pipeline stages (llm, sql, render) by ``admission.stage(name)``, using the
+priority of the request that reached them.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from config.settings import settings
+from src.services.metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_SHED, ADMISSION_WAIT
+
+# Lower values are served first
+PRIORITIES = {"interactive": 0, "default": 1, "batch": 2}
+DEFAULT_PRIORITY = PRIORITIES["default"]
+
+_current_priority: contextvars.ContextVar[int] = contextvars.ContextVar("admission_priority", default=DEFAULT_PRIORITY)
+
+class AdmissionRejected(Exception):
+    """A caller was shed instead of admitted"""
+
+    def __init__(self, limiter: str, reason: str, retry_after: int):
+        super().__init__(f"Server busy ({limiter}: {reason}); retry in {retry_after}s")
+        self.limiter = limiter
+        self.reason = reason
+        self.retry_after = retry_after
+
+_WAITING, _GRANTED, _PREEMPTED, _CANCELLED = range(4)
+
+class _Waiter:
+    """A queued caller, woken through a threading.Event or an asyncio future"""
+
+    def __init__(self, priority: int, seq: int, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.priority = priority
+        self.seq = seq
+        self.state = _WAITING
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def wake(self) -> None:
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve_future, self.future)
+
+def _resolve_future(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+class AdmissionLimiter:
+    """Concurrency limit with a bounded priority queue, usable from threads and coroutines"""
+
+    def __init__(self, name: str, limit: int, queue_size: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        # Moving average of how long a slot is held, for Retry-After
+        self._hold_seconds = 1.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.limit > 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"limit": self.limit, "active": self._active, "queued": len(self._queue), "queue_size": self.queue_size}
+
+    def retry_after(self) -> int:
+        """Seconds until a new caller would likely get a slot"""
+        with self._lock:
+            return self._retry_after_locked()
+
+    def _retry_after_locked(self) -> int:
+        waves = (len(self._queue) + 1) / max(self.limit, 1)
+        return max(1, math.ceil(waves * self._hold_seconds))
+
+    def _shed(self, reason: str) -> AdmissionRejected:
+        ADMISSION_SHED.inc(limiter=self.name, reason=reason)
+        return AdmissionRejected(self.name, reason, self._retry_after_locked())
+
+    def _try_admit(self, priority: int, loop: Optional[asyncio.AbstractEventLoop]) -> Optional[_Waiter]:
+        """Take a free slot (returns None) or enqueue a waiter; raises when shed. Called with the lock held."""
+        if self._active < self.limit and not self._queue:
+            self._active += 1
+            ADMISSION_IN_FLIGHT.set(self._active, limiter=self.name)
+            return None
+        if len(self._queue) >= self.queue_size:
+            victim = max(self._queue) if self._queue else None
+            if victim is None or victim.priority <= priority:
+                raise self._shed("queue_full")
+            # Make room by shedding the lowest-priority, most recent waiter
+            self._queue.remove(victim)
+            heapq.heapify(self._queue)
+            victim.state = _PREEMPTED
+            victim.wake()
+        waiter = _Waiter(priority, next(self._seq), loop)
+        heapq.heappush(self._queue, waiter)
+        ADMISSION_QUEUE_DEPTH.set(len(self._queue), limiter=self.name)
+        return waiter
+
+    def _finish_wait(self, waiter: _Waiter, started: float) -> None:
+        """Resolve a waiter after it woke or timed out; raises if it was not granted a slot"""
+        with self._lock:
+            if waiter.state == _WAITING:
+                waiter.state = _CANCELLED
+                self._queue.remove(waiter)
+                heapq.heapify(self._queue)
+                ADMISSION_QUEUE_DEPTH.set(len(self._queue), limiter=self.name)
+                raise self._shed("timeout")
+            if waiter.state == _PREEMPTED:
+                ADMISSION_QUEUE_DEPTH.set(len(self._queue), limiter=self.name)
+                raise self._shed("preempted")
+        ADMISSION_WAIT.observe(time.perf_counter() - started, limiter=self.name)
+
+    def acquire(self, priority: Optional[int] = None) -> float:
+        """Take a slot, waiting in the queue if needed; returns the admission time for release()"""
+        if not self.enabled:
+            return time.perf_counter()
+        priority = _current_priority.get() if priority is None else priority
+        started = time.perf_counter()
+        with self._lock:
+            waiter = self._try_admit(priority, None)
+        if waiter is not None:
+            waiter.event.wait(self.timeout)
+            self._finish_wait(waiter, started)
+        return time.perf_counter()
+
+    async def acquire_async(self, priority: Optional[int] = None) -> float:
+        """acquire() for coroutines: waits on the event loop instead of blocking a thread"""
+        if not self.enabled:
+            return time.perf_counter()
+        priority = _current_priority.get() if priority is None else priority
+        started = time.perf_counter()
+        with self._lock:
+            waiter = self._try_admit(priority, asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.timeout)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                with self._lock:
+                    granted = waiter.state == _GRANTED
+                    if waiter.state == _WAITING:
+                        waiter.state = _CANCELLED
+                        self._queue.remove(waiter)
+                        heapq.heapify(self._queue)
+                if granted:
+                    self.release(time.perf_counter())
+                raise
+            self._finish_wait(waiter, started)
+        return time.perf_counter()
+
+    def release(self, admitted: float) -> None:
+        """Hand the slot to the next waiter, or free it"""
+        if not self.enabled:
+            return
+        held = time.perf_counter() - admitted
+        with self._lock:
+            self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * held
+            if self._queue:
+                waiter = heapq.heappop(self._queue)
+                waiter.state = _GRANTED
+                waiter.wake()
+                ADMISSION_QUEUE_DEPTH.set(len(self._queue), limiter=self.name)
+            else:
+                self._active -= 1
+                ADMISSION_IN_FLIGHT.set(self._active, limiter=self.name)
+
+    @contextmanager
+    def slot(self, priority: Optional[int] = None) -> Iterator[None]:
+        """Hold a slot for the duration of a with block"""
+        admitted = self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release(admitted)
+
+class AdmissionController:
+    """Named limiters for endpoints and pipeline stages"""
+
+    def __init__(self, endpoints: Dict[str, Tuple[int, int]], stages: Dict[str, Tuple[int, int]],
+                 timeout: float, enabled: bool = True):
+        self.enabled = enabled
+        self.endpoints = {path: AdmissionLimiter(path, limit, queue, timeout) for path, (limit, queue) in endpoints.items()}
+        self.stages = {name: AdmissionLimiter(name, limit, queue, timeout) for name, (limit, queue) in stages.items()}
+
+    def endpoint_for(self, path: str) -> Optional[AdmissionLimiter]:
+        """Limiter for a request path: exact match or the longest configured prefix segment"""
+        if not self.enabled:
+            return None
+        best = None
+        for prefix, limiter in self.endpoints.items():
+            if limiter.enabled and (path == prefix or path.startswith(prefix.rstrip("/") + "/")):
+                if best is None or len(prefix) > len(best.name):
+                    best = limiter
+        return best
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Hold a slot of a pipeline stage limiter; unconfigured stages are unlimited"""
+        limiter = self.stages.get(name) if self.enabled else None
+        if limiter is None:
+            yield
+            return
+        with limiter.slot():
+            yield
+
+    def stats(self) -> Dict[str, Dict[str, Dict[str, int]]]:
+        return {
+            "endpoints": {name: limiter.stats() for name, limiter in self.endpoints.items()},
+            "stages": {name: limiter.stats() for name, limiter in self.stages.items()},
+        }
+
+def parse_priority(value: Optional[str], floor: int = DEFAULT_PRIORITY) -> int:
+    """Priority named by a client; callers may lower their priority below ``floor`` but not raise it"""
+    return max(PRIORITIES.get((value or "").strip().lower(), floor), floor)
+
+@contextmanager
+def priority_scope(priority: int) -> Iterator[None]:
+    """Run a block (and the stages it reaches) at ``priority``"""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+class AdmissionMiddleware:
+    """Shed HTTP requests over their endpoint's limit with 429 and Retry-After before any work starts"""
+
+    def __init__(self, app, controller: Optional[AdmissionController] = None):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        controller = self.controller or admission
+        limiter = controller.endpoint_for(scope["path"]) if scope["type"] == "http" else None
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        priority = parse_priority(headers.get(b"x-priority", b"").decode("latin-1"))
+        try:
+            admitted = await limiter.acquire_async(priority)
+        except AdmissionRejected as e:
+            await _send_rejection(send, e)
+            return
+        try:
+            with priority_scope(priority):
+                await self.app(scope, receive, send)
+        finally:
+            limiter.release(admitted)
+
+async def _send_rejection(send, error: AdmissionRejected) -> None:
+    body = json.dumps({"detail": str(error), "retry_after": error.retry_after}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 429,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"retry-after", str(error.retry_after).encode("ascii")),
+            (b"content-length", str(len(body)).encode("ascii")),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+# Global admission controller instance
+admission = AdmissionController(
+    settings.ENDPOINT_LIMITS, settings.STAGE_LIMITS, settings.ADMISSION_QUEUE_TIMEOUT, settings.ADMISSION_ENABLED
+)
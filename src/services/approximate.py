@@ -0,0 +1,336 @@
+"""
+Approximate answers from stratified samples
+
+Every database generation keeps a sample of the large metric tables,
+stratified by item_id: each item keeps SAMPLE_RATE of its rows (at least
+SAMPLE_MIN_ROWS), every sampled row carries the weight N/n of its item's
+stratum, and rows are spread over SAMPLE_REPLICATES replicate groups.
+
+estimate_query() runs an aggregate query against the sample with weighted
+aggregates: SUM(x) -> SUM(x * w), COUNT(*) -> TOTAL(w), AVG(x) -> the
+weighted mean, so ratios such as RoAS become ratios of weighted sums. The
+same query per replicate group gives each estimated value a standard error
+(random groups variance estimation) and so an error bound at
+APPROXIMATE_CONFIDENCE. MIN and MAX come from the sample without a bound.
+
+Only aggregate queries over one sampled table with at least
+APPROXIMATE_MIN_ROWS rows are estimated; joins, subqueries, DISTINCT
+aggregates and row queries are answered exactly only.
+
+Usage:
+    python -m src.services.approximate build --db generations/data-000002.db
+    python -m src.services.approximate estimate "SELECT date, SUM(ad_sales) / SUM(ad_spend) FROM ad_sales_metrics GROUP BY date"
+"""
+import argparse
+import logging
+import math
+import re
+import sqlite3
+import time
+from statistics import NormalDist
+from typing import Any, Dict, List, Optional, Tuple
+
+from config.settings import settings
+from src.services.generations import generations, open_readonly
+from src.services.metrics import ESTIMATES
+from src.services.results import to_records
+from src.services.sqlparse import (
+    AGGREGATE_RE, Clauses, UnsupportedSQL, aggregate_calls, mask_literals, quote_identifier, split_top_level,
+)
+
+logger = logging.getLogger(__name__)
+
+SAMPLED_TABLES = ("ad_sales_metrics", "total_sales_metrics")
+SAMPLE_PREFIX = "_sample_"
+CATALOG_TABLE = "_samples"
+STRATUM_COLUMN = "item_id"
+WEIGHT_COLUMN = "_w"
+REPLICATE_COLUMN = "_replicate"
+
+class ApproximationUnsupported(Exception):
+    """The query cannot be answered from the samples"""
+
+def sample_table(table: str) -> str:
+    return f"{SAMPLE_PREFIX}{table}"
+
+def build_samples(conn: sqlite3.Connection, rate: Optional[float] = None, min_rows: Optional[int] = None,
+                  replicates: Optional[int] = None) -> Dict[str, int]:
+    """(Re)build the stratified sample of every sampled table present; returns sample rows per table"""
+    rate = settings.SAMPLE_RATE if rate is None else rate
+    min_rows = max(1, settings.SAMPLE_MIN_ROWS if min_rows is None else min_rows)
+    replicates = replicates or settings.SAMPLE_REPLICATES
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CATALOG_TABLE} (
+            table_name TEXT PRIMARY KEY,
+            population_rows INTEGER NOT NULL,
+            sample_rows INTEGER NOT NULL,
+            rate REAL NOT NULL,
+            replicates INTEGER NOT NULL
+        )
+    """)
+    built = {}
+    for table in SAMPLED_TABLES:
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info('{table}')")]
+        if STRATUM_COLUMN not in columns:
+            continue
+        names = ", ".join(f'"{column}"' for column in columns)
+        sample = sample_table(table)
+        conn.execute(f'DROP TABLE IF EXISTS "{sample}"')
+        # Rows are drawn in random order within each item; rotating the replicate
+        # by item spreads items with a single sampled row over every replicate
+        conn.execute(f"""
+            CREATE TABLE "{sample}" AS
+            WITH ranked AS (
+                SELECT {names},
+                       ROW_NUMBER() OVER (PARTITION BY {STRATUM_COLUMN} ORDER BY random()) AS _rn,
+                       COUNT(*) OVER (PARTITION BY {STRATUM_COLUMN}) AS _n
+                FROM "{table}"
+            ),
+            sized AS (
+                SELECT *, MIN(_n, MAX({min_rows}, CAST(ROUND(_n * {rate}) AS INTEGER))) AS _k FROM ranked
+            )
+            SELECT {names}, CAST(_n AS REAL) / _k AS {WEIGHT_COLUMN},
+                   (_rn + COALESCE({STRATUM_COLUMN}, 0)) % {replicates} AS {REPLICATE_COLUMN}
+            FROM sized
+            WHERE _rn <= _k
+        """)
+        (population,) = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()
+        (sampled,) = conn.execute(f'SELECT COUNT(*) FROM "{sample}"').fetchone()
+        conn.execute(f"INSERT OR REPLACE INTO {CATALOG_TABLE} VALUES (?, ?, ?, ?, ?)",
+                     (table, population, sampled, rate, replicates))
+        built[table] = sampled
+        logger.info(f"Sampled {sampled} of {population} rows of {table}")
+    return built
+
+def load_catalog(conn: sqlite3.Connection) -> Dict[str, Tuple[int, int, int]]:
+    """{table: (population rows, sample rows, replicates)}; empty when the database has no samples"""
+    try:
+        rows = conn.execute(f"SELECT table_name, population_rows, sample_rows, replicates FROM {CATALOG_TABLE}").fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    return {table: (population, sampled, replicates) for table, population, sampled, replicates in rows}
+
+def _weighted(function: str, argument: str, weight: str) -> str:
+    if function == "COUNT":
+        if argument == "*":
+            return f"TOTAL({weight})"
+        return f"TOTAL(CASE WHEN ({argument}) IS NOT NULL THEN {weight} END)"
+    if function == "AVG":
+        return f"(SUM(({argument}) * {weight}) / SUM(CASE WHEN ({argument}) IS NOT NULL THEN {weight} END))"
+    return f"{function}(({argument}) * {weight})"
+
+def _weight_aggregates(expression: str, weight: str) -> Tuple[str, bool]:
+    """Expression with weighted aggregates, and whether it estimates anything (MIN/MAX do not)"""
+    output, position, estimated = [], 0, False
+    for start, end, function, argument in aggregate_calls(expression):
+        if re.match(r"DISTINCT\b", argument, re.IGNORECASE):
+            raise ApproximationUnsupported("DISTINCT aggregates are not estimated")
+        output.append(expression[position:start])
+        if function in ("MIN", "MAX"):
+            output.append(expression[start:end])
+        else:
+            output.append(_weighted(function, argument, weight))
+            estimated = True
+        position = end
+    output.append(expression[position:])
+    return "".join(output), estimated
+
+class EstimatePlan:
+    """The query rewritten over a sample, once weighted and once per replicate group"""
+
+    def __init__(self, table: str, estimate_sql: str, replicate_sql: str, group_columns: int,
+                 estimated: List[bool]):
+        self.table = table
+        self.estimate_sql = estimate_sql
+        self.replicate_sql = replicate_sql
+        # Trailing group key columns both queries add, to match replicate rows to estimate rows
+        self.group_columns = group_columns
+        self.estimated = estimated
+
+def plan_estimate(query: str, catalog: Dict[str, Tuple[int, int, int]]) -> EstimatePlan:
+    """Rewrite an aggregate query over a sampled table; raises ApproximationUnsupported"""
+    try:
+        clauses = Clauses(query)
+        return _plan(clauses, catalog)
+    except UnsupportedSQL as e:
+        raise ApproximationUnsupported(str(e))
+
+def _plan(clauses: Clauses, catalog: Dict[str, Tuple[int, int, int]]) -> EstimatePlan:
+    source = re.match(r'^"?(\w+)"?(?:\s+(?:AS\s+)?"?(\w+)"?)?$', clauses.get("FROM"), re.IGNORECASE)
+    if not source or source.group(1).lower() not in catalog:
+        raise ApproximationUnsupported("not a single sampled table")
+    table = source.group(1).lower()
+    alias = source.group(2) or source.group(1)
+    select_masked = " ".join(mask_literals(item.expression) for item in clauses.items)
+    if not (clauses.get("GROUP BY") or AGGREGATE_RE.search(select_masked)):
+        raise ApproximationUnsupported("only aggregate queries are estimated")
+    if clauses.distinct:
+        raise ApproximationUnsupported("SELECT DISTINCT is not estimated")
+    if any(item.expression.endswith("*") for item in clauses.items):
+        raise ApproximationUnsupported("star columns are not estimated")
+
+    # Group expressions, with positions and aliases resolved, identify each output row
+    aliases = {item.alias.lower(): item for item in clauses.items if item.alias}
+    groups = []
+    if clauses.get("GROUP BY"):
+        for term in split_top_level(clauses.get("GROUP BY"), mask_literals(clauses.get("GROUP BY"))):
+            if term.isdigit():
+                if not 1 <= int(term) <= len(clauses.items):
+                    raise ApproximationUnsupported(f"GROUP BY position {term} out of range")
+                term = clauses.items[int(term) - 1].expression
+            elif term.lower() in aliases:
+                term = aliases[term.lower()].expression
+            groups.append(term)
+    group_select = "".join(f", {expression} AS _g{i}" for i, expression in enumerate(groups))
+
+    def body(weight: str, extra: str = "") -> Tuple[str, List[bool]]:
+        items, estimated = [], []
+        for item in clauses.items:
+            text, flag = _weight_aggregates(item.expression, weight)
+            # Named as the original query names its columns
+            items.append(f"{text} AS {quote_identifier(item.name)}")
+            estimated.append(flag)
+        where = f" WHERE {clauses.get('WHERE')}" if clauses.get("WHERE") else ""
+        return f"SELECT {', '.join(items)}{group_select}{extra} FROM \"{sample_table(table)}\" AS \"{alias}\"{where}", estimated
+
+    estimate_sql, estimated = body(WEIGHT_COLUMN)
+    if clauses.get("GROUP BY"):
+        estimate_sql += f" GROUP BY {clauses.get('GROUP BY')}"
+    if clauses.get("HAVING"):
+        estimate_sql += f" HAVING {_weight_aggregates(clauses.get('HAVING'), WEIGHT_COLUMN)[0]}"
+    if clauses.get("ORDER BY"):
+        estimate_sql += f" ORDER BY {_weight_aggregates(clauses.get('ORDER BY'), WEIGHT_COLUMN)[0]}"
+    if clauses.get("LIMIT"):
+        estimate_sql += f" LIMIT {clauses.get('LIMIT')}"
+
+    # Each replicate holds 1/K of the sample, so its estimates scale the weights by K
+    replicates = catalog[table][2]
+    replicate_sql, _ = body(f"({WEIGHT_COLUMN} * {replicates})", f", {REPLICATE_COLUMN}")
+    group_by = f"{clauses.get('GROUP BY')}, " if clauses.get("GROUP BY") else ""
+    replicate_sql += f" GROUP BY {group_by}{REPLICATE_COLUMN}"
+
+    return EstimatePlan(table, estimate_sql, replicate_sql, len(groups), estimated)
+
+class Estimate:
+    """Estimated rows with a +/- error bound for every estimated value"""
+
+    def __init__(self, columns: List[str], rows: List[tuple], bounds: List[List[Optional[float]]],
+                 table: str, sample_rows: int, population_rows: int, confidence: float):
+        self.columns = columns
+        self.rows = rows
+        self.bounds = bounds
+        self.table = table
+        self.sample_rows = sample_rows
+        self.population_rows = population_rows
+        self.confidence = confidence
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "answer": to_records(self.columns, self.rows),
+            # Per row: {column: bound} for the estimated columns
+            "error_bounds": [{column: bound for column, bound in zip(self.columns, row) if bound is not None}
+                             for row in self.bounds],
+            "confidence": self.confidence,
+            "sample_rows": self.sample_rows,
+            "population_rows": self.population_rows,
+            "approximate": True,
+        }
+
+def _bound(values: List[Any], z: float) -> Optional[float]:
+    """z times the random-groups standard error of the replicate estimates"""
+    values = [float(v) for v in values if isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v)]
+    k = len(values)
+    if k < 2:
+        return None
+    mean = sum(values) / k
+    return z * math.sqrt(sum((v - mean) ** 2 for v in values) / (k * (k - 1)))
+
+def estimate_query(query: str) -> Optional[Estimate]:
+    """Estimate an aggregate query from the served generation's samples; None when it does not qualify"""
+    if not settings.APPROXIMATE_ENABLED or settings.DB_BACKEND != "sqlite" or not query:
+        return None
+    with generations.use() as generation:
+        conn = open_readonly(generation.path)
+        try:
+            return estimate_on(conn, query)
+        finally:
+            conn.close()
+
+def estimate_on(conn: sqlite3.Connection, query: str, min_rows: Optional[int] = None) -> Optional[Estimate]:
+    """Estimate ``query`` from the samples in ``conn`` if a sampled table of at least ``min_rows`` rows qualifies"""
+    min_rows = settings.APPROXIMATE_MIN_ROWS if min_rows is None else min_rows
+    catalog = {table: info for table, info in load_catalog(conn).items() if info[0] >= min_rows}
+    if not catalog:
+        return None
+    try:
+        plan = plan_estimate(query, catalog)
+    except ApproximationUnsupported as e:
+        logger.debug(f"Not estimating query: {e}")
+        ESTIMATES.inc(outcome="unsupported")
+        return None
+    try:
+        cursor = conn.execute(plan.estimate_sql)
+        rows = cursor.fetchall()
+        columns = [d[0] for d in cursor.description[:len(cursor.description) - plan.group_columns]]
+        replicate_rows = conn.execute(plan.replicate_sql).fetchall()
+    except sqlite3.Error as e:
+        logger.info(f"Estimate failed, answering exactly only: {e}")
+        ESTIMATES.inc(outcome="error")
+        return None
+
+    width = len(columns)
+    replicates: Dict[tuple, List[tuple]] = {}
+    for row in replicate_rows:
+        replicates.setdefault(tuple(row[width:-1]), []).append(row[:width])
+    z = NormalDist().inv_cdf(0.5 + settings.APPROXIMATE_CONFIDENCE / 2)
+    bounds = []
+    for row in rows:
+        group = replicates.get(tuple(row[width:]), [])
+        bounds.append([_bound([values[j] for values in group], z) if plan.estimated[j] else None
+                       for j in range(width)])
+    ESTIMATES.inc(outcome="estimated")
+    population, sampled, _ = catalog[plan.table]
+    return Estimate(columns, [row[:width] for row in rows], bounds, plan.table, sampled, population,
+                    settings.APPROXIMATE_CONFIDENCE)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build samples or compare an estimate with the exact answer")
+    parser.add_argument("command", choices=["build", "estimate"])
+    parser.add_argument("query", nargs="?", help="SQL to estimate")
+    parser.add_argument("--db", help="Database file to add samples to (new generations get them when built)")
+    parser.add_argument("--rate", type=float, default=settings.SAMPLE_RATE)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        if not args.db:
+            parser.error("build needs --db")
+        conn = sqlite3.connect(args.db)
+        try:
+            built = build_samples(conn, rate=args.rate)
+            conn.execute("ANALYZE")
+            conn.commit()
+        finally:
+            conn.close()
+        print(", ".join(f"{table}: {rows:,d} sample rows" for table, rows in built.items()) or "No sampled tables found")
+        return
+
+    start = time.perf_counter()
+    estimate = estimate_query(args.query)
+    estimated_in = time.perf_counter() - start
+    if estimate is None:
+        print("Query is not estimated (unsupported query, no samples, or tables under APPROXIMATE_MIN_ROWS)")
+        return
+    with generations.use() as generation:
+        conn = open_readonly(generation.path)
+        start = time.perf_counter()
+        exact = conn.execute(args.query).fetchall()
+        exact_in = time.perf_counter() - start
+        conn.close()
+    print(f"Estimate in {estimated_in * 1000:.1f} ms from {estimate.sample_rows:,d} of {estimate.population_rows:,d} rows; "
+          f"exact in {exact_in * 1000:.1f} ms")
+    for row, bounds, exact_row in zip(estimate.rows, estimate.bounds, exact):
+        cells = [f"{value} ± {bound:.4g}" if bound is not None else str(value) for value, bound in zip(row, bounds)]
+        print(f"  {' | '.join(cells)}    exact: {' | '.join(map(str, exact_row))}")
+
+if __name__ == "__main__":
+    main()
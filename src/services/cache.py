@@ -0,0 +1,471 @@
+"""
+Shared cache tier for LLM SQL, query results and rendered charts
+
+Cache stores values in namespaces ("llm", "results", "charts"), each with
+its own entry and byte limits (CACHE_LIMITS), least recently used entries
+evicted first. Every entry records the database it was computed on (its
+scope, see database_scope()) and the data generation; lookups only return
+entries of this database's current generation, and its entries of other
+generations are dropped once a worker sees a new one. Deployments sharing
+a store therefore never see or invalidate each other's entries. Values
+are stored as JSON, so any backend can hold them.
+
+The backend is chosen by CACHE_BACKEND:
+- memory: an LRU dict per process, so workers warm separately
+- sqlite: one WAL-mode file (CACHE_PATH) shared by every worker on the host
+- network: a cache server at CACHE_URL shared across hosts. The server
+  shipped here (``python -m src.services.cache serve``) keeps entries in
+  memory and is the local stand-in for a dedicated cache service.
+
+A failing backend never fails a request: errors count as misses.
+
+Usage:
+    python -m src.services.cache serve --port 9200
+    python -m src.services.cache stats
+    python -m src.services.cache clear [--namespace results]
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from config.settings import settings
+from src.services.generations import current_generation
+from src.services.metrics import CACHE_REQUESTS
+from src.services.results import QueryRows, ResultInfo
+
+logger = logging.getLogger(__name__)
+
+NAMESPACES = ("llm", "results", "charts")
+
+Limits = Dict[str, Tuple[int, int]]
+
+def database_scope() -> str:
+    """Identity of the database this process serves, so deployments sharing a cache store stay apart"""
+    parts = [settings.DB_BACKEND, os.path.realpath(settings.DB_GENERATIONS_DIR), os.path.realpath(settings.DB_PATH)]
+    if settings.DB_BACKEND == "duckdb":
+        parts.append(os.path.realpath(settings.PARQUET_DIR))
+    elif settings.DB_BACKEND == "sharded":
+        parts.append(os.path.realpath(settings.SHARD_DIR))
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()[:16]
+
+class CacheBackend(ABC):
+    """Byte store keyed by (namespace, key) whose entries carry a database scope and a data generation"""
+
+    def __init__(self, limits: Limits):
+        # namespace -> (max entries, max megabytes); 0 megabytes means no byte limit
+        self.limits = limits
+
+    def limit(self, namespace: str) -> Tuple[int, int]:
+        """(max entries, max bytes) for a namespace; (0, 0) means it is not cached"""
+        entries, megabytes = self.limits.get(namespace, (0, 0))
+        return entries, megabytes * 1024 * 1024
+
+    @abstractmethod
+    def get(self, namespace: str, key: str, generation: int) -> Optional[bytes]:
+        """The stored value, or None if missing or from another generation"""
+
+    @abstractmethod
+    def set(self, namespace: str, key: str, scope: str, generation: int, value: bytes) -> None:
+        """Store a value, evicting least recently used entries over the namespace limits"""
+
+    @abstractmethod
+    def invalidate(self, scope: str, generation: int) -> int:
+        """Drop the scope's entries of every other generation; returns how many were removed"""
+
+    @abstractmethod
+    def clear(self, namespace: Optional[str] = None) -> None:
+        """Drop every entry, or every entry of one namespace"""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """{namespace: {"entries": n, "bytes": n}}"""
+
+    def close(self) -> None:
+        pass
+
+class InProcessCacheBackend(CacheBackend):
+    """LRU dicts in this process"""
+
+    def __init__(self, limits: Limits):
+        super().__init__(limits)
+        self._entries: Dict[str, "OrderedDict[str, Tuple[str, int, bytes]]"] = {}
+        self._bytes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: str, generation: int) -> Optional[bytes]:
+        with self._lock:
+            entries = self._entries.get(namespace)
+            entry = entries.get(key) if entries else None
+            if entry is None or entry[1] != generation:
+                return None
+            entries.move_to_end(key)
+            return entry[2]
+
+    def set(self, namespace: str, key: str, scope: str, generation: int, value: bytes) -> None:
+        max_entries, max_bytes = self.limit(namespace)
+        if not max_entries or (max_bytes and len(value) > max_bytes):
+            return
+        with self._lock:
+            entries = self._entries.setdefault(namespace, OrderedDict())
+            old = entries.pop(key, None)
+            size = self._bytes.get(namespace, 0) - (len(old[2]) if old else 0) + len(value)
+            entries[key] = (scope, generation, value)
+            while len(entries) > max_entries or (max_bytes and size > max_bytes):
+                _, (_, _, evicted) = entries.popitem(last=False)
+                size -= len(evicted)
+            self._bytes[namespace] = size
+
+    def invalidate(self, scope: str, generation: int) -> int:
+        removed = 0
+        with self._lock:
+            for namespace, entries in self._entries.items():
+                stale = [key for key, (entry_scope, entry_generation, _) in entries.items()
+                         if entry_scope == scope and entry_generation != generation]
+                for key in stale:
+                    self._bytes[namespace] -= len(entries.pop(key)[2])
+                removed += len(stale)
+        return removed
+
+    def clear(self, namespace: Optional[str] = None) -> None:
+        with self._lock:
+            for name in [namespace] if namespace else list(self._entries):
+                self._entries.pop(name, None)
+                self._bytes.pop(name, None)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {name: {"entries": len(entries), "bytes": self._bytes.get(name, 0)}
+                    for name, entries in self._entries.items()}
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    One SQLite file shared by every process on the host. WAL mode lets
+    readers proceed while another worker writes; each thread keeps its own
+    connection.
+    """
+
+    def __init__(self, path: str, limits: Limits):
+        super().__init__(limits)
+        self.path = path
+        self._local = threading.local()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connection()
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(cache_entries)")}
+        if columns and "scope" not in columns:
+            # Entries from before scopes existed cannot be attributed to a database
+            conn.execute("DROP TABLE cache_entries")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                scope TEXT NOT NULL,
+                generation INTEGER NOT NULL,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_entries_lru ON cache_entries (namespace, accessed)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit; eviction opens its own transaction
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace: str, key: str, generation: int) -> Optional[bytes]:
+        conn = self._connection()
+        row = conn.execute("SELECT generation, value FROM cache_entries WHERE namespace = ? AND key = ?",
+                           (namespace, key)).fetchone()
+        if row is None or row[0] != generation:
+            return None
+        conn.execute("UPDATE cache_entries SET accessed = ? WHERE namespace = ? AND key = ?",
+                     (time.time(), namespace, key))
+        return row[1]
+
+    def set(self, namespace: str, key: str, scope: str, generation: int, value: bytes) -> None:
+        max_entries, max_bytes = self.limit(namespace)
+        if not max_entries or (max_bytes and len(value) > max_bytes):
+            return
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT OR REPLACE INTO cache_entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (namespace, key, scope, generation, value, len(value), time.time()))
+            entries, size = conn.execute("SELECT COUNT(*), TOTAL(size) FROM cache_entries WHERE namespace = ?",
+                                         (namespace,)).fetchone()
+            if entries > max_entries or (max_bytes and size > max_bytes):
+                evict = []
+                for old_key, old_size in conn.execute(
+                        "SELECT key, size FROM cache_entries WHERE namespace = ? ORDER BY accessed", (namespace,)):
+                    if entries <= max_entries and (not max_bytes or size <= max_bytes):
+                        break
+                    evict.append((namespace, old_key))
+                    entries -= 1
+                    size -= old_size
+                conn.executemany("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", evict)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def invalidate(self, scope: str, generation: int) -> int:
+        return self._connection().execute("DELETE FROM cache_entries WHERE scope = ? AND generation != ?",
+                                          (scope, generation)).rowcount
+
+    def clear(self, namespace: Optional[str] = None) -> None:
+        if namespace:
+            self._connection().execute("DELETE FROM cache_entries WHERE namespace = ?", (namespace,))
+        else:
+            self._connection().execute("DELETE FROM cache_entries")
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        rows = self._connection().execute(
+            "SELECT namespace, COUNT(*), TOTAL(size) FROM cache_entries GROUP BY namespace").fetchall()
+        return {name: {"entries": entries, "bytes": int(size)} for name, entries, size in rows}
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+class NetworkCacheBackend(CacheBackend):
+    """
+    Client for a cache server over HTTP:
+    GET /cache/{namespace}/{key}?generation=N, PUT with &scope=S as well,
+    POST /invalidate?scope=S&generation=N,
+    DELETE /cache[/{namespace}] and GET /stats. The server enforces the limits.
+    """
+
+    def __init__(self, url: str, timeout: float = 2.0):
+        super().__init__({})
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, method: str, path: str, data: Optional[bytes] = None) -> Optional[bytes]:
+        request = urllib.request.Request(f"{self.url}{path}", data=data, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+
+    def get(self, namespace: str, key: str, generation: int) -> Optional[bytes]:
+        return self._request("GET", f"/cache/{namespace}/{key}?generation={generation}")
+
+    def set(self, namespace: str, key: str, scope: str, generation: int, value: bytes) -> None:
+        self._request("PUT", f"/cache/{namespace}/{key}?{urlencode({'scope': scope, 'generation': generation})}", value)
+
+    def invalidate(self, scope: str, generation: int) -> int:
+        query = urlencode({"scope": scope, "generation": generation})
+        return json.loads(self._request("POST", f"/invalidate?{query}", b""))["removed"]
+
+    def clear(self, namespace: Optional[str] = None) -> None:
+        self._request("DELETE", f"/cache/{namespace}" if namespace else "/cache")
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return json.loads(self._request("GET", "/stats"))
+
+def create_cache_backend(name: Optional[str] = None) -> CacheBackend:
+    """Build the backend selected by CACHE_BACKEND ("memory", "sqlite" or "network")"""
+    name = (name or settings.CACHE_BACKEND).lower()
+    if name == "memory":
+        return InProcessCacheBackend(settings.CACHE_LIMITS)
+    if name == "sqlite":
+        return SQLiteCacheBackend(settings.CACHE_PATH, settings.CACHE_LIMITS)
+    if name == "network":
+        return NetworkCacheBackend(settings.CACHE_URL, settings.CACHE_TIMEOUT)
+    raise ValueError(f"Unknown cache backend '{name}', expected 'memory', 'sqlite' or 'network'")
+
+def _encode(value: Any) -> bytes:
+    if isinstance(value, QueryRows):
+        return json.dumps({"rows": list(value)}).encode("utf-8")
+    return json.dumps({"value": value}).encode("utf-8")
+
+def _decode(data: bytes) -> Any:
+    payload = json.loads(data)
+    if "rows" in payload:
+        return QueryRows(payload["rows"], ResultInfo(len(payload["rows"])))
+    return payload["value"]
+
+class Cache:
+    """Namespaced, generation-aware cache in front of a backend; the backend is created on first use"""
+
+    def __init__(self, backend: Optional[CacheBackend] = None, enabled: bool = True,
+                 limits: Optional[Limits] = None, scope: Optional[str] = None):
+        self.enabled = enabled
+        self.limits = settings.CACHE_LIMITS if limits is None else limits
+        self.scope = scope or database_scope()
+        self._backend = backend
+        self._backend_lock = threading.Lock()
+        self._generation: Optional[int] = None
+
+    @property
+    def backend(self) -> CacheBackend:
+        if self._backend is None:
+            with self._backend_lock:
+                if self._backend is None:
+                    self._backend = create_cache_backend()
+        return self._backend
+
+    def caches(self, namespace: str) -> bool:
+        return self.enabled and self.limits.get(namespace, (0, 0))[0] > 0
+
+    def generation(self) -> int:
+        """Current data generation; dropping the previous generation's entries the first time a new one is seen"""
+        generation = current_generation()
+        if generation != self._generation:
+            self._generation = generation
+            if self.enabled:
+                try:
+                    removed = self.backend.invalidate(self.scope, generation)
+                    if removed:
+                        logger.info(f"Dropped {removed} cache entries from earlier data generations")
+                except Exception as e:
+                    logger.warning(f"Cache invalidation failed: {e}")
+        return generation
+
+    def _key(self, key: str) -> str:
+        return hashlib.sha256(f"{self.scope}\0{key}".encode("utf-8")).hexdigest()
+
+    def get(self, namespace: str, key: str) -> Any:
+        """The cached value for ``key``, or None"""
+        if not self.caches(namespace):
+            return None
+        try:
+            data = self.backend.get(namespace, self._key(key), self.generation())
+            value = None if data is None else _decode(data)
+        except Exception as e:
+            logger.warning(f"Cache read from '{namespace}' failed: {e}")
+            CACHE_REQUESTS.inc(namespace=namespace, outcome="error")
+            return None
+        CACHE_REQUESTS.inc(namespace=namespace, outcome="miss" if value is None else "hit")
+        return value
+
+    def set(self, namespace: str, key: str, value: Any, generation: Optional[int] = None) -> None:
+        """
+        Store a value. Pass the generation read before computing it, so a value
+        computed across a data refresh is not filed under the new generation.
+        """
+        if not self.caches(namespace):
+            return
+        try:
+            generation = self.generation() if generation is None else generation
+            self.backend.set(namespace, self._key(key), self.scope, generation, _encode(value))
+        except Exception as e:
+            logger.warning(f"Cache write to '{namespace}' failed: {e}")
+            CACHE_REQUESTS.inc(namespace=namespace, outcome="error")
+
+    def clear(self, namespace: Optional[str] = None) -> None:
+        try:
+            self.backend.clear(namespace)
+        except Exception as e:
+            logger.warning(f"Cache clear failed: {e}")
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return self.backend.stats()
+
+# Global cache instance
+cache = Cache(enabled=settings.CACHE_ENABLED)
+
+class _CacheHandler(BaseHTTPRequestHandler):
+    backend: CacheBackend = None
+
+    def _route(self) -> Tuple[list, Dict[str, list]]:
+        url = urlparse(self.path)
+        return [part for part in url.path.split("/") if part], parse_qs(url.query)
+
+    def do_GET(self):
+        parts, query = self._route()
+        if parts == ["stats"]:
+            self._reply(200, json.dumps(self.backend.stats()).encode("utf-8"))
+        elif len(parts) == 3 and parts[0] == "cache" and "generation" in query:
+            value = self.backend.get(parts[1], parts[2], int(query["generation"][0]))
+            self._reply(200, value) if value is not None else self._reply(404, b"")
+        else:
+            self._reply(404, b"")
+
+    def do_PUT(self):
+        parts, query = self._route()
+        if len(parts) != 3 or parts[0] != "cache" or "generation" not in query or "scope" not in query:
+            self._reply(404, b"")
+            return
+        value = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.backend.set(parts[1], parts[2], query["scope"][0], int(query["generation"][0]), value)
+        self._reply(204, b"")
+
+    def do_POST(self):
+        parts, query = self._route()
+        if parts != ["invalidate"] or "generation" not in query or "scope" not in query:
+            self._reply(404, b"")
+            return
+        removed = self.backend.invalidate(query["scope"][0], int(query["generation"][0]))
+        self._reply(200, json.dumps({"removed": removed}).encode("utf-8"))
+
+    def do_DELETE(self):
+        parts, _ = self._route()
+        if not parts or parts[0] != "cache" or len(parts) > 2:
+            self._reply(404, b"")
+            return
+        self.backend.clear(parts[1] if len(parts) == 2 else None)
+        self._reply(204, b"")
+
+    def _reply(self, status: int, body: bytes) -> None:
+        self.send_response(status)
+        if status != 204:
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if status != 204:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+def make_cache_server(backend: Optional[CacheBackend] = None, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """HTTP cache server over a backend (in-memory with CACHE_LIMITS by default); port 0 picks a free port"""
+    backend = backend or InProcessCacheBackend(settings.CACHE_LIMITS)
+    handler = type("CacheHandler", (_CacheHandler,), {"backend": backend})
+    return ThreadingHTTPServer((host, port), handler)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve, inspect or clear the shared cache")
+    parser.add_argument("command", choices=["serve", "stats", "clear"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--namespace", choices=NAMESPACES, help="Namespace to clear (default: all)")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        server = make_cache_server(host=args.host, port=args.port)
+        print(f"Serving cache on http://{args.host}:{server.server_address[1]}")
+        server.serve_forever()
+    elif args.command == "stats":
+        for namespace, stats in sorted(cache.stats().items()):
+            print(f"  {namespace:8s} {stats['entries']:>7,d} entries  {stats['bytes'] / 1024 / 1024:8.2f} MB")
+    else:
+        cache.clear(args.namespace)
+        print(f"Cleared {args.namespace or 'all namespaces'}")
+
+if __name__ == "__main__":
+    main()
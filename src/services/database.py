@@ -1,23 +1,350 @@
 """
 Database service for handling SQL operations
 """
+import os
+import re
 import sqlite3
-import pandas as pd
 import logging
-from typing import List, Dict, Any, Union
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Set, Tuple, Union
 from pathlib import Path
 
 from config.settings import settings
+from src.services.admission import AdmissionRejected, admission
+from src.services.generations import current_generation, generations, open_readonly
+from src.services.metrics import DATAFRAME_BUILD, QUERY_ERRORS, QUERY_LATENCY, QUERY_ROWS, SHARD_QUERIES
+from src.services.profiling import profile_stage
+from src.services.results import collect_rows, query_rows
 
 logger = logging.getLogger(__name__)
 
+QueryResult = Tuple[List[str], List[tuple]]
+
+class DatabaseBackend(ABC):
+    """Analytical engine that executes SQL and describes its tables"""
+
+    dialect: str = ""
+
+    @abstractmethod
+    def execute(self, query: str) -> QueryResult:
+        """Run a query and return (column names, rows)"""
+
+    @contextmanager
+    def fetch(self, query: str) -> Iterator[Tuple[List[str], Iterator[List[tuple]]]]:
+        """Run a query and yield (column names, row batches) while its cursor is open"""
+        columns, rows = self.execute(query)
+        yield columns, iter([rows] if rows else [])
+
+    @abstractmethod
+    def get_table_names(self) -> List[str]:
+        """List the queryable tables"""
+
+    def get_table_schema(self, table_name: str) -> List[Dict[str, Any]]:
+        """Describe a table's columns; both engines support PRAGMA table_info"""
+        _, rows = self.execute(f"PRAGMA table_info('{table_name}')")
+        return [
+            {
+                "column_id": col[0],
+                "name": col[1],
+                "type": col[2],
+                "not_null": bool(col[3]),
+                "default_value": col[4],
+                "primary_key": bool(col[5])
+            }
+            for col in rows
+        ]
+
+    def identifiers(self) -> Set[str]:
+        """Lower-cased table and column names, used by SQL normalization"""
+        names = set()
+        for table in self.get_table_names():
+            names.add(table.lower())
+            names.update(col["name"].lower() for col in self.get_table_schema(table))
+        return names
+
+    def close(self) -> None:
+        pass
+
+class SQLiteBackend(DatabaseBackend):
+    """Row-oriented SQLite file, the default engine"""
+
+    dialect = "sqlite"
+
+    def __init__(self, db_path: Optional[str] = None):
+        # None follows the published database generation
+        self.db_path = db_path
+
+    @property
+    def path(self) -> str:
+        return self.db_path or generations.current().path
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        with nullcontext() if self.db_path else generations.use() as generation:
+            conn = sqlite3.connect(self.db_path) if self.db_path else open_readonly(generation.path)
+            try:
+                yield conn
+            finally:
+                conn.close()
+
+    def execute(self, query: str) -> QueryResult:
+        from src.services.partitions import route_query
+
+        with self._connection() as conn:
+            cursor = conn.execute(route_query(conn, query))
+            rows = cursor.fetchall()
+            columns = [description[0] for description in cursor.description or ()]
+            return columns, rows
+
+    @contextmanager
+    def fetch(self, query: str) -> Iterator[Tuple[List[str], Iterator[List[tuple]]]]:
+        from src.services.partitions import route_query
+        from src.services.results import fetch_batches
+
+        with self._connection() as conn:
+            cursor = conn.execute(route_query(conn, query))
+            yield [description[0] for description in cursor.description or ()], fetch_batches(cursor)
+
+    def get_table_names(self) -> List[str]:
+        from src.services.eligibility import INTERNAL_TABLES
+        from src.services.partitions import INTERNAL_TABLE_RE
+
+        # Partitioned and encoded tables are views over their storage tables
+        _, rows = self.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view');")
+        return [row[0] for row in rows if not INTERNAL_TABLE_RE.match(row[0]) and row[0] not in INTERNAL_TABLES]
+
+class DuckDBBackend(DatabaseBackend):
+    """
+    Embedded columnar engine over a directory of Parquet files, one
+    ``<table>.parquet`` file (or ``<table>/`` directory of files) per table
+    """
+
+    dialect = "duckdb"
+
+    def __init__(self, parquet_dir: str, threads: Optional[int] = None):
+        try:
+            import duckdb
+        except ImportError:
+            raise ImportError("The duckdb backend requires the duckdb package (pip install duckdb)")
+
+        self.parquet_dir = Path(parquet_dir)
+        self._conn = duckdb.connect(database=":memory:")
+        if threads:
+            self._conn.execute(f"SET threads = {int(threads)}")
+        self._tables: List[str] = []
+        self._local = threading.local()
+        self.refresh_views()
+
+    def refresh_views(self) -> None:
+        """(Re)create one view per Parquet table so new files are picked up"""
+        tables = []
+        for path in sorted(self.parquet_dir.glob("*")):
+            if path.suffix == ".parquet":
+                table, source = path.stem, str(path)
+            elif path.is_dir() and any(path.glob("*.parquet")):
+                table, source = path.name, str(path / "*.parquet")
+            else:
+                continue
+            self._conn.execute(f"CREATE OR REPLACE VIEW \"{table}\" AS SELECT * FROM read_parquet('{source}')")
+            tables.append(table)
+        self._tables = tables
+
+    def _cursor(self):
+        # A DuckDB connection must not be shared between threads; cursors are
+        # per-thread connections to the same in-memory catalog
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None:
+            cursor = self._local.cursor = self._conn.cursor()
+        return cursor
+
+    def execute(self, query: str) -> QueryResult:
+        cursor = self._cursor()
+        cursor.execute(query)
+        columns = [description[0] for description in cursor.description or ()]
+        rows = cursor.fetchall() if cursor.description else []
+        return columns, rows
+
+    @contextmanager
+    def fetch(self, query: str) -> Iterator[Tuple[List[str], Iterator[List[tuple]]]]:
+        from src.services.results import fetch_batches
+
+        cursor = self._cursor()
+        cursor.execute(query)
+        if not cursor.description:
+            yield [], iter([])
+            return
+        yield [description[0] for description in cursor.description], fetch_batches(cursor)
+
+    def get_table_names(self) -> List[str]:
+        return list(self._tables)
+
+    def close(self) -> None:
+        self._conn.close()
+
+class ShardedBackend(DatabaseBackend):
+    """
+    SQLite shards split by item_id (see src/services/sharding.py), queried
+    scatter-gather; queries that cannot be split run on the unsharded database.
+    Shards built from another database than the one served (an earlier
+    generation) are not used; a rebuilt manifest is picked up on the next query.
+    """
+
+    dialect = "sqlite"
+
+    def __init__(self, shard_dir: str, nodes: Optional[List[str]] = None, fallback: bool = True,
+                 db_path: Optional[str] = None):
+        self.shard_dir = shard_dir
+        self.nodes = nodes
+        self.db_path = db_path
+        self.fallback = SQLiteBackend(db_path) if fallback else None
+        self.coordinator = None
+        self.manifest: Dict[str, Any] = {}
+        self._manifest_key = None
+        self._lock = threading.Lock()
+        self._stale_warned: Optional[Tuple[str, str]] = None
+        self._current()
+
+    def _current(self):
+        """The coordinator, reopened if the manifest was rebuilt; None while the shards are stale"""
+        from src.services.sharding import MANIFEST_FILE, ShardCoordinator, open_shards, shards_current
+
+        stat = os.stat(Path(self.shard_dir) / MANIFEST_FILE)
+        key = (stat.st_ino, stat.st_mtime_ns)
+        with self._lock:
+            if key != self._manifest_key:
+                shards, manifest = open_shards(self.shard_dir, self.nodes)
+                if self.coordinator is not None:
+                    self.coordinator.close()
+                self.coordinator = ShardCoordinator(shards, self.fallback)
+                self.manifest, self._manifest_key = manifest, key
+            coordinator, manifest = self.coordinator, self.manifest
+
+        source = self.db_path or generations.current().path
+        if shards_current(manifest, source):
+            return coordinator
+        if self._stale_warned != (manifest.get("source"), source):
+            self._stale_warned = (manifest.get("source"), source)
+            logger.warning(f"Shards in {self.shard_dir} were built from {manifest.get('source')}, not the served "
+                           f"{source}; rebuild them with python -m src.services.sharding build")
+        return None
+
+    def _stale(self) -> SQLiteBackend:
+        from src.services.sharding import ShardingUnsupported
+
+        if self.fallback is None:
+            raise ShardingUnsupported("shards are stale and SHARD_FALLBACK is disabled; rebuild them")
+        SHARD_QUERIES.inc(plan="stale")
+        return self.fallback
+
+    def execute(self, query: str) -> QueryResult:
+        coordinator = self._current()
+        if coordinator is None:
+            return self._stale().execute(query)
+        return coordinator.execute(query)
+
+    @contextmanager
+    def fetch(self, query: str) -> Iterator[Tuple[List[str], Iterator[List[tuple]]]]:
+        # Merged rows stream from the coordinator's scratch database into the row cap and spill
+        coordinator = self._current()
+        source = coordinator or self._stale()
+        with source.fetch(query) as result:
+            yield result
+
+    def get_table_names(self) -> List[str]:
+        self._current()
+        return self.manifest["sharded_tables"] + self.manifest["replicated_tables"]
+
+    def close(self) -> None:
+        if self.coordinator is not None:
+            self.coordinator.close()
+
+def create_backend(name: Optional[str] = None, db_path: Optional[str] = None) -> DatabaseBackend:
+    """Build the backend selected by DB_BACKEND ("sqlite", "duckdb" or "sharded")"""
+    name = (name or settings.DB_BACKEND).lower()
+    if name == "sqlite":
+        return SQLiteBackend(db_path)
+    if name == "duckdb":
+        return DuckDBBackend(settings.PARQUET_DIR, settings.DUCKDB_THREADS)
+    if name == "sharded":
+        return ShardedBackend(settings.SHARD_DIR, settings.SHARD_NODES, settings.SHARD_FALLBACK, db_path)
+    raise ValueError(f"Unknown database backend '{name}', expected 'sqlite', 'duckdb' or 'sharded'")
+
+_FENCE_RE = re.compile(r"```(?:sql)?", re.IGNORECASE)
+# A double-quoted token right after a comparison: SQLite falls back to a string
+# literal when no such column exists, DuckDB always reads an identifier
+_DOUBLE_QUOTED_RE = re.compile(r'((?:=|<>|!=|<=|>=|<|>|\bLIKE|\bIN\s*\()\s*)"([^"]*)"', re.IGNORECASE)
+_STRFTIME_RE = re.compile(r"strftime\(\s*('[^']*')\s*,\s*([\w.\"]+|'[^']*')\s*\)", re.IGNORECASE)
+_SQLITE_NOW = [
+    (re.compile(r"\bdate\(\s*'now'\s*\)", re.IGNORECASE), "current_date"),
+    (re.compile(r"\bdatetime\(\s*'now'\s*\)", re.IGNORECASE), "current_timestamp"),
+]
+_REAL_CAST_RE = re.compile(r"\bAS\s+REAL\b", re.IGNORECASE)
+_ILIKE_RE = re.compile(r"\bILIKE\b", re.IGNORECASE)
+
+def normalize_sql(query: str, dialect: str, identifiers: Optional[Iterable[str]] = None) -> str:
+    """
+    Normalize LLM-generated SQL (which is written for SQLite) for an engine:
+    strip markdown fences and trailing semicolons, rewrite a double-quoted
+    token that follows a comparison operator, LIKE or IN ( as a single-quoted
+    string literal unless it names a known table or column, and translate
+    the SQLite-only functions the model tends to use.
+    """
+    query = _FENCE_RE.sub("", query).strip().rstrip(";").strip()
+
+    if identifiers is not None:
+        known = {name.lower() for name in identifiers}
+        query = _DOUBLE_QUOTED_RE.sub(
+            lambda m: m.group(0) if m.group(2).lower() in known else m.group(1) + "'" + m.group(2).replace("'", "''") + "'",
+            query,
+        )
+
+    if dialect == "duckdb":
+        # SQLite: strftime(format, value); DuckDB: strftime(timestamp, format)
+        query = _STRFTIME_RE.sub(lambda m: f"strftime(CAST({m.group(2)} AS TIMESTAMP), {m.group(1)})", query)
+        for pattern, replacement in _SQLITE_NOW:
+            query = pattern.sub(replacement, query)
+        # REAL is single precision in DuckDB but double in SQLite
+        query = _REAL_CAST_RE.sub("AS DOUBLE", query)
+    elif dialect == "sqlite":
+        # SQLite LIKE is already case-insensitive for ASCII
+        query = _ILIKE_RE.sub("LIKE", query)
+    return query
+
+def export_to_parquet(db_path: str, parquet_dir: str, tables: Optional[List[str]] = None) -> List[str]:
+    """Copy SQLite tables to ``<parquet_dir>/<table>.parquet`` for the duckdb backend"""
+    import duckdb
+    import pandas as pd
+
+    os.makedirs(parquet_dir, exist_ok=True)
+    source = SQLiteBackend(db_path)
+    exported = []
+    duck = duckdb.connect()
+    try:
+        for table in tables or source.get_table_names():
+            with sqlite3.connect(db_path) as conn:
+                df = pd.read_sql_query(f'SELECT * FROM "{table}"', conn)
+            duck.register("export_df", df)
+            target = os.path.join(parquet_dir, f"{table}.parquet")
+            duck.execute(f"COPY export_df TO '{target}' (FORMAT PARQUET)")
+            duck.unregister("export_df")
+            exported.append(target)
+    finally:
+        duck.close()
+    return exported
+
 class DatabaseService:
     """Service for database operations"""
     
-    def __init__(self, db_path: str = None):
+    def __init__(self, db_path: str = None, backend: Optional[DatabaseBackend] = None):
         """Initialize database service"""
         self.db_path = db_path or settings.DB_PATH
-        self._ensure_db_exists()
+        if backend is None and settings.DB_BACKEND == "sqlite":
+            self._ensure_db_exists()
+        # Without an explicit path the SQLite backend follows the published generation
+        self.backend = backend or create_backend(db_path=db_path)
+        self._identifiers: Optional[Tuple[int, Set[str]]] = None
     
     def _ensure_db_exists(self) -> None:
         """Ensure database file exists"""
@@ -45,31 +372,50 @@ class DatabaseService:
             query: SQL query string
             
         Returns:
-            Query results as list of dictionaries or error message
+            Query results as list of dictionaries (QueryRows, capped at
+            RESULT_ROW_CAP with the rest spilled to disk) or error message
         """
         try:
+            query = normalize_sql(query, self.backend.dialect, self.identifiers())
             logger.info(f"Executing query: {query}")
             
-            with sqlite3.connect(self.db_path) as conn:
-                df = pd.read_sql_query(query, conn)
-                results = df.to_dict(orient="records")
+            # Rows past RESULT_ROW_CAP spill to disk instead of memory
+            with admission.stage("sql"), profile_stage("sql"), QUERY_LATENCY.time(source="service"):
+                with self.backend.fetch(query) as (columns, batches):
+                    rows, info = collect_rows(columns, batches)
+            QUERY_ROWS.observe(info.total_rows if info.total_rows is not None else len(rows), source="service")
+            
+            with profile_stage("dataframe"), DATAFRAME_BUILD.time(source="service"):
+                results = query_rows(columns, rows, info)
                 
-            logger.info(f"Query executed successfully, returned {len(results)} rows")
+            logger.info(f"Query executed successfully, returned {len(results)} rows"
+                        + (f" of {info.total_rows}" if info.truncated else ""))
             return results
             
+        except AdmissionRejected:
+            raise
+            
         except Exception as e:
+            QUERY_ERRORS.inc(source="service")
             error_msg = f"SQL Execution Error: {e}"
             logger.error(error_msg)
             return error_msg
     
+    def identifiers(self) -> Set[str]:
+        """Known table and column names, cached per database generation"""
+        generation = current_generation()
+        if self._identifiers is None or self._identifiers[0] != generation:
+            try:
+                self._identifiers = (generation, self.backend.identifiers())
+            except Exception as e:
+                logger.error(f"Failed to read identifiers: {e}")
+                return set()
+        return self._identifiers[1]
+    
     def get_table_names(self) -> List[str]:
         """Get list of table names in the database"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-                tables = [row[0] for row in cursor.fetchall()]
-            return tables
+            return self.backend.get_table_names()
         except Exception as e:
             logger.error(f"Failed to get table names: {e}")
             return []
@@ -77,22 +423,7 @@ class DatabaseService:
     def get_table_schema(self, table_name: str) -> List[Dict[str, Any]]:
         """Get schema information for a table"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(f"PRAGMA table_info({table_name});")
-                columns = cursor.fetchall()
-                
-                schema = []
-                for col in columns:
-                    schema.append({
-                        "column_id": col[0],
-                        "name": col[1],
-                        "type": col[2],
-                        "not_null": bool(col[3]),
-                        "default_value": col[4],
-                        "primary_key": bool(col[5])
-                    })
-                return schema
+            return self.backend.get_table_schema(table_name)
         except Exception as e:
             logger.error(f"Failed to get schema for table {table_name}: {e}")
             return []
@@ -135,7 +466,9 @@ class DatabaseService:
                 }
             
             return {
-                "database_path": self.db_path,
+                "database_path": getattr(self.backend, "path", self.db_path),
+                "generation": current_generation(),
+                "backend": self.backend.dialect,
                 "table_count": len(tables),
                 "tables": table_info
             }
@@ -143,5 +476,13 @@ class DatabaseService:
             logger.error(f"Failed to get database info: {e}")
             return {"error": str(e)}
 
-# Global database service instance
-db_service = DatabaseService()
+# Global database service instance, created by the application startup hook
+# (or on first use) rather than at import time
+db_service: Optional[DatabaseService] = None
+
+def get_db_service() -> DatabaseService:
+    """Return the global database service, creating it on first use"""
+    global db_service
+    if db_service is None:
+        db_service = DatabaseService()
+    return db_service
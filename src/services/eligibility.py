@@ -0,0 +1,181 @@
+"""
+Eligibility message index, built at ingest
+
+eligibility_table repeats a handful of long explanation strings thousands of
+times. build_eligibility_index() stores each distinct message once in
+eligibility_messages with an FTS5 index over it, keeps the history in
+eligibility_events with message IDs, and maintains eligibility_latest (the
+most recent row per item) with triggers, so later inserts keep it current
+without a rebuild. eligibility_table becomes a view with the original
+columns (plus message_id), and inserts into it are encoded by a trigger.
+"""
+import logging
+import sqlite3
+import threading
+from typing import Optional, Tuple
+
+from config.settings import settings
+from src.services.generations import generations, open_readonly
+
+logger = logging.getLogger(__name__)
+
+# Storage behind the eligibility_table view and the FTS5 shadow tables,
+# hidden from schema listings
+INTERNAL_TABLES = {
+    "eligibility_events",
+    "eligibility_messages_fts_data",
+    "eligibility_messages_fts_idx",
+    "eligibility_messages_fts_docsize",
+    "eligibility_messages_fts_config",
+}
+INDEX_TABLES = ("eligibility_latest", "eligibility_messages", "eligibility_messages_fts")
+
+def _sortable_timestamp(column: str) -> str:
+    """SQL turning '2025-06-01 8:50:09' into '2025-06-01 08:50:09' so timestamps compare as text"""
+    return f"CASE WHEN substr({column}, 13, 1) = ':' THEN substr({column}, 1, 11) || '0' || substr({column}, 12) ELSE {column} END"
+
+_SCHEMA = f"""
+CREATE TABLE eligibility_messages (
+    message_id INTEGER PRIMARY KEY,
+    message TEXT NOT NULL UNIQUE
+);
+CREATE VIRTUAL TABLE eligibility_messages_fts USING fts5(
+    message, content='eligibility_messages', content_rowid='message_id', tokenize='porter unicode61'
+);
+-- Messages are a dictionary: only ever inserted, never changed
+CREATE TRIGGER eligibility_messages_index AFTER INSERT ON eligibility_messages BEGIN
+    INSERT INTO eligibility_messages_fts (rowid, message) VALUES (new.message_id, new.message);
+END;
+
+CREATE TABLE eligibility_events (
+    eligibility_datetime_utc TEXT,
+    item_id INTEGER,
+    eligibility INTEGER,
+    message_id INTEGER REFERENCES eligibility_messages (message_id)
+);
+CREATE INDEX idx_eligibility_events_item ON eligibility_events (item_id);
+CREATE INDEX idx_eligibility_events_message ON eligibility_events (message_id);
+
+CREATE TABLE eligibility_latest (
+    item_id INTEGER PRIMARY KEY,
+    eligibility_datetime_utc TEXT,
+    eligibility INTEGER,
+    message_id INTEGER REFERENCES eligibility_messages (message_id),
+    observed_at TEXT
+);
+CREATE INDEX idx_eligibility_latest_eligibility ON eligibility_latest (eligibility);
+CREATE TRIGGER eligibility_events_latest AFTER INSERT ON eligibility_events WHEN new.item_id IS NOT NULL BEGIN
+    INSERT INTO eligibility_latest (item_id, eligibility_datetime_utc, eligibility, message_id, observed_at)
+    VALUES (
+        new.item_id, new.eligibility_datetime_utc, new.eligibility, new.message_id,
+        {_sortable_timestamp("new.eligibility_datetime_utc")}
+    )
+    ON CONFLICT (item_id) DO UPDATE SET
+        eligibility_datetime_utc = excluded.eligibility_datetime_utc,
+        eligibility = excluded.eligibility,
+        message_id = excluded.message_id,
+        observed_at = excluded.observed_at
+    WHERE excluded.observed_at >= eligibility_latest.observed_at;
+END;
+"""
+
+_VIEW = """
+CREATE VIEW eligibility_table AS
+SELECT e.eligibility_datetime_utc, e.item_id, e.eligibility, m.message, e.message_id
+FROM eligibility_events e LEFT JOIN eligibility_messages m ON m.message_id = e.message_id;
+
+CREATE TRIGGER eligibility_table_insert INSTEAD OF INSERT ON eligibility_table BEGIN
+    INSERT OR IGNORE INTO eligibility_messages (message) SELECT new.message WHERE new.message IS NOT NULL;
+    INSERT INTO eligibility_events (eligibility_datetime_utc, item_id, eligibility, message_id)
+    VALUES (
+        new.eligibility_datetime_utc, new.item_id, new.eligibility,
+        (SELECT message_id FROM eligibility_messages WHERE message = new.message)
+    );
+END;
+"""
+
+def build_eligibility_index(conn: sqlite3.Connection) -> Tuple[int, int]:
+    """
+    Convert a flat eligibility_table into the encoded, indexed layout.
+    Returns (distinct messages, items); does nothing if already converted.
+    """
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = 'eligibility_table'").fetchone()
+    if row is None or row[0] != "table":
+        return 0, 0
+
+    with conn:
+        for statement in _statements(_SCHEMA):
+            conn.execute(statement)
+        conn.execute(
+            "INSERT INTO eligibility_messages (message) "
+            "SELECT DISTINCT message FROM eligibility_table WHERE message IS NOT NULL"
+        )
+        # Original row order is kept; the trigger picks the latest row per item regardless
+        conn.execute(
+            "INSERT INTO eligibility_events (eligibility_datetime_utc, item_id, eligibility, message_id) "
+            "SELECT t.eligibility_datetime_utc, t.item_id, t.eligibility, m.message_id "
+            "FROM eligibility_table t LEFT JOIN eligibility_messages m ON m.message = t.message ORDER BY t.rowid"
+        )
+        conn.execute("DROP TABLE eligibility_table")
+        for statement in _statements(_VIEW):
+            conn.execute(statement)
+
+    (messages,) = conn.execute("SELECT COUNT(*) FROM eligibility_messages").fetchone()
+    (items,) = conn.execute("SELECT COUNT(*) FROM eligibility_latest").fetchone()
+    logger.info(f"Encoded eligibility_table: {messages} distinct messages, latest eligibility for {items} items")
+    return messages, items
+
+def _statements(script: str):
+    """Split a script on statement boundaries, keeping trigger bodies whole"""
+    statement = ""
+    for line in script.strip().splitlines():
+        if line.startswith("--"):
+            continue
+        statement += line + "\n"
+        if sqlite3.complete_statement(statement):
+            yield statement.strip()
+            statement = ""
+
+# (generation number, available) of the last lookup
+_availability: Tuple[Optional[int], bool] = (None, False)
+_availability_lock = threading.Lock()
+
+def index_available() -> bool:
+    """Whether the served database generation has the eligibility index tables"""
+    global _availability
+    if settings.DB_BACKEND != "sqlite":
+        return False
+    generation = generations.current()
+    with _availability_lock:
+        if _availability[0] == generation.number:
+            return _availability[1]
+    try:
+        conn = open_readonly(generation.path)
+        try:
+            names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+        finally:
+            conn.close()
+        available = all(name in names for name in INDEX_TABLES)
+    except sqlite3.Error as e:
+        logger.warning(f"Could not inspect database generation {generation.number}: {e}")
+        return False
+    with _availability_lock:
+        _availability = (generation.number, available)
+    return available
+
+def prompt_tables() -> str:
+    """Extra table lines for the SQL prompt; empty when the index is not built"""
+    if not index_available():
+        return ""
+    return """
+- eligibility_latest (columns: item_id, eligibility_datetime_utc, eligibility, message_id) - one row per item with its most recent eligibility
+- eligibility_messages (columns: message_id, message) - each distinct eligibility message once; eligibility_table also has message_id
+- eligibility_messages_fts (FTS5 full-text index over eligibility_messages.message, rowid = message_id)"""
+
+def prompt_guidelines() -> str:
+    """Extra guideline lines for the SQL prompt; empty when the index is not built"""
+    if not index_available():
+        return ""
+    return """
+- For the current eligibility of items, use `eligibility_latest` instead of scanning `eligibility_table`
+- To search eligibility messages for words, filter with message_id IN (SELECT rowid FROM eligibility_messages_fts WHERE eligibility_messages_fts MATCH 'word') instead of LIKE '%word%'"""
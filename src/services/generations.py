@@ -0,0 +1,260 @@
+"""
+Database generations: build a complete new database file, then swap readers over
+
+Ingest loads the CSVs into a new numbered file (``data.gen-000042.db``),
+indexes and validates it, and publishes it by atomically replacing the
+``CURRENT`` pointer file. Readers resolve the pointer each time they start a
+query, so queries already running finish on the generation they started on.
+A generation that is no longer current is deleted once this process has no
+queries left on it; the newest DB_GENERATIONS_RETAIN old ones are kept so
+other worker processes can drain too.
+
+Until the first generation is published readers use DB_PATH (generation 0).
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter as TallyCounter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from config.settings import settings
+from src.services.metrics import DATA_GENERATION
+
+logger = logging.getLogger(__name__)
+
+POINTER_FILE = "CURRENT"
+_GENERATION_RE = re.compile(r"^data\.gen-(\d+)\.db$")
+
+# Indexes created on every generation for the filters and joins the
+# generated SQL uses most (eligibility_table is indexed by its own build step)
+INDEXES: Dict[str, List[Tuple[str, ...]]] = {
+    "ad_sales_metrics": [("date", "item_id")],
+    "total_sales_metrics": [("date", "item_id")],
+}
+
+class Generation:
+    """One published database file"""
+
+    def __init__(self, number: int, path: str):
+        self.number = number
+        self.path = path
+
+    def __repr__(self) -> str:
+        return f"Generation({self.number}, {self.path!r})"
+
+def generation_filename(number: int) -> str:
+    return f"data.gen-{number:06d}.db"
+
+def open_readonly(path: str, **kwargs) -> sqlite3.Connection:
+    """
+    Read-only connection to a generation file; fails instead of creating an
+    empty database if the file was cleaned up in the meantime
+    """
+    return sqlite3.connect(f"file:{Path(path).resolve()}?mode=ro", uri=True, **kwargs)
+
+class GenerationTracker:
+    """Resolves the current generation and tracks in-flight queries per generation"""
+
+    def __init__(self, directory: str, fallback_path: str, retain: int = 1):
+        self.directory = Path(directory)
+        self.fallback = Generation(0, fallback_path)
+        self.retain = retain
+        self._lock = threading.Lock()
+        self._pointer_key: Optional[Tuple[int, int]] = None
+        self._current = self.fallback
+        self._in_flight: TallyCounter = TallyCounter()
+
+    def _generation_files(self) -> List[Tuple[int, Path]]:
+        if not self.directory.exists():
+            return []
+        files = []
+        for path in self.directory.iterdir():
+            match = _GENERATION_RE.match(path.name)
+            if match:
+                files.append((int(match.group(1)), path))
+        return sorted(files)
+
+    def current(self) -> Generation:
+        """The published generation; re-reads the pointer only when it was replaced"""
+        pointer = self.directory / POINTER_FILE
+        try:
+            stat = pointer.stat()
+        except FileNotFoundError:
+            return self.fallback
+        # os.replace gives the pointer a new inode on every publish
+        key = (stat.st_ino, stat.st_mtime_ns)
+        with self._lock:
+            if key == self._pointer_key:
+                return self._current
+        name = pointer.read_text().strip()
+        match = _GENERATION_RE.match(name)
+        if not match:
+            logger.error(f"Ignoring malformed generation pointer {pointer}: {name!r}")
+            return self.fallback
+        generation = Generation(int(match.group(1)), str(self.directory / name))
+        with self._lock:
+            self._pointer_key = key
+            self._current = generation
+        DATA_GENERATION.set(generation.number)
+        return generation
+
+    @contextmanager
+    def use(self) -> Iterator[Generation]:
+        """Pin the current generation for the duration of a query"""
+        generation = self.current()
+        with self._lock:
+            self._in_flight[generation.number] += 1
+        try:
+            yield generation
+        finally:
+            with self._lock:
+                self._in_flight[generation.number] -= 1
+                drained = self._in_flight[generation.number] == 0
+            if drained and generation.number != self.current().number:
+                self.cleanup()
+
+    def in_flight(self) -> Dict[int, int]:
+        with self._lock:
+            return {number: count for number, count in self._in_flight.items() if count}
+
+    def cleanup(self) -> List[str]:
+        """Delete drained generations older than the current one and the retained predecessors"""
+        current = self.current().number
+        older = [(number, path) for number, path in self._generation_files() if number < current]
+        removed = []
+        for number, path in older[:max(len(older) - self.retain, 0)]:
+            with self._lock:
+                if self._in_flight[number]:
+                    continue
+            for suffix in ("", "-wal", "-shm", "-journal"):
+                Path(f"{path}{suffix}").unlink(missing_ok=True)
+            removed.append(path.name)
+            logger.info(f"Removed drained database generation {path.name}")
+        return removed
+
+    def next_number(self) -> int:
+        numbers = [number for number, _ in self._generation_files()]
+        building = [int(m.group(1)) for m in (re.match(r"^data\.gen-(\d+)\.db\.building$", p.name)
+                                              for p in self.directory.glob("*.building")) if m]
+        return max(numbers + building + [self.current().number]) + 1
+
+    def publish(self, generation: Generation) -> None:
+        """Atomically point readers at ``generation``"""
+        pointer = self.directory / POINTER_FILE
+        tmp = self.directory / f"{POINTER_FILE}.tmp"
+        with open(tmp, "w") as f:
+            f.write(Path(generation.path).name + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, pointer)
+        _fsync_directory(self.directory)
+        logger.info(f"Published database generation {generation.number}")
+        self.current()
+        self.cleanup()
+
+def _fsync_directory(directory: Path) -> None:
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _load_csvs(conn: sqlite3.Connection, data_dir: str) -> Dict[str, int]:
+    import pandas as pd
+
+    expected = {}
+    for filename in sorted(os.listdir(data_dir)):
+        if filename.endswith(".csv"):
+            table_name = filename.replace(".csv", "")
+            df = pd.read_csv(os.path.join(data_dir, filename))
+            df.to_sql(table_name, conn, if_exists="fail", index=False)
+            expected[table_name] = len(df)
+            logger.info(f"Loaded {filename} as table '{table_name}'")
+    return expected
+
+def _create_indexes(conn: sqlite3.Connection, tables: List[str]) -> None:
+    for table in tables:
+        for columns in INDEXES.get(table, []):
+            name = f"idx_{table}_{'_'.join(columns)}"
+            conn.execute(f'CREATE INDEX "{name}" ON "{table}" ({", ".join(columns)})')
+
+def validate_generation(conn: sqlite3.Connection, expected: Dict[str, int]) -> None:
+    """Raise ValueError unless the file is intact and every table has the rows that were loaded"""
+    (integrity,) = conn.execute("PRAGMA integrity_check").fetchone()
+    if integrity != "ok":
+        raise ValueError(f"Integrity check failed: {integrity}")
+    if not expected:
+        raise ValueError("No tables were loaded")
+    for table, rows in expected.items():
+        (actual,) = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()
+        if actual != rows:
+            raise ValueError(f"Table {table} has {actual} rows, expected {rows}")
+
+def build_generation(data_dir: Optional[str] = None, partition: bool = False,
+                     tracker: Optional["GenerationTracker"] = None) -> Generation:
+    """
+    Load every CSV in ``data_dir`` into a new generation file, index,
+    validate and optionally partition it, and build the eligibility
+    message index and the samples behind approximate answers. The file
+    only gets its final name once it is complete; publish() makes it
+    current.
+    """
+    tracker = tracker or generations
+    data_dir = data_dir or settings.DATA_DIR
+    tracker.directory.mkdir(parents=True, exist_ok=True)
+
+    while True:
+        number = tracker.next_number()
+        path = tracker.directory / generation_filename(number)
+        building = Path(f"{path}.building")
+        try:
+            # Exclusive create claims the number against concurrent builds
+            open(building, "x").close()
+            break
+        except FileExistsError:
+            continue
+
+    try:
+        conn = sqlite3.connect(building)
+        try:
+            # Nothing reads the file until it is complete, so skip the journal
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute("PRAGMA synchronous = OFF")
+            expected = _load_csvs(conn, data_dir)
+            validate_generation(conn, expected)
+            if "eligibility_table" in expected:
+                from src.services.eligibility import build_eligibility_index
+                build_eligibility_index(conn)
+            if partition:
+                from src.services.partitions import PARTITIONED_TABLES, partition_table
+                for table in PARTITIONED_TABLES:
+                    if table in expected:
+                        partition_table(conn, table)
+                _create_indexes(conn, [t for t in expected if t not in PARTITIONED_TABLES])
+            else:
+                _create_indexes(conn, list(expected))
+            from src.services.approximate import build_samples
+            build_samples(conn)
+            validate_generation(conn, expected)
+            conn.execute("ANALYZE")
+            conn.commit()
+        finally:
+            conn.close()
+        with open(building, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(building, path)
+    except BaseException:
+        building.unlink(missing_ok=True)
+        raise
+    return Generation(number, str(path))
+
+# Global generation tracker instance
+generations = GenerationTracker(settings.DB_GENERATIONS_DIR, settings.DB_PATH, settings.DB_GENERATIONS_RETAIN)
+
+def current_generation() -> int:
+    """Number of the published data generation, for cache keys and /health"""
+    return generations.current().number
@@ -6,6 +6,10 @@ import logging
 from typing import Optional, Dict, Any
 
 from config.settings import settings
+from src.services.admission import AdmissionRejected, admission
+from src.services.metrics import LLM_ERRORS, LLM_LATENCY, SQL_CLEANING_FAILURES
+from src.services.eligibility import prompt_guidelines, prompt_tables
+from src.services.profiling import profile_stage
 
 logger = logging.getLogger(__name__)
 
@@ -29,7 +33,7 @@ Only return the SQL query, nothing else.
 Use the following available tables:
 - ad_sales_metrics (columns: date, item_id, ad_sales, impressions, ad_spend, clicks, units_sold)
 - total_sales_metrics (columns: date, item_id, total_sales, total_units_ordered)
-- eligibility_table (columns: eligibility_datetime_utc, item_id, eligibility, message)
+- eligibility_table (columns: eligibility_datetime_utc, item_id, eligibility, message){prompt_tables()}
 
 Important guidelines:
 - For questions asking for "total sales" or "total amount", use SUM(total_sales) to get the aggregate total
@@ -37,7 +41,7 @@ Important guidelines:
 - Use table `total_sales_metrics` for sales-related questions
 - Always use proper aggregate functions when asked for totals/sums
 - For RoAS calculations, use: ad_sales / ad_spend
-- For CPC calculations, use: ad_spend / clicks (where clicks > 0)
+- For CPC calculations, use: ad_spend / clicks (where clicks > 0){prompt_guidelines()}
 
 Question: {question}
 """
@@ -67,12 +71,13 @@ Question: {question}
                 ]
             }
             
-            response = requests.post(
-                f"{self.model_url}?key={self.api_key}",
-                headers=self.headers,
-                json=payload,
-                timeout=30
-            )
+            with admission.stage("llm"), profile_stage("llm"), LLM_LATENCY.time(source="service"):
+                response = requests.post(
+                    f"{self.model_url}?key={self.api_key}",
+                    headers=self.headers,
+                    json=payload,
+                    timeout=30
+                )
             
             response.raise_for_status()
             data = response.json()
@@ -82,21 +87,31 @@ Question: {question}
             
             # Clean up the SQL query (remove markdown formatting)
             sql_query = sql_query.replace("```sql", "").replace("```", "").strip()
+            if not sql_query:
+                SQL_CLEANING_FAILURES.inc(reason="empty")
+            elif sql_query.split(None, 1)[0].upper() not in ("SELECT", "WITH"):
+                SQL_CLEANING_FAILURES.inc(reason="not_select")
             
             logger.info(f"Generated SQL query: {sql_query}")
             return sql_query
             
+        except AdmissionRejected:
+            raise
+        
         except requests.exceptions.RequestException as e:
+            LLM_ERRORS.inc(source="service", reason="request")
             error_msg = f"LLM API request failed: {e}"
             logger.error(error_msg)
             return error_msg
             
         except KeyError as e:
+            LLM_ERRORS.inc(source="service", reason="response_format")
             error_msg = f"Unexpected LLM response format: {e}"
             logger.error(error_msg)
             return error_msg
             
         except Exception as e:
+            LLM_ERRORS.inc(source="service", reason="other")
             error_msg = f"LLM service error: {e}"
             logger.error(error_msg)
             return error_msg
@@ -190,5 +205,13 @@ Provide a clear, concise explanation of what this query does.
                 "api_key_configured": bool(self.api_key)
             }
 
-# Global LLM service instance
-llm_service = LLMService()
+# Global LLM service instance, created by the application startup hook
+# (or on first use) so that importing this module never requires an API key
+llm_service: Optional[LLMService] = None
+
+def get_llm_service() -> LLMService:
+    """Return the global LLM service, creating it on first use"""
+    global llm_service
+    if llm_service is None:
+        llm_service = LLMService()
+    return llm_service
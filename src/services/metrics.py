@@ -0,0 +1,224 @@
+"""
+In-process metrics for the question pipeline, exposed in Prometheus text format
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Default latency buckets in seconds, from a fast cache hit to a slow LLM call
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric:
+    """Base class holding per-label-set state behind a lock"""
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    type_name = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+class Gauge(_Metric):
+    """Value that can go up and down, such as a queue depth"""
+
+    type_name = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram with sum and count"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # label values -> [bucket counts..., sum, count]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels: str):
+        """Observe the wall time of a with block, even if it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> float:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state[-1] if state else 0.0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = []
+        for key, state in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = ("le", _format_value(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {_format_value(state[-1])}")
+        return lines
+
+class MetricsRegistry:
+    """Collection of named metrics rendered together for /metrics"""
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(self.prefix + name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(self.prefix + name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(self.prefix + name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+# Global metrics registry
+registry = MetricsRegistry(prefix="ecommerce_agent_")
+
+# Question pipeline stages. The "source" label names the code path recording
+# the sample (e.g. "app" for app/*, "service" for src/services/*).
+LLM_LATENCY = registry.histogram("llm_request_seconds", "Latency of LLM SQL-generation calls", ["source"])
+LLM_ERRORS = registry.counter("llm_errors_total", "LLM calls that failed or returned no SQL", ["source", "reason"])
+SQL_CLEANING_FAILURES = registry.counter("sql_cleaning_failures_total", "LLM responses that did not clean up into a query", ["reason"])
+QUERY_LATENCY = registry.histogram("sql_query_seconds", "SQL execution and fetch time", ["source"])
+QUERY_ERRORS = registry.counter("sql_query_errors_total", "SQL queries that raised an error", ["source"])
+QUERY_ROWS = registry.histogram("sql_query_rows", "Rows returned per SQL query", ["source"], buckets=ROW_BUCKETS)
+DATAFRAME_BUILD = registry.histogram("dataframe_build_seconds", "Time spent building pandas DataFrames", ["source"])
+CHART_RENDER = registry.histogram("chart_render_seconds", "Chart render time", ["chart_type"])
+RESPONSE_BYTES = registry.histogram("response_bytes", "Response payload size", ["path"], buckets=BYTE_BUCKETS)
+STREAM_EVENTS = registry.counter("stream_events_total", "Streaming events emitted", ["event"])
+PARTITION_READS = registry.counter("partition_reads_total", "Monthly partitions read or pruned by date routing", ["table", "outcome"])
+DATA_GENERATION = registry.gauge("data_generation", "Database generation currently served")
+RESULT_SPILLS = registry.counter("result_spills_total", "Results over the row cap, spilled to disk or truncated", ["outcome"])
+ADMISSION_IN_FLIGHT = registry.gauge("admission_in_flight", "Callers holding a slot, per endpoint or stage limiter", ["limiter"])
+ADMISSION_QUEUE_DEPTH = registry.gauge("admission_queue_depth", "Callers waiting for a slot, per endpoint or stage limiter", ["limiter"])
+ADMISSION_SHED = registry.counter("admission_shed_total", "Callers shed with 429 instead of admitted", ["limiter", "reason"])
+ADMISSION_WAIT = registry.histogram("admission_wait_seconds", "Time queued callers waited for a slot", ["limiter"])
+CACHE_REQUESTS = registry.counter("cache_requests_total", "Shared cache lookups and failed writes by namespace (hit, miss, error)", ["namespace", "outcome"])
+PIPELINE_STAGE = registry.histogram("pipeline_stage_seconds", "Time spent in each question pipeline stage", ["stage"])
+SHARD_QUERIES = registry.counter("shard_queries_total", "Queries on the sharded backend by plan (aggregate, rows, single, fallback, stale)", ["plan"])
+SHARD_LATENCY = registry.histogram("shard_query_seconds", "Per-shard execution time of scattered queries", ["shard"])
+ESTIMATES = registry.counter("approximate_estimates_total", "Sampled estimates by outcome (estimated, unsupported, error)", ["outcome"])
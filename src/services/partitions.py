@@ -0,0 +1,496 @@
+"""
+Monthly date partitions for the metrics tables
+
+partition_table() splits a flat metrics table into one table per month
+(``ad_sales_metrics_p202506``, ...) recorded in a ``_partitions`` catalog,
+and puts a UNION ALL view with the original name in its place so any SQL
+keeps working. route_query() reads the date predicates of a query and swaps
+each routable reference to that view for only the partitions the predicates
+can match.
+
+Usage:
+    python -m src.services.partitions partition
+    python -m src.services.partitions rollover --month 2025-07
+    python -m src.services.partitions compact
+    python -m src.services.partitions status
+"""
+import argparse
+import logging
+import re
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from config.settings import settings
+from src.services.metrics import PARTITION_READS
+from src.services.sqlparse import NOT_BEFORE_RE, mask_literals, paren_depths
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLES = ("ad_sales_metrics", "total_sales_metrics")
+PARTITION_COLUMN = "date"
+CATALOG_TABLE = "_partitions"
+
+# Partition tables and underscore-prefixed tables (catalogs, samples) are storage
+# details, hidden from schema listings
+INTERNAL_TABLE_RE = re.compile(r"^(?:_\w+|sqlite_\w+|\w+_p(?:\d{6}|null))$")
+
+class Partition:
+    """One monthly partition of a base table"""
+
+    def __init__(self, base_table: str, table: str, month: Optional[str], row_count: int = 0,
+                 min_date: Optional[str] = None, max_date: Optional[str] = None):
+        self.base_table = base_table
+        self.table = table
+        # "YYYY-MM" prefix shared by every date in the partition; None holds NULL dates
+        self.month = month
+        self.row_count = row_count
+        self.min_date = min_date
+        self.max_date = max_date
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+def partition_name(table: str, month: Optional[str]) -> str:
+    return f"{table}_p{month.replace('-', '') if month else 'null'}"
+
+def _ensure_catalog(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {CATALOG_TABLE} ("
+        "base_table TEXT NOT NULL, partition_table TEXT PRIMARY KEY, month TEXT, "
+        "row_count INTEGER NOT NULL DEFAULT 0, min_date TEXT, max_date TEXT)"
+    )
+
+def load_catalog(conn: sqlite3.Connection) -> Dict[str, List[Partition]]:
+    """Partitions per base table, oldest month first; empty when nothing is partitioned"""
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (CATALOG_TABLE,)).fetchone()
+    if not exists:
+        return {}
+    catalog: Dict[str, List[Partition]] = {}
+    rows = conn.execute(
+        f"SELECT base_table, partition_table, month, row_count, min_date, max_date FROM {CATALOG_TABLE} "
+        "ORDER BY base_table, month IS NULL, month"
+    )
+    for row in rows:
+        catalog.setdefault(row[0], []).append(Partition(*row))
+    return catalog
+
+def _object_type(conn: sqlite3.Connection, name: str) -> Optional[str]:
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+def _column_definitions(conn: sqlite3.Connection, table: str) -> str:
+    return ", ".join(f'"{row[1]}" {row[2]}'.strip() for row in conn.execute(f"PRAGMA table_info('{table}')"))
+
+def _create_index(conn: sqlite3.Connection, table: str) -> None:
+    conn.execute(f'CREATE INDEX IF NOT EXISTS "{table}_date_item" ON "{table}" ("{PARTITION_COLUMN}", item_id)')
+
+def _create_partition(conn: sqlite3.Connection, base_table: str, month: Optional[str], columns: str) -> str:
+    table = partition_name(base_table, month)
+    conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({columns})')
+    _create_index(conn, table)
+    conn.execute(f"INSERT OR IGNORE INTO {CATALOG_TABLE} (base_table, partition_table, month) VALUES (?, ?, ?)",
+                 (base_table, table, month))
+    return table
+
+def _refresh_stats(conn: sqlite3.Connection, partition_table: str) -> None:
+    conn.execute(
+        f"UPDATE {CATALOG_TABLE} SET (row_count, min_date, max_date) = "
+        f'(SELECT COUNT(*), MIN("{PARTITION_COLUMN}"), MAX("{PARTITION_COLUMN}") FROM "{partition_table}") '
+        "WHERE partition_table = ?",
+        (partition_table,),
+    )
+
+def _rebuild_view(conn: sqlite3.Connection, base_table: str) -> None:
+    partitions = load_catalog(conn).get(base_table, [])
+    conn.execute(f'DROP VIEW IF EXISTS "{base_table}"')
+    union = " UNION ALL ".join(f'SELECT * FROM "{p.table}"' for p in partitions)
+    conn.execute(f'CREATE VIEW "{base_table}" AS {union}')
+
+def partition_table(conn: sqlite3.Connection, base_table: str) -> List[str]:
+    """
+    Split a flat table into monthly partitions and replace it with a view of
+    the same name. Does nothing if the table is already partitioned.
+    """
+    if _object_type(conn, base_table) != "table":
+        return []
+
+    with conn:
+        _ensure_catalog(conn)
+        columns = _column_definitions(conn, base_table)
+        months = [row[0] for row in conn.execute(
+            f'SELECT DISTINCT substr("{PARTITION_COLUMN}", 1, 7) FROM "{base_table}"'
+        )]
+        if not months:
+            # Keep the view valid: an empty table still gets one (empty) partition
+            months = [None]
+
+        created = []
+        for month in months:
+            table = _create_partition(conn, base_table, month, columns)
+            month_filter = f'"{PARTITION_COLUMN}" IS NULL' if month is None else f'substr("{PARTITION_COLUMN}", 1, 7) = ?'
+            conn.execute(
+                f'INSERT INTO "{table}" SELECT * FROM "{base_table}" WHERE {month_filter} '
+                f'ORDER BY "{PARTITION_COLUMN}", item_id',
+                () if month is None else (month,),
+            )
+            _refresh_stats(conn, table)
+            created.append(table)
+
+        conn.execute(f'DROP TABLE "{base_table}"')
+        _rebuild_view(conn, base_table)
+    logger.info(f"Partitioned {base_table} into {len(created)} monthly partitions")
+    return created
+
+def append_rows(conn: sqlite3.Connection, base_table: str, rows: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+    """Insert rows (e.g. a daily load) into their monthly partitions, creating any that are missing"""
+    catalog = load_catalog(conn).get(base_table)
+    if not catalog:
+        raise ValueError(f"{base_table} is not partitioned")
+
+    by_month: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    for row in rows:
+        value = row.get(PARTITION_COLUMN)
+        by_month.setdefault(str(value)[:7] if value is not None else None, []).append(row)
+
+    known = {p.month for p in catalog}
+    inserted: Dict[str, int] = {}
+    with conn:
+        columns = _column_definitions(conn, catalog[0].table)
+        for month, month_rows in by_month.items():
+            table = _create_partition(conn, base_table, month, columns)
+            names = list(month_rows[0].keys())
+            column_list = ", ".join(f'"{name}"' for name in names)
+            placeholders = ", ".join("?" for _ in names)
+            conn.executemany(f'INSERT INTO "{table}" ({column_list}) VALUES ({placeholders})',
+                             [tuple(row.get(name) for name in names) for row in month_rows])
+            _refresh_stats(conn, table)
+            inserted[table] = len(month_rows)
+        if set(by_month) - known:
+            _rebuild_view(conn, base_table)
+    return inserted
+
+def _next_month(month: str) -> str:
+    year, mon = int(month[:4]), int(month[5:7])
+    return f"{year + mon // 12:04d}-{mon % 12 + 1:02d}"
+
+def rollover(conn: sqlite3.Connection, base_table: str, month: Optional[str] = None) -> Optional[str]:
+    """
+    Create the partition for ``month`` (default: the month after the newest
+    partition) ahead of time so daily loads never pay for DDL
+    """
+    catalog = load_catalog(conn).get(base_table)
+    if not catalog:
+        raise ValueError(f"{base_table} is not partitioned")
+    months = [p.month for p in catalog if p.month]
+    month = month or (_next_month(months[-1]) if months else None)
+    if month is None or month in months:
+        return None
+
+    with conn:
+        table = _create_partition(conn, base_table, month, _column_definitions(conn, catalog[0].table))
+        _rebuild_view(conn, base_table)
+    return table
+
+def compact(conn: sqlite3.Connection, base_table: str, months: Optional[List[str]] = None) -> Dict[str, int]:
+    """
+    Rewrite partitions in (date, item_id) order, drop empty partitions other
+    than the newest one, and refresh the catalog statistics. Rows appended
+    by daily loads end up clustered with the rest of their month again.
+    """
+    catalog = load_catalog(conn).get(base_table)
+    if not catalog:
+        raise ValueError(f"{base_table} is not partitioned")
+
+    newest = max((p.month for p in catalog if p.month), default=None)
+    compacted: Dict[str, int] = {}
+    with conn:
+        conn.execute(f'DROP VIEW IF EXISTS "{base_table}"')
+        for partition in catalog:
+            if months is not None and partition.month not in months:
+                continue
+            (count,) = conn.execute(f'SELECT COUNT(*) FROM "{partition.table}"').fetchone()
+            if count == 0 and partition.month != newest:
+                conn.execute(f'DROP TABLE "{partition.table}"')
+                conn.execute(f"DELETE FROM {CATALOG_TABLE} WHERE partition_table = ?", (partition.table,))
+                continue
+
+            staging = f"{partition.table}_compact"
+            conn.execute(f'DROP TABLE IF EXISTS "{staging}"')
+            conn.execute(f'CREATE TABLE "{staging}" ({_column_definitions(conn, partition.table)})')
+            conn.execute(
+                f'INSERT INTO "{staging}" SELECT * FROM "{partition.table}" ORDER BY "{PARTITION_COLUMN}", item_id'
+            )
+            conn.execute(f'DROP TABLE "{partition.table}"')
+            conn.execute(f'ALTER TABLE "{staging}" RENAME TO "{partition.table}"')
+            _create_index(conn, partition.table)
+            _refresh_stats(conn, partition.table)
+            compacted[partition.table] = count
+        _rebuild_view(conn, base_table)
+    conn.execute("ANALYZE")
+    return compacted
+
+# --- Query routing ---
+
+_COLUMN = rf'(?<![\w."])(?:(\w+)\.)?"?{PARTITION_COLUMN}"?'
+_DATE_COLUMN = rf"(?:{_COLUMN}|date\(\s*{_COLUMN}\s*\))"
+_VALUE = r"('[^']*'|(?:date|datetime)\(\s*'[^']*'(?:\s*,\s*'[^']*')*\s*\)|current_date)"
+# Predicate kind -> pattern, matched against the query with literal contents
+# blanked out. Group layout: the qualifier group(s) of the date column, then
+# the operator and value(s); "cmp_reversed" has the value first and "month"
+# the strftime format.
+_PREDICATES = [
+    ("cmp", re.compile(rf"{_DATE_COLUMN}\s*(==|=|>=|<=|>|<)\s*{_VALUE}", re.IGNORECASE)),
+    ("cmp_reversed", re.compile(rf"{_VALUE}\s*(==|=|>=|<=|>|<)\s*{_DATE_COLUMN}", re.IGNORECASE)),
+    ("between", re.compile(rf"{_DATE_COLUMN}\s+BETWEEN\s+{_VALUE}\s+AND\s+{_VALUE}", re.IGNORECASE)),
+    ("like", re.compile(rf"{_DATE_COLUMN}\s+LIKE\s+('[^']*')", re.IGNORECASE)),
+    ("in", re.compile(rf"{_DATE_COLUMN}\s+IN\s*\(((?:\s*'[^']*'\s*,?)+)\)", re.IGNORECASE)),
+    ("month", re.compile(
+        rf"(?:strftime\(\s*('[^']*')\s*,\s*{_COLUMN}\s*\)|substr\(\s*{_COLUMN}\s*,\s*1\s*,\s*7\s*\))\s*(==|=)\s*('[^']*')",
+        re.IGNORECASE,
+    )),
+]
+# Operator seen from the date column's side when the literal comes first
+_FLIPPED = {">": "<", "<": ">", ">=": "<=", "<=": ">=", "=": "=", "==": "="}
+_CLAUSE_RE = re.compile(r"\b(WHERE|GROUP\s+BY|ORDER\s+BY|HAVING|LIMIT|UNION|EXCEPT|INTERSECT|WINDOW)\b", re.IGNORECASE)
+_ALIAS_STOPWORDS = {
+    "where", "group", "order", "limit", "join", "inner", "left", "right", "cross", "natural", "full",
+    "outer", "on", "using", "union", "except", "intersect", "having", "window",
+}
+
+class _Reference:
+    """One FROM/JOIN reference to a partitioned table"""
+
+    def __init__(self, table: str, alias: Optional[str], start: int, end: int, depth: int):
+        self.table = table
+        self.alias = alias
+        self.start = start
+        self.end = end
+        self.depth = depth
+
+def _scope_end(masked: str, depths: List[int], position: int) -> int:
+    """End of the innermost parenthesized span (or the query) containing ``position``"""
+    depth = depths[position]
+    end = position
+    while end < len(masked) and not (masked[end] == ")" and depths[end] == depth):
+        end += 1
+    return end
+
+def _references(masked: str, depths: List[int], tables: Iterable[str]) -> List[_Reference]:
+    names = "|".join(re.escape(t) for t in tables)
+    pattern = re.compile(rf'\b(?:FROM|JOIN)\s+("?)({names})\b\1(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+    references = []
+    for match in pattern.finditer(masked):
+        alias, end = match.group(3), match.end()
+        if alias and alias.lower() in _ALIAS_STOPWORDS:
+            alias, end = None, match.end(2) + len(match.group(1))
+        references.append(_Reference(match.group(2).lower(), alias, match.start(1), end, depths[match.start()]))
+    return references
+
+class _DateFilter:
+    """Conjunction of date predicates; answers whether a month partition can match"""
+
+    def __init__(self):
+        self.checks: List[Tuple[str, Any]] = []
+
+    def add(self, op: str, value: Any) -> None:
+        self.checks.append((op, value))
+
+    def matches(self, month: Optional[str]) -> bool:
+        if month is None:
+            # NULL dates never satisfy a date predicate
+            return not self.checks
+        # Dates are ISO 8601 strings: every date in the partition starts with
+        # ``month`` and is no earlier than its first day. Keep the partition
+        # if any such string could satisfy every predicate.
+        first_day = f"{month}-01"
+        for op, value in self.checks:
+            if op in (">", ">="):
+                ok = month >= value[:7]
+            elif op == "<":
+                ok = first_day < value
+            elif op == "<=":
+                ok = first_day <= value
+            elif op == "=":
+                ok = value[:7] == month
+            elif op == "in":
+                ok = any(v[:7] == month for v in value)
+            else:  # "prefix"
+                ok = month.startswith(value) or value.startswith(month)
+            if not ok:
+                return False
+        return True
+
+def _literal(conn: sqlite3.Connection, token: str) -> Optional[str]:
+    if token.startswith("'"):
+        return token[1:-1].replace("''", "'")
+    # date('now', ...) and current_date contain only literals, so SQLite can evaluate them
+    row = conn.execute(f"SELECT {token}").fetchone()
+    return row[0] if row and isinstance(row[0], str) else None
+
+def _where_bounds(masked: str, depths: List[int], reference: _Reference) -> Optional[Tuple[int, int]]:
+    """Span of the WHERE clause belonging to the reference's own SELECT, if it has one"""
+    scope_end = _scope_end(masked, depths, reference.start)
+    where = None
+    for match in _CLAUSE_RE.finditer(masked, reference.end, scope_end):
+        if depths[match.start()] != reference.depth:
+            continue
+        if where is None:
+            if match.group(1).upper() != "WHERE":
+                return None
+            where = match.end()
+        else:
+            return where, match.start()
+    return (where, scope_end) if where is not None else None
+
+def _date_filter(conn: sqlite3.Connection, query: str, masked: str, depths: List[int],
+                 reference: _Reference) -> Optional[_DateFilter]:
+    """
+    Date predicates on the referenced table from its own WHERE clause.
+    Returns None when the clause has an OR at that level, since the
+    predicates then no longer all have to hold.
+    """
+    date_filter = _DateFilter()
+    bounds = _where_bounds(masked, depths, reference)
+    if bounds is None:
+        return date_filter
+    start, end = bounds
+    for match in re.finditer(r"\bOR\b", masked[start:end], re.IGNORECASE):
+        if depths[start + match.start()] == reference.depth:
+            return None
+
+    # An unqualified date column can only mean this table: any other table in
+    # scope with a date column would make it ambiguous, which SQLite rejects
+    qualifiers = {reference.table, (reference.alias or reference.table).lower()}
+    for kind, pattern in _PREDICATES:
+        for match in pattern.finditer(masked, start, end):
+            if depths[match.start()] != reference.depth or NOT_BEFORE_RE.search(masked[start:match.start()]):
+                continue
+            groups = [query[match.start(i):match.end(i)] if match.start(i) >= 0 else None
+                      for i in range(1, pattern.groups + 1)]
+            if kind == "cmp_reversed":
+                value, op, qualifier_groups = groups[0], _FLIPPED[groups[1]], groups[2:4]
+            elif kind == "month":
+                if groups[0] is not None and groups[0] != "'%Y-%m'":
+                    continue
+                qualifier_groups, groups = groups[1:3], groups[3:]
+            else:
+                qualifier_groups, groups = groups[:2], groups[2:]
+            qualifier = next((g for g in qualifier_groups if g), None)
+            if qualifier and qualifier.lower() not in qualifiers:
+                continue
+
+            if kind == "cmp_reversed":
+                date_filter.add(op, _literal(conn, value))
+            elif kind == "cmp":
+                date_filter.add(groups[0].replace("==", "="), _literal(conn, groups[1]))
+            elif kind == "between":
+                date_filter.add(">=", _literal(conn, groups[0]))
+                date_filter.add("<=", _literal(conn, groups[1]))
+            elif kind == "like":
+                date_filter.add("prefix", re.split(r"[%_]", groups[0][1:-1], maxsplit=1)[0].lower())
+            elif kind == "in":
+                date_filter.add("in", [v.strip()[1:-1] for v in groups[0].split(",") if v.strip()])
+            elif kind == "month":
+                date_filter.add("=", groups[1][1:-1])
+    # A value SQLite could not turn into text says nothing about the partitions
+    date_filter.checks = [(op, value) for op, value in date_filter.checks if value is not None]
+    return date_filter
+
+class PartitionRouter:
+    """Rewrites queries to read only the partitions their date predicates can match"""
+
+    def __init__(self):
+        self._catalogs: Dict[str, Tuple[int, Dict[str, List[Partition]]]] = {}
+        self._lock = threading.Lock()
+
+    def catalog(self, conn: sqlite3.Connection) -> Dict[str, List[Partition]]:
+        """Catalog of the connection's database, reloaded when its schema changes"""
+        (version,) = conn.execute("PRAGMA schema_version").fetchone()
+        path = conn.execute("PRAGMA database_list").fetchone()[2]
+        with self._lock:
+            cached = self._catalogs.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        catalog = load_catalog(conn)
+        with self._lock:
+            self._catalogs[path] = (version, catalog)
+        return catalog
+
+    def route(self, conn: sqlite3.Connection, query: str) -> str:
+        if not re.match(r"\s*(SELECT|WITH)\b", query, re.IGNORECASE):
+            return query
+        catalog = self.catalog(conn)
+        if not catalog:
+            return query
+
+        masked = mask_literals(query)
+        depths = paren_depths(masked)
+        replacements = []
+        for reference in _references(masked, depths, catalog):
+            partitions = catalog[reference.table]
+            # Self-joins and subqueries over the same table keep the full view
+            mentions = re.findall(rf'\b{re.escape(reference.table)}\b"?(?!\s*\.)', masked, re.IGNORECASE)
+            date_filter = _date_filter(conn, query, masked, depths, reference) if len(mentions) == 1 else None
+            if date_filter is None or not date_filter.checks:
+                PARTITION_READS.inc(len(partitions), table=reference.table, outcome="scanned")
+                continue
+
+            selected = [p for p in partitions if date_filter.matches(p.month)]
+            PARTITION_READS.inc(len(selected), table=reference.table, outcome="scanned")
+            PARTITION_READS.inc(len(partitions) - len(selected), table=reference.table, outcome="pruned")
+            if len(selected) == len(partitions):
+                continue
+            if not selected:
+                source = f'(SELECT * FROM "{partitions[0].table}" WHERE 0)'
+            elif len(selected) == 1:
+                source = f'"{selected[0].table}"'
+            else:
+                source = "(" + " UNION ALL ".join(f'SELECT * FROM "{p.table}"' for p in selected) + ")"
+            replacements.append((reference.start, reference.end, f"{source} AS {reference.alias or reference.table}"))
+
+        for start, end, text in sorted(replacements, reverse=True):
+            query = query[:start] + text + query[end:]
+        return query
+
+# Global partition router instance
+router = PartitionRouter()
+
+def route_query(conn: sqlite3.Connection, query: str) -> str:
+    """Route a query to the partitions it needs; unchanged when routing is off or not applicable"""
+    if not settings.PARTITION_ROUTING:
+        return query
+    try:
+        return router.route(conn, query)
+    except sqlite3.Error as e:
+        logger.warning(f"Partition routing skipped: {e}")
+        return query
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Manage monthly partitions of the metrics tables")
+    parser.add_argument("command", choices=["partition", "rollover", "compact", "status"])
+    parser.add_argument("--db", default=settings.DB_PATH)
+    parser.add_argument("--table", action="append", choices=PARTITIONED_TABLES, help="Default: all metrics tables")
+    parser.add_argument("--month", help="YYYY-MM for rollover (default: next month) or compact (default: all)")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    for table in args.table or PARTITIONED_TABLES:
+        if args.command == "partition":
+            created = partition_table(conn, table)
+            print(f"{table}: {len(created)} partitions created" if created else f"{table}: already partitioned")
+        elif args.command == "rollover":
+            created = rollover(conn, table, args.month)
+            print(f"{table}: created {created}" if created else f"{table}: partition already exists")
+        elif args.command == "compact":
+            compacted = compact(conn, table, [args.month] if args.month else None)
+            print(f"{table}: compacted {len(compacted)} partitions")
+        for partition in load_catalog(conn).get(table, []):
+            print(f"  {partition.table:32s} {partition.month or 'NULL':8s} {partition.row_count:>10,d} rows  "
+                  f"{partition.min_date or '-'} .. {partition.max_date or '-'}")
+    if args.command == "compact":
+        conn.execute("VACUUM")
+    conn.close()
+
+if __name__ == "__main__":
+    main()
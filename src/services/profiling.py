@@ -0,0 +1,259 @@
+"""
+Opt-in per-request profiling: a sampling CPU profiler plus tracemalloc
+
+A profile covers one request running in one thread. Code marks the pipeline
+stages it runs with ``profile_stage("llm")`` etc.; outside a profiled request
+those markers are a single context-variable lookup.
+
+tracemalloc is process-wide, so only one profile at a time traces memory;
+profiles that start while another holds it record CPU samples and timings
+only. Even then the traced memory includes allocations made by other
+requests running at the same time, which the report notes.
+"""
+import contextvars
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter as TallyCounter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_active_profile: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar(
+    "active_profile", default=None
+)
+
+# Held by the one profile tracing memory; resetting the peak or diffing
+# snapshots under another profile would mix the two requests' numbers
+_tracemalloc_lock = threading.Lock()
+
+class SamplingProfiler:
+    """Samples the call stack of one thread at a fixed interval from a background thread"""
+
+    def __init__(self, thread_id: int, interval: float = 0.005, max_depth: int = 64):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks: TallyCounter = TallyCounter()
+        self.sample_count = 0
+        self.stage = "request"
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None and len(names) < self.max_depth:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            # Collapsed-stack format (root first), prefixed by the pipeline stage
+            self.stacks[";".join([self.stage] + names[::-1])] += 1
+            self.sample_count += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+class RequestProfile:
+    """Profile of a single request: stage timings, CPU samples and allocations"""
+
+    def __init__(self, reason: str, label: str = ""):
+        self.id = uuid.uuid4().hex[:12]
+        self.reason = reason
+        self.label = label
+        self.started_at = datetime.utcnow().isoformat()
+        self.stages: List[Dict[str, Any]] = []
+        self.profiler = SamplingProfiler(threading.get_ident(), settings.PROFILE_SAMPLE_INTERVAL_MS / 1000)
+        self._start = 0.0
+        self._duration = 0.0
+        # Whether this profile holds tracemalloc, and whether it started it
+        self.traces_memory = False
+        self._started_tracing = False
+        self._snapshot_before: Optional[tracemalloc.Snapshot] = None
+        self._top_allocations: List[Dict[str, Any]] = []
+        self._peak_bytes = 0
+
+    def start(self) -> None:
+        self.traces_memory = _tracemalloc_lock.acquire(blocking=False)
+        if self.traces_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(settings.PROFILE_TRACEMALLOC_FRAMES)
+                self._started_tracing = True
+            tracemalloc.reset_peak()
+            self._snapshot_before = tracemalloc.take_snapshot()
+        self._start = time.perf_counter()
+        self.profiler.start()
+
+    def stop(self) -> None:
+        self._duration = time.perf_counter() - self._start
+        self.profiler.stop()
+        if not self.traces_memory:
+            return
+        try:
+            _, self._peak_bytes = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            ])
+            diff = snapshot.compare_to(self._snapshot_before, "lineno")
+            self._top_allocations = [
+                {
+                    "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                    "size_diff_bytes": stat.size_diff,
+                    "count_diff": stat.count_diff,
+                }
+                for stat in diff[:settings.PROFILE_TOP_ALLOCATIONS]
+            ]
+        finally:
+            self._snapshot_before = None
+            if self._started_tracing:
+                tracemalloc.stop()
+            _tracemalloc_lock.release()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        previous = self.profiler.stage
+        self.profiler.stage = name
+        mem_before = tracemalloc.get_traced_memory()[0] if self.traces_memory else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append({
+                "stage": name,
+                "seconds": round(time.perf_counter() - start, 6),
+                "allocated_bytes": tracemalloc.get_traced_memory()[0] - mem_before if self.traces_memory else None,
+            })
+            self.profiler.stage = previous
+
+    def report(self) -> Dict[str, Any]:
+        samples = self.profiler.stacks.most_common(settings.PROFILE_TOP_STACKS)
+        by_stage: TallyCounter = TallyCounter()
+        for stack, count in self.profiler.stacks.items():
+            by_stage[stack.split(";", 1)[0]] += count
+        return {
+            "id": self.id,
+            "reason": self.reason,
+            "label": self.label,
+            "started_at": self.started_at,
+            "duration_seconds": round(self._duration, 6),
+            "stages": self.stages,
+            "cpu": {
+                "interval_ms": settings.PROFILE_SAMPLE_INTERVAL_MS,
+                "samples": self.profiler.sample_count,
+                "samples_by_stage": dict(by_stage),
+                # Collapsed stacks, usable directly by flamegraph tools
+                "top_stacks": [{"stack": stack, "samples": count} for stack, count in samples],
+            },
+            "memory": {
+                "traced": self.traces_memory,
+                "note": ("process-wide: includes allocations by requests running at the same time"
+                         if self.traces_memory else "not traced: another profile was tracing memory"),
+                "peak_traced_bytes": self._peak_bytes if self.traces_memory else None,
+                "top_allocations": self._top_allocations,
+            },
+        }
+
+class ProfileStore:
+    """Bounded on-disk ring of profile reports; the oldest files are dropped first"""
+
+    def __init__(self, directory: str, capacity: int):
+        self.directory = Path(directory)
+        self.capacity = capacity
+        self._lock = threading.Lock()
+
+    def _files(self) -> List[Path]:
+        if not self.directory.exists():
+            return []
+        return sorted(self.directory.glob("*.json"))
+
+    def save(self, report: Dict[str, Any]) -> Path:
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # Time-ordered names keep the ring sortable without an index file
+            path = self.directory / f"{time.time_ns()}-{report['id']}.json"
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(report))
+            os.replace(tmp, path)
+            files = self._files()
+            for old in files[:max(len(files) - self.capacity, 0)]:
+                old.unlink(missing_ok=True)
+            return path
+
+    def list(self) -> List[Dict[str, Any]]:
+        entries = []
+        for path in reversed(self._files()):
+            profile_id = path.stem.split("-", 1)[-1]
+            entries.append({"id": profile_id, "file": path.name, "bytes": path.stat().st_size})
+        return entries
+
+    def load(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        for path in self._files():
+            if path.stem.split("-", 1)[-1] == profile_id:
+                return json.loads(path.read_text())
+        return None
+
+# Global profile store
+profile_store = ProfileStore(settings.PROFILE_DIR, settings.PROFILE_RING_SIZE)
+
+_request_counter = itertools.count(1)
+
+def should_sample() -> bool:
+    """True for 1 in PROFILE_SAMPLE_RATE requests (never when the rate is 0)"""
+    rate = settings.PROFILE_SAMPLE_RATE
+    return rate > 0 and next(_request_counter) % rate == 0
+
+@contextmanager
+def profile_request(mode: Optional[str], label: str = "") -> Iterator[Optional[RequestProfile]]:
+    """
+    Profile the enclosed block when ``mode`` is "return" or "store", or when the
+    1-in-N sampler picks this request. Stored and sampled profiles are written
+    to the on-disk ring; the caller attaches returned ones to its response.
+    """
+    if mode is None and should_sample():
+        mode = "sampled"
+    if mode is None:
+        yield None
+        return
+
+    profile = RequestProfile(reason=mode, label=label)
+    token = _active_profile.set(profile)
+    profile.start()
+    try:
+        yield profile
+    finally:
+        profile.stop()
+        _active_profile.reset(token)
+        if mode in ("store", "sampled"):
+            try:
+                profile_store.save(profile.report())
+            except OSError as e:
+                logger.warning(f"Failed to store profile {profile.id}: {e}")
+
+@contextmanager
+def profile_stage(name: str) -> Iterator[None]:
+    """Mark a pipeline stage for the active profile; a no-op otherwise"""
+    profile = _active_profile.get()
+    if profile is None:
+        yield
+        return
+    with profile.stage(name):
+        yield
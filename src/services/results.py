@@ -0,0 +1,307 @@
+"""
+Memory-bounded query results
+
+Results are read from the cursor in batches. Up to RESULT_ROW_CAP rows are
+returned inline; past the cap the whole result is spilled batch by batch to
+a temporary SQLite file, so memory stays flat however large the result is.
+The spilled result is identified by a handle and backs pagination
+(/results/{handle}), streaming and export until it expires after
+RESULT_TTL_SECONDS. Exports (app/export.py) spill every result and keep
+their encoded files next to the spill file.
+"""
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from config.settings import settings
+from src.services.metrics import RESULT_SPILLS
+
+logger = logging.getLogger(__name__)
+
+_HANDLE_RE = re.compile(r"^[0-9a-f]{32}$")
+
+class ResultInfo:
+    """How much of a result was returned inline and where the rest went"""
+
+    def __init__(self, total_rows: Optional[int], truncated: bool = False, handle: Optional[str] = None,
+                 limit_reached: bool = False):
+        # None when reading stopped at the cap without counting the rest
+        self.total_rows = total_rows
+        self.truncated = truncated
+        self.handle = handle
+        self.limit_reached = limit_reached
+
+    @property
+    def spilled(self) -> bool:
+        return self.handle is not None
+
+    def to_dict(self) -> Dict[str, Any]:
+        info = {"truncated": self.truncated, "spilled": self.spilled, "total_rows": self.total_rows}
+        if self.handle:
+            info["result_handle"] = self.handle
+        if self.limit_reached:
+            info["spill_limit_reached"] = True
+        return info
+
+class QueryRows(list):
+    """
+    List of result records that also carries the ResultInfo of a capped
+    result and, when built by query_rows(), the DataFrame the records came
+    from, so charts profile the result without converting it again.
+    """
+
+    def __init__(self, records: Iterable[Dict[str, Any]] = (), info: Optional[ResultInfo] = None, frame: Any = None):
+        super().__init__(records)
+        self.info = info
+        self.frame = frame
+
+def result_metadata(answer: Any) -> Dict[str, Any]:
+    """Response fields describing a truncated or spilled answer; empty for complete answers"""
+    info = getattr(answer, "info", None)
+    if info is None or not info.truncated:
+        return {}
+    return info.to_dict()
+
+def _frame(columns: List[str], rows: List[tuple]):
+    """The same conversion pd.read_sql_query performs"""
+    import pandas as pd  # deferred: pandas dominates cold-start import time
+
+    return pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+
+def to_records(columns: List[str], rows: List[tuple]) -> List[Dict[str, Any]]:
+    """The same conversion pd.read_sql_query performs, as list-of-records"""
+    return _frame(columns, rows).to_dict(orient="records")
+
+def query_rows(columns: List[str], rows: List[tuple], info: Optional[ResultInfo] = None) -> QueryRows:
+    """Records as to_records() builds them, keeping the DataFrame for profiling"""
+    frame = _frame(columns, rows)
+    return QueryRows(frame.to_dict(orient="records"), info, frame)
+
+def fetch_batches(cursor, batch_size: Optional[int] = None) -> Iterator[List[tuple]]:
+    """Read a DB-API cursor in fetchmany batches"""
+    batch_size = batch_size or settings.RESULT_FETCH_BATCH
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return
+        yield batch
+
+def _storable(value: Any) -> Any:
+    """Values other engines return (Decimal, dates) in a form SQLite can store"""
+    if value is None or isinstance(value, (int, float, str, bytes)):
+        return value
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+class SpillWriter:
+    """Appends result rows to a spill file; the file gets its final name on finish()"""
+
+    def __init__(self, path: Path, columns: List[str]):
+        self.path = path
+        self.partial = Path(f"{path}.partial")
+        self.columns = columns
+        self.rows = 0
+        self._conn = sqlite3.connect(self.partial)
+        # A memory journal keeps the write cheap but still allows rolling back a batch
+        self._conn.execute("PRAGMA journal_mode = MEMORY")
+        self._conn.execute("PRAGMA synchronous = OFF")
+        self._convert = False
+        placeholders = ", ".join(f"c{i}" for i in range(len(columns)))
+        self._conn.execute(f"CREATE TABLE rows ({placeholders})")
+        self._conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._insert = f"INSERT INTO rows VALUES ({', '.join('?' * len(columns))})"
+
+    def write(self, rows: List[tuple]) -> None:
+        if self._convert:
+            rows = [tuple(_storable(v) for v in row) for row in rows]
+        self._conn.execute("SAVEPOINT batch")
+        try:
+            self._conn.executemany(self._insert, rows)
+        except (sqlite3.InterfaceError, sqlite3.ProgrammingError):
+            if self._convert:
+                raise
+            # Values SQLite cannot bind; convert this and every later batch
+            self._conn.execute("ROLLBACK TO batch")
+            self._convert = True
+            self._conn.executemany(self._insert, [tuple(_storable(v) for v in row) for row in rows])
+        self._conn.execute("RELEASE batch")
+        self.rows += len(rows)
+
+    def finish(self, complete: bool) -> None:
+        meta = {"columns": json.dumps(self.columns), "total_rows": str(self.rows),
+                "complete": "1" if complete else "0", "created_at": str(time.time())}
+        self._conn.executemany("INSERT INTO meta VALUES (?, ?)", meta.items())
+        self._conn.commit()
+        self._conn.close()
+        self.partial.replace(self.path)
+
+    def abort(self) -> None:
+        self._conn.close()
+        self.partial.unlink(missing_ok=True)
+
+class SpilledResult:
+    """Read access to a spilled result"""
+
+    def __init__(self, handle: str, path: Path):
+        self.handle = handle
+        self.path = path
+        conn = self._connect()
+        try:
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+        finally:
+            conn.close()
+        self.columns: List[str] = json.loads(meta["columns"])
+        self.total_rows = int(meta["total_rows"])
+        self.complete = meta["complete"] == "1"
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+
+    def page(self, offset: int, limit: int) -> List[tuple]:
+        """Rows offset+1 .. offset+limit; rows are stored in result order by rowid"""
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT * FROM rows WHERE rowid > ? AND rowid <= ? ORDER BY rowid",
+                                (offset, offset + limit)).fetchall()
+        finally:
+            conn.close()
+
+    def column_types(self) -> List[set]:
+        """SQLite storage classes seen in each column ('integer', 'real', 'text', 'blob', 'null')"""
+        if not self.columns:
+            return []
+        conn = self._connect()
+        try:
+            selects = ", ".join(f"group_concat(DISTINCT typeof(c{i}))" for i in range(len(self.columns)))
+            row = conn.execute(f"SELECT {selects} FROM rows").fetchone()
+        finally:
+            conn.close()
+        return [set(kinds.split(",")) if kinds else set() for kinds in row]
+
+    def batches(self, batch_size: Optional[int] = None, offset: int = 0) -> Iterator[List[tuple]]:
+        """Iterate the rows from ``offset`` in batches, holding one batch at a time"""
+        conn = self._connect()
+        try:
+            cursor = conn.execute("SELECT * FROM rows WHERE rowid > ? ORDER BY rowid", (offset,))
+            yield from fetch_batches(cursor, batch_size)
+        finally:
+            conn.close()
+
+class ResultStore:
+    """Directory of spill files, named by handle, removed once they expire"""
+
+    def __init__(self, directory: str, ttl: float):
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self._cleanup_lock = threading.Lock()
+
+    def create(self, columns: List[str]) -> Tuple[str, SpillWriter]:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.cleanup()
+        handle = uuid.uuid4().hex
+        return handle, SpillWriter(self.directory / f"{handle}.db", columns)
+
+    def export_path(self, handle: str, suffix: str) -> Path:
+        """Where the encoded export of a spilled result is kept (suffix such as csv.gz)"""
+        return self.directory / f"{handle}.{suffix}"
+
+    def open(self, handle: str) -> Optional[SpilledResult]:
+        """The spilled result for a handle, or None if it is unknown or expired"""
+        if not _HANDLE_RE.match(handle):
+            return None
+        path = self.directory / f"{handle}.db"
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl:
+                return None
+            return SpilledResult(handle, path)
+        except (FileNotFoundError, sqlite3.Error, KeyError):
+            return None
+
+    def cleanup(self) -> int:
+        """Delete spill and export files (and abandoned partial ones) older than the TTL"""
+        if not self._cleanup_lock.acquire(blocking=False):
+            return 0
+        removed = 0
+        try:
+            cutoff = time.time() - self.ttl
+            for path in self.directory.glob("*"):
+                try:
+                    if path.stat().st_mtime < cutoff:
+                        path.unlink()
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        finally:
+            self._cleanup_lock.release()
+        return removed
+
+# Global result store instance
+result_store = ResultStore(settings.RESULT_SPILL_DIR, settings.RESULT_TTL_SECONDS)
+
+def collect_rows(columns: List[str], batches: Iterable[List[tuple]],
+                 cap: Optional[int] = None, max_spill_rows: Optional[int] = None,
+                 store: Optional[ResultStore] = None) -> Tuple[List[tuple], ResultInfo]:
+    """
+    Keep at most ``cap`` rows in memory. A larger result is written to a
+    spill file, up to ``max_spill_rows`` rows, and only its first ``cap``
+    rows are returned; without spilling, reading simply stops at the cap.
+    """
+    cap = settings.RESULT_ROW_CAP if cap is None else cap
+    max_spill_rows = settings.RESULT_SPILL_MAX_ROWS if max_spill_rows is None else max_spill_rows
+    store = store or result_store
+    batches = iter(batches)
+
+    inline: List[tuple] = []
+    for batch in batches:
+        if not cap or len(inline) + len(batch) <= cap:
+            inline.extend(batch)
+            continue
+        if not max_spill_rows:
+            inline.extend(batch[:cap - len(inline)])
+            RESULT_SPILLS.inc(outcome="truncated")
+            return inline, ResultInfo(None, truncated=True)
+        return _spill(columns, inline, batch, batches, cap, max_spill_rows, store)
+    return inline, ResultInfo(len(inline))
+
+def spill_rows(columns: List[str], batches: Iterable[List[tuple]], max_spill_rows: Optional[int] = None,
+               store: Optional[ResultStore] = None) -> ResultInfo:
+    """Write a whole result to a spill file, however small; RESULT_SPILL_MAX_ROWS still applies"""
+    max_spill_rows = max_spill_rows or settings.RESULT_SPILL_MAX_ROWS or settings.RESULT_ROW_CAP
+    batches = iter(batches)
+    _, info = _spill(columns, [], next(batches, []), batches, 0, max_spill_rows, store or result_store)
+    return info
+
+def _spill(columns: List[str], inline: List[tuple], batch: List[tuple], batches: Iterator[List[tuple]],
+           cap: int, max_spill_rows: int, store: ResultStore) -> Tuple[List[tuple], ResultInfo]:
+    handle, writer = store.create(columns)
+    # With RESULT_SPILL_MAX_ROWS below the cap the inline rows alone can fill the spill
+    limit_reached = len(inline) > max_spill_rows
+    try:
+        writer.write(inline[:max_spill_rows])
+        pending: Optional[List[tuple]] = batch
+        while pending:
+            room = max(max_spill_rows - writer.rows, 0)
+            writer.write(pending[:room])
+            if len(inline) < cap:
+                inline.extend(pending[:cap - len(inline)])
+            if len(pending) > room:
+                limit_reached = True
+                break
+            pending = next(batches, None)
+        writer.finish(complete=not limit_reached)
+    except BaseException:
+        writer.abort()
+        raise
+    RESULT_SPILLS.inc(outcome="spilled")
+    logger.info(f"Spilled {writer.rows} result rows to {handle}")
+    return inline, ResultInfo(writer.rows, truncated=True, handle=handle, limit_reached=limit_reached)
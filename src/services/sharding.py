@@ -0,0 +1,665 @@
+"""
+Horizontal sharding by item_id with scatter-gather execution
+
+build_shards() splits every table with an item_id column across N SQLite
+files by ``item_id % N`` (other tables are copied to every shard), so all
+rows of an item, in every table, live on the same shard and joins on
+item_id stay shard-local. A shard is read either from a local file or from
+a worker process serving it over HTTP (``python -m src.services.sharding
+serve``), so shards can sit on other nodes.
+
+ShardCoordinator plans each query before running it:
+- aggregate queries run as per-shard partial aggregates that are merged
+  in a scratch SQLite database. SUM, TOTAL, COUNT, MIN and MAX merge
+  directly; AVG becomes SUM/COUNT; ratios such as RoAS
+  (SUM(ad_sales) / SUM(ad_spend)) are ratios of merged sums; COUNT(DISTINCT
+  item_id) is additive because items never span shards.
+- row queries are concatenated and re-sorted, with LIMIT pushed down as a
+  per-shard top-k.
+- ``item_id = <n>`` filters are sent to the one shard that holds the item.
+
+Queries the planner cannot split (subqueries, CTEs, set operations, window
+functions, other DISTINCT aggregates, joins not on item_id) run on the
+unsharded database when SHARD_FALLBACK is enabled.
+
+The manifest records the database the shards were built from. Once a new
+data generation is published the shards are stale: every query runs on the
+unsharded database (or fails without SHARD_FALLBACK) until they are
+rebuilt.
+
+Usage:
+    python -m src.services.sharding build --shards 4
+    python -m src.services.sharding serve --shard 0 --port 9100
+    python -m src.services.sharding status
+"""
+import argparse
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from config.settings import settings
+from src.services.metrics import SHARD_LATENCY, SHARD_QUERIES
+from src.services.results import fetch_batches
+from src.services.sqlparse import (
+    AGGREGATE_RE, COLUMN_RE, NOT_BEFORE_RE, Clauses, UnsupportedSQL, aggregate_calls, mask_literals, paren_depths,
+    quote_identifier, split_top_level,
+)
+
+logger = logging.getLogger(__name__)
+
+SHARD_KEY = "item_id"
+MANIFEST_FILE = "shards.json"
+# Metrics tables get the same (date, item_id) index as a database generation
+SHARD_INDEXES = {"ad_sales_metrics": ("date", "item_id"), "total_sales_metrics": ("date", "item_id")}
+
+QueryResult = Tuple[List[str], List[tuple]]
+BatchResult = Tuple[List[str], Iterator[List[tuple]]]
+
+class ShardingUnsupported(Exception):
+    """The query cannot be split into per-shard parts"""
+
+def shard_for(item_id: Any, count: int) -> int:
+    """Shard holding an item; matches the SQL expression used by build_shards()"""
+    return int(item_id or 0) % count
+
+def _shard_filename(index: int) -> str:
+    return f"shard-{index:03d}.db"
+
+def _source_tables(conn: sqlite3.Connection) -> List[str]:
+    from src.services.eligibility import INTERNAL_TABLES
+    from src.services.partitions import INTERNAL_TABLE_RE
+
+    rows = conn.execute("SELECT name FROM src.sqlite_master WHERE type IN ('table', 'view') ORDER BY name").fetchall()
+    return [name for (name,) in rows if not INTERNAL_TABLE_RE.match(name) and name not in INTERNAL_TABLES]
+
+def build_shards(source_path: str, directory: str, count: int) -> Dict[str, Any]:
+    """
+    Write ``count`` shard files and a manifest into ``directory``. Partitioned
+    or encoded source tables (views) are written out as plain tables.
+    """
+    target = Path(directory)
+    target.mkdir(parents=True, exist_ok=True)
+    source_uri = f"file:{Path(source_path).resolve()}?mode=ro"
+
+    tables: Dict[str, bool] = {}
+    files = []
+    for index in range(count):
+        path = target / _shard_filename(index)
+        building = Path(f"{path}.building")
+        building.unlink(missing_ok=True)
+        conn = sqlite3.connect(building, uri=True)
+        try:
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute("ATTACH DATABASE ? AS src", (source_uri,))
+            for table in _source_tables(conn):
+                columns = [row[1] for row in conn.execute(f"PRAGMA src.table_info('{table}')")]
+                sharded = SHARD_KEY in columns
+                tables[table] = sharded
+                where = f" WHERE (COALESCE({SHARD_KEY}, 0) % {count} + {count}) % {count} = {index}" if sharded else ""
+                conn.execute(f'CREATE TABLE main."{table}" AS SELECT * FROM src."{table}"{where}')
+                if table in SHARD_INDEXES:
+                    index_columns = SHARD_INDEXES[table]
+                    conn.execute(f'CREATE INDEX "idx_{table}_{"_".join(index_columns)}" ON "{table}" ({", ".join(index_columns)})')
+            conn.commit()
+            conn.execute("DETACH DATABASE src")
+            conn.execute("ANALYZE")
+            conn.commit()
+        finally:
+            conn.close()
+        building.replace(path)
+        files.append(path.name)
+
+    # The database the shards were split from; a backend serving another generation does not use them
+    manifest = {"key": SHARD_KEY, "count": count, "shards": files, "source": str(Path(source_path).resolve()),
+                "sharded_tables": sorted(t for t, s in tables.items() if s),
+                "replicated_tables": sorted(t for t, s in tables.items() if not s)}
+    tmp = target / f"{MANIFEST_FILE}.tmp"
+    tmp.write_text(json.dumps(manifest, indent=2))
+    tmp.replace(target / MANIFEST_FILE)
+    return manifest
+
+def load_manifest(directory: str) -> Dict[str, Any]:
+    with open(Path(directory) / MANIFEST_FILE) as f:
+        return json.load(f)
+
+def shards_current(manifest: Dict[str, Any], source_path: str) -> bool:
+    """Whether the shards were built from ``source_path``; manifests from before sources were recorded never are"""
+    return manifest.get("source") == str(Path(source_path).resolve())
+
+class LocalShard:
+    """A shard file opened read-only in this process"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = Path(path).name
+
+    def execute(self, query: str) -> QueryResult:
+        with self.fetch(query) as (columns, batches):
+            return columns, [row for batch in batches for row in batch]
+
+    @contextmanager
+    def fetch(self, query: str, batch_size: Optional[int] = None) -> Iterator[BatchResult]:
+        """Run a query and yield (column names, row batches) while its cursor is open"""
+        conn = sqlite3.connect(f"file:{Path(self.path).resolve()}?mode=ro", uri=True)
+        try:
+            cursor = conn.execute(query)
+            yield [d[0] for d in cursor.description or ()], fetch_batches(cursor, batch_size)
+        finally:
+            conn.close()
+
+class RemoteShard:
+    """
+    A shard served by a worker over HTTP: POST /query {"sql"} -> {"columns",
+    "rows"}. With "batch_size" the worker streams JSON lines instead: the
+    columns, then one {"rows"} line per batch.
+    """
+
+    def __init__(self, url: str, timeout: float = 30.0):
+        self.url = url.rstrip("/")
+        self.name = self.url
+        self.timeout = timeout
+
+    def _post(self, body: Dict[str, Any]):
+        request = urllib.request.Request(
+            f"{self.url}/query", data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST",
+        )
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            detail = json.loads(e.read() or b"{}").get("error", str(e))
+            raise sqlite3.OperationalError(f"{self.name}: {detail}")
+
+    def execute(self, query: str) -> QueryResult:
+        with self._post({"sql": query}) as response:
+            body = json.loads(response.read())
+        return body["columns"], [tuple(row) for row in body["rows"]]
+
+    @contextmanager
+    def fetch(self, query: str) -> Iterator[BatchResult]:
+        """Run a query and yield (column names, row batches) as the worker streams them"""
+        with self._post({"sql": query, "batch_size": settings.RESULT_FETCH_BATCH}) as response:
+            yield json.loads(response.readline())["columns"], self._batches(response)
+
+    def _batches(self, response) -> Iterator[List[tuple]]:
+        for line in response:
+            message = json.loads(line)
+            if "error" in message:
+                raise sqlite3.OperationalError(f"{self.name}: {message['error']}")
+            yield [tuple(row) for row in message["rows"]]
+
+def open_shards(directory: Optional[str] = None, nodes: Optional[List[str]] = None,
+                timeout: Optional[float] = None) -> Tuple[List[Any], Dict[str, Any]]:
+    """Shard clients in shard order: worker URLs from ``nodes`` when given, else the local files"""
+    directory = directory or settings.SHARD_DIR
+    manifest = load_manifest(directory)
+    nodes = nodes if nodes is not None else settings.SHARD_NODES
+    if nodes:
+        if len(nodes) != manifest["count"]:
+            raise ValueError(f"{len(nodes)} shard nodes configured for {manifest['count']} shards")
+        shards = [RemoteShard(url, timeout or settings.SHARD_TIMEOUT) if url.startswith("http") else LocalShard(url)
+                  for url in nodes]
+    else:
+        shards = [LocalShard(str(Path(directory) / name)) for name in manifest["shards"]]
+    return shards, manifest
+
+# --- Query planning ---------------------------------------------------------
+
+_DIRECTION_RE = re.compile(r"^(.*?)((?:\s+COLLATE\s+\w+)?(?:\s+(?:ASC|DESC))?(?:\s+NULLS\s+(?:FIRST|LAST))?)$", re.IGNORECASE | re.DOTALL)
+_LIMIT_RE = re.compile(r"^\s*(\d+)\s*(?:(?:OFFSET\s+(\d+))|(?:,\s*(\d+)))?\s*$", re.IGNORECASE)
+_KEY_JOIN_RE = re.compile(rf'(\bUSING\s*\(\s*"?{SHARD_KEY}"?\s*\)|\w+\."?{SHARD_KEY}"?\s*=\s*\w+\."?{SHARD_KEY}"?)', re.IGNORECASE)
+_KEY_EQUALS_RE = re.compile(rf'(?<![\w."])(?:\w+\.)?"?{SHARD_KEY}"?\s*=\s*(\d+)\b|\b(\d+)\s*=\s*(?:\w+\.)?"?{SHARD_KEY}"?(?![\w"])', re.IGNORECASE)
+_TOP_LEVEL_OR_RE = re.compile(r"\bOR\b", re.IGNORECASE)
+
+def _normalize(expression: str) -> str:
+    return re.sub(r"\s+", " ", expression.strip()).lower()
+
+def _check_joins(clauses: Clauses) -> None:
+    """Joins must be on the shard key so every joined row is on the same shard"""
+    sources = clauses.masked["FROM"] + " " + clauses.masked.get("WHERE", "")
+    joins = len(re.findall(r"\bJOIN\b", clauses.masked["FROM"], re.IGNORECASE)) + clauses.masked["FROM"].count(",")
+    if joins and len(_KEY_JOIN_RE.findall(sources)) < joins:
+        raise ShardingUnsupported(f"joins must be on {SHARD_KEY}")
+
+def _target_shards(clauses: Clauses, count: int) -> Optional[List[int]]:
+    """Shards an ``item_id = n`` filter restricts the query to, or None for all"""
+    where = clauses.masked.get("WHERE")
+    if not where:
+        return None
+    depths = paren_depths(where)
+    if any(depths[m.start()] == 0 for m in _TOP_LEVEL_OR_RE.finditer(where)):
+        return None
+    for match in _KEY_EQUALS_RE.finditer(where):
+        # NOT item_id = n matches every other shard; NOT (item_id = n) is one level deeper
+        if depths[match.start()] == 0 and not NOT_BEFORE_RE.search(where[:match.start()]):
+            return [shard_for(int(match.group(1) or match.group(2)), count)]
+    return None
+
+class _Aggregates:
+    """Partial aggregate columns for the shards and the expressions merging them"""
+
+    def __init__(self):
+        self.partials: List[str] = []
+        self._index: Dict[str, str] = {}
+
+    def partial(self, expression: str) -> str:
+        key = _normalize(expression)
+        if key not in self._index:
+            self._index[key] = f"p{len(self.partials)}"
+            self.partials.append(expression)
+        return self._index[key]
+
+    def merge(self, function: str, inner: str) -> str:
+        function = function.upper()
+        distinct = re.match(r"DISTINCT\s+(.*)$", inner, re.IGNORECASE | re.DOTALL)
+        if distinct:
+            column = COLUMN_RE.match(distinct.group(1).strip())
+            if function != "COUNT" or not column or column.group(1).lower() != SHARD_KEY:
+                raise ShardingUnsupported(f"{function}(DISTINCT ...) only splits for COUNT(DISTINCT {SHARD_KEY})")
+            return f"SUM({self.partial(f'COUNT({inner})')})"
+        if function in ("SUM", "COUNT"):
+            return f"SUM({self.partial(f'{function}({inner})')})"
+        if function in ("TOTAL", "MIN", "MAX"):
+            return f"{function}({self.partial(f'{function}({inner})')})"
+        # AVG
+        total, count = self.partial(f"SUM({inner})"), self.partial(f"COUNT({inner})")
+        return f"CAST(SUM({total}) AS REAL) / SUM({count})"
+
+def _rewrite(expression: str, aggregates: _Aggregates, groups: Dict[str, str]) -> str:
+    """Replace aggregate calls with merge expressions and grouped columns with their partial columns"""
+    normalized = _normalize(expression)
+    if normalized in groups:
+        return groups[normalized]
+    output, position = [], 0
+    for start, end, function, inner in aggregate_calls(expression):
+        output.append(_rewrite_columns(expression[position:start], groups))
+        output.append(aggregates.merge(function, inner))
+        position = end
+    output.append(_rewrite_columns(expression[position:], groups))
+    return "".join(output)
+
+def _rewrite_columns(text: str, groups: Dict[str, str]) -> str:
+    """Grouped plain columns used outside aggregates refer to their partial column"""
+    for key, column in groups.items():
+        name = COLUMN_RE.match(key)
+        if name:
+            pattern = rf'(?<![\w."])(?:\w+\.)?"?{re.escape(name.group(1))}"?(?![\w"(])'
+            text = re.sub(pattern, column, text, flags=re.IGNORECASE)
+    return text
+
+class ShardPlan:
+    """Per-shard SQL plus the SQL merging the partial rows"""
+
+    def __init__(self, kind: str, shard_sql: str, merge_sql: Optional[str] = None,
+                 partial_columns: Optional[List[str]] = None,
+                 targets: Optional[List[int]] = None, hidden_columns: int = 0):
+        self.kind = kind
+        self.shard_sql = shard_sql
+        self.merge_sql = merge_sql
+        # Column names of the partials table; None when they depend on the row width.
+        # Aggregate merges name their columns as the original query would.
+        self.partial_columns = partial_columns
+        self.targets = targets
+        # ORDER BY expressions a row query selects only for sorting
+        self.hidden_columns = hidden_columns
+
+def _limit_clause(clauses: Clauses) -> Tuple[str, Optional[int]]:
+    """LIMIT text for the merge and the per-shard row bound (limit + offset) if it is constant"""
+    limit = clauses.get("LIMIT")
+    if not limit:
+        return "", None
+    match = _LIMIT_RE.match(limit)
+    if not match:
+        return f" LIMIT {limit}", None
+    if match.group(3):  # LIMIT offset, count
+        return f" LIMIT {limit}", int(match.group(1)) + int(match.group(3))
+    return f" LIMIT {limit}", int(match.group(1)) + int(match.group(2) or 0)
+
+def plan_query(query: str, shard_count: int) -> ShardPlan:
+    """Split a query into per-shard SQL and merge SQL; raises ShardingUnsupported"""
+    try:
+        return _plan(query, shard_count)
+    except UnsupportedSQL as e:
+        raise ShardingUnsupported(str(e)) from e
+
+def _plan(query: str, shard_count: int) -> ShardPlan:
+    clauses = Clauses(query)
+    _check_joins(clauses)
+    targets = _target_shards(clauses, shard_count)
+    if targets is not None:
+        # One shard holds every matching row; run the query unchanged there
+        return ShardPlan("single", query, targets=targets)
+
+    where = f" WHERE {clauses.get('WHERE')}" if clauses.get("WHERE") else ""
+    source = f" FROM {clauses.get('FROM')}{where}"
+    select_masked = " ".join(mask_literals(item.expression) for item in clauses.items)
+    is_aggregate = bool(clauses.get("GROUP BY") or clauses.get("HAVING") or AGGREGATE_RE.search(select_masked))
+    if is_aggregate:
+        return _plan_aggregate(clauses, source)
+    return _plan_rows(clauses, source)
+
+def _plan_aggregate(clauses: Clauses, source: str) -> ShardPlan:
+    items = clauses.items
+    aliases = {item.alias.lower(): item for item in items if item.alias}
+
+    group_exprs: List[str] = []
+    if clauses.get("GROUP BY"):
+        for term in split_top_level(clauses.get("GROUP BY"), mask_literals(clauses.get("GROUP BY"))):
+            if term.isdigit():
+                term = items[int(term) - 1].expression
+            elif term.lower() in aliases:
+                term = aliases[term.lower()].expression
+            group_exprs.append(term)
+    groups = {_normalize(expr): f"g{i}" for i, expr in enumerate(group_exprs)}
+
+    aggregates = _Aggregates()
+    merged_items = []
+    for i, item in enumerate(items):
+        if "*" in mask_literals(item.expression) and not AGGREGATE_RE.search(mask_literals(item.expression)):
+            raise ShardingUnsupported("SELECT * with aggregates")
+        expression = _rewrite(item.expression, aggregates, groups)
+        merged_items.append(f"{expression} AS {quote_identifier(item.name)}")
+
+    having = f" HAVING {_rewrite(clauses.get('HAVING'), aggregates, groups)}" if clauses.get("HAVING") else ""
+    order = ""
+    if clauses.get("ORDER BY"):
+        terms = []
+        for term in split_top_level(clauses.get("ORDER BY"), mask_literals(clauses.get("ORDER BY"))):
+            core, suffix = _DIRECTION_RE.match(term).groups()
+            if not core.strip().isdigit() and core.strip().lower() not in aliases:
+                core = _rewrite(core, aggregates, groups)
+            terms.append(core + suffix)
+        order = " ORDER BY " + ", ".join(terms)
+    limit, _ = _limit_clause(clauses)
+
+    partial_select = [f"{expr} AS g{i}" for i, expr in enumerate(group_exprs)]
+    partial_select += [f"{expr} AS p{i}" for i, expr in enumerate(aggregates.partials)]
+    if not partial_select:
+        raise ShardingUnsupported("nothing to aggregate")
+    group_by = f" GROUP BY {', '.join(group_exprs)}" if group_exprs else ""
+    shard_sql = f"SELECT {', '.join(partial_select)}{source}{group_by}"
+
+    partial_names = [f"g{i}" for i in range(len(group_exprs))] + [f"p{i}" for i in range(len(aggregates.partials))]
+    merge_group = f" GROUP BY {', '.join(f'g{i}' for i in range(len(group_exprs)))}" if group_exprs else ""
+    distinct = "DISTINCT " if clauses.distinct else ""
+    merge_sql = f"SELECT {distinct}{', '.join(merged_items)} FROM partials{merge_group}{having}{order}{limit}"
+    return ShardPlan("aggregate", shard_sql, merge_sql, partial_names)
+
+def _plan_rows(clauses: Clauses, source: str) -> ShardPlan:
+    items = clauses.items
+    star = any(mask_literals(item.expression).strip().endswith("*") for item in items)
+    aliases = {item.alias.lower(): i for i, item in enumerate(items) if item.alias}
+    expressions = {_normalize(item.expression): i for i, item in enumerate(items)}
+    # An unqualified ORDER BY column can only name the one selected column of that name
+    # (SQLite rejects it as ambiguous otherwise); qualified terms must match exactly
+    names: Dict[str, Optional[int]] = {}
+    for i, item in enumerate(items):
+        column = COLUMN_RE.match(item.expression)
+        if column and not item.alias:
+            name = column.group(1).lower()
+            names[name] = None if name in names else i
+
+    hidden: List[str] = []
+    order_terms: List[str] = []
+    if clauses.get("ORDER BY"):
+        for term in split_top_level(clauses.get("ORDER BY"), mask_literals(clauses.get("ORDER BY"))):
+            core, suffix = _DIRECTION_RE.match(term).groups()
+            key = core.strip()
+            if key.isdigit():
+                order_terms.append(f"c{int(key) - 1}{suffix}")
+                continue
+            index = None if star else aliases.get(key.lower(), expressions.get(_normalize(key)))
+            if index is None and not star and re.match(r'^"?\w+"?$', key):
+                index = names.get(key.strip('"').lower())
+            if index is not None:
+                order_terms.append(f"c{index}{suffix}")
+            else:
+                if clauses.distinct:
+                    raise ShardingUnsupported("DISTINCT ordered by a column it does not select")
+                hidden.append(key)
+                order_terms.append(f"o{len(hidden) - 1}{suffix}")
+
+    limit, bound = _limit_clause(clauses)
+    select = ", ".join(item.text for item in items)
+    hidden_select = "".join(f", {expr} AS o{i}" for i, expr in enumerate(hidden))
+    distinct = "DISTINCT " if clauses.distinct else ""
+    shard_sql = f"SELECT {distinct}{select}{hidden_select}{source}"
+    if bound is not None:
+        if clauses.get("ORDER BY"):
+            shard_sql += f" ORDER BY {clauses.get('ORDER BY')}"
+        shard_sql += f" LIMIT {bound}"
+
+    order = f" ORDER BY {', '.join(order_terms)}" if order_terms else ""
+    # Visible columns are filled in once the shards report how many there are
+    merge_sql = f"SELECT {distinct}{{columns}} FROM partials{order}{limit}"
+    return ShardPlan("rows", shard_sql, merge_sql, hidden_columns=len(hidden))
+
+# --- Execution --------------------------------------------------------------
+
+class ShardCoordinator:
+    """Runs queries across shards in parallel and merges the partial results"""
+
+    def __init__(self, shards: List[Any], fallback: Optional[Any] = None):
+        self.shards = shards
+        # Anything with execute(query) -> (columns, rows), used for queries the planner cannot split
+        self.fallback = fallback
+        self._executor = ThreadPoolExecutor(max_workers=max(len(shards), 1), thread_name_prefix="shard")
+
+    def _run(self, index: int, query: str) -> QueryResult:
+        shard = self.shards[index]
+        with SHARD_LATENCY.time(shard=str(index)):
+            return shard.execute(query)
+
+    def scatter(self, query: str, targets: Optional[List[int]] = None) -> List[QueryResult]:
+        """Run ``query`` on every shard (or ``targets``) in parallel"""
+        targets = list(range(len(self.shards))) if targets is None else targets
+        futures = [self._executor.submit(self._run, index, query) for index in targets]
+        return [future.result() for future in futures]
+
+    def execute(self, query: str) -> QueryResult:
+        with self.fetch(query) as (columns, batches):
+            return columns, [row for batch in batches for row in batch]
+
+    @contextmanager
+    def fetch(self, query: str) -> Iterator[BatchResult]:
+        """
+        Run a query and yield (column names, row batches). Shards stream their
+        partial rows into an on-disk scratch database, and the merged rows
+        are read from it batch by batch, so large row results never sit in
+        memory whole.
+        """
+        if query.lstrip()[:6].upper() == "PRAGMA":
+            # Schema and settings are the same on every shard
+            with _fetch(self.shards[0], query) as result:
+                yield result
+            return
+        try:
+            plan = plan_query(query, len(self.shards))
+        except ShardingUnsupported as e:
+            if self.fallback is None:
+                raise
+            logger.info(f"Running query unsharded: {e}")
+            SHARD_QUERIES.inc(plan="fallback")
+            with _fetch(self.fallback, query) as result:
+                yield result
+            return
+
+        SHARD_QUERIES.inc(plan=plan.kind)
+        if plan.kind == "single":
+            with _fetch(self.shards[plan.targets[0]], plan.shard_sql) as result:
+                yield result
+            return
+
+        conn = sqlite3.connect("", check_same_thread=False)
+        try:
+            shard_columns = self._gather(conn, plan)
+            columns = shard_columns[:len(shard_columns) - plan.hidden_columns]
+            merge_sql = plan.merge_sql
+            if plan.partial_columns is None:
+                merge_sql = merge_sql.format(columns=", ".join(f"c{i}" for i in range(len(columns))))
+            try:
+                cursor = conn.execute(merge_sql)
+            except sqlite3.OperationalError as e:
+                # e.g. bare non-grouped columns, which only the unsharded query can resolve
+                if self.fallback is None:
+                    raise ShardingUnsupported(f"partial results do not merge: {e}")
+                logger.info(f"Running query unsharded, merge failed: {e}")
+                SHARD_QUERIES.inc(plan="fallback")
+                cursor = None
+            if cursor is None:
+                with _fetch(self.fallback, query) as result:
+                    yield result
+            else:
+                if plan.partial_columns is not None:
+                    columns = [d[0] for d in cursor.description]
+                yield columns, fetch_batches(cursor)
+        finally:
+            conn.close()
+
+    def _gather(self, conn: sqlite3.Connection, plan: ShardPlan) -> List[str]:
+        """Insert every shard's partial rows into the scratch ``partials`` table; returns the shards' column names"""
+        lock = threading.Lock()
+        reported: List[List[str]] = []
+
+        def load(index: int) -> None:
+            with SHARD_LATENCY.time(shard=str(index)), _fetch(self.shards[index], plan.shard_sql) as (columns, batches):
+                with lock:
+                    if not reported:
+                        reported.append(columns)
+                        names = plan.partial_columns or (
+                            [f"c{i}" for i in range(len(columns) - plan.hidden_columns)]
+                            + [f"o{i}" for i in range(plan.hidden_columns)])
+                        conn.execute(f"CREATE TABLE partials ({', '.join(names)})")
+                insert = f"INSERT INTO partials VALUES ({', '.join('?' * len(columns))})"
+                # One batch per shard in flight; the scratch connection takes one writer at a time
+                for batch in batches:
+                    with lock:
+                        conn.executemany(insert, batch)
+
+        futures = [self._executor.submit(load, index) for index in range(len(self.shards))]
+        # Every load must stop before the caller closes the scratch database
+        wait(futures)
+        for future in futures:
+            future.result()
+        return reported[0]
+
+    def get_table_names(self) -> List[str]:
+        _, rows = self._run(0, "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%'")
+        return [name for (name,) in rows]
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+@contextmanager
+def _fetch(source: Any, query: str) -> Iterator[BatchResult]:
+    """Batches from a shard or fallback backend; sources with only execute() give one batch"""
+    if hasattr(source, "fetch"):
+        with source.fetch(query) as result:
+            yield result
+    else:
+        columns, rows = source.execute(query)
+        yield columns, iter([rows] if rows else [])
+
+# --- Worker -----------------------------------------------------------------
+
+class _WorkerHandler(BaseHTTPRequestHandler):
+    shard: LocalShard = None
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._reply(200, {"status": "ok", "shard": self.shard.name})
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/query":
+            self._reply(404, {"error": "not found"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            if "batch_size" in body:
+                self._stream(body["sql"], int(body["batch_size"]))
+                return
+            columns, rows = self.shard.execute(body["sql"])
+        except (sqlite3.Error, KeyError, ValueError) as e:
+            self._reply(400, {"error": str(e)})
+            return
+        self._reply(200, {"columns": columns, "rows": rows})
+
+    def _stream(self, query: str, batch_size: int) -> None:
+        """JSON lines: the columns, then one line per row batch (or an error line if reading fails midway)"""
+        with self.shard.fetch(query, batch_size) as (columns, batches):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            self.wfile.write(json.dumps({"columns": columns}).encode("utf-8") + b"\n")
+            try:
+                for batch in batches:
+                    self.wfile.write(json.dumps({"rows": batch}).encode("utf-8") + b"\n")
+            except sqlite3.Error as e:
+                self.wfile.write(json.dumps({"error": str(e)}).encode("utf-8") + b"\n")
+
+    def _reply(self, status: int, body: Dict[str, Any]) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+def make_worker(shard_path: str, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """HTTP worker serving one shard file read-only; port 0 picks a free port"""
+    handler = type("ShardWorkerHandler", (_WorkerHandler,), {"shard": LocalShard(shard_path)})
+    return ThreadingHTTPServer((host, port), handler)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build, serve and inspect item_id shards")
+    parser.add_argument("command", choices=["build", "serve", "status"])
+    parser.add_argument("--dir", default=settings.SHARD_DIR, help="Shard directory")
+    parser.add_argument("--source", help="Database to shard (default: the current generation)")
+    parser.add_argument("--shards", type=int, default=settings.SHARD_COUNT, help="Number of shards to build")
+    parser.add_argument("--shard", type=int, help="Shard index to serve")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        from src.services.generations import generations
+
+        start = time.perf_counter()
+        manifest = build_shards(args.source or generations.current().path, args.dir, args.shards)
+        print(f"Built {manifest['count']} shards in {time.perf_counter() - start:.1f}s: "
+              f"sharded {', '.join(manifest['sharded_tables'])}; replicated {', '.join(manifest['replicated_tables']) or '-'}")
+    elif args.command == "serve":
+        manifest = load_manifest(args.dir)
+        path = str(Path(args.dir) / manifest["shards"][args.shard])
+        server = make_worker(path, args.host, args.port)
+        print(f"Serving {path} on http://{args.host}:{server.server_address[1]}")
+        server.serve_forever()
+    else:
+        from src.services.generations import generations
+
+        shards, manifest = open_shards(args.dir, nodes=[])
+        current = generations.current().path
+        state = "current" if shards_current(manifest, current) else f"stale, serving {current}"
+        print(f"Built from {manifest.get('source', 'an unrecorded database')} ({state})")
+        for index, shard in enumerate(shards):
+            counts = [f"{table} {shard.execute(f'SELECT COUNT(*) FROM {table}')[1][0][0]:,d}"
+                      for table in manifest["sharded_tables"]]
+            print(f"  shard {index}: {shard.name}  " + ", ".join(counts))
+
+if __name__ == "__main__":
+    main()
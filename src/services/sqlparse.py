@@ -0,0 +1,151 @@
+"""
+SQL text helpers shared by the query planners
+
+Partition routing (partitions.py), scatter-gather planning (sharding.py)
+and sampled estimates (approximate.py) read SQL as text rather than
+through a full parser. String literal contents are blanked out first so
+nothing inside them is matched, and clauses, commas and keywords only
+count at the parenthesis depth they belong to. Clauses splits a single
+SELECT statement into its top-level clauses and select items; statements
+outside that shape raise UnsupportedSQL.
+"""
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+
+AGGREGATE_RE = re.compile(r"\b(SUM|TOTAL|COUNT|AVG|MIN|MAX)\s*\(", re.IGNORECASE)
+# A plain, optionally qualified column reference; group 1 is the column name
+COLUMN_RE = re.compile(r'^(?:\w+\.)?"?(\w+)"?$')
+# NOT directly before a predicate negates it
+NOT_BEFORE_RE = re.compile(r"\bNOT\s*$", re.IGNORECASE)
+
+_CLAUSE_RE = re.compile(r"\b(SELECT|FROM|WHERE|GROUP\s+BY|HAVING|ORDER\s+BY|LIMIT)\b", re.IGNORECASE)
+_UNSUPPORTED_RE = re.compile(r"\b(UNION|INTERSECT|EXCEPT|OVER|WITH|WINDOW|FILTER|GROUP_CONCAT|STRING_AGG)\b", re.IGNORECASE)
+_ALIAS_RE = re.compile(r'^(.*?)\s+(?:AS\s+)?("(?:[^"]|"")+"|[A-Za-z_]\w*)$', re.IGNORECASE | re.DOTALL)
+_NOT_ALIASES = {"end", "null", "asc", "desc", "and", "or", "not", "else", "then", "distinct", "is"}
+
+class UnsupportedSQL(Exception):
+    """The statement is not a shape the clause helpers can take apart"""
+
+def mask_literals(query: str) -> str:
+    """Blank out string literal contents (keeping offsets) so nothing inside them is matched"""
+    return re.sub(r"'(?:[^']|'')*'", lambda m: "'" + " " * (len(m.group(0)) - 2) + "'", query)
+
+def paren_depths(masked: str) -> List[int]:
+    """Parenthesis depth of every character; a paren has the depth of its contents"""
+    depths, depth = [], 0
+    for char in masked:
+        if char == "(":
+            depth += 1
+        depths.append(depth)
+        if char == ")":
+            depth -= 1
+    return depths
+
+def split_top_level(text: str, masked: str) -> List[str]:
+    """Split on commas outside parentheses"""
+    parts, start, depth = [], 0, 0
+    for i, char in enumerate(masked):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            parts.append(text[start:i].strip())
+            start = i + 1
+    parts.append(text[start:].strip())
+    return [p for p in parts if p]
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def _balanced(masked: str) -> bool:
+    return masked.count("(") == masked.count(")")
+
+class SelectItem:
+    """One select list item split into its expression and alias"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.expression, self.alias = text, None
+        masked = mask_literals(text)
+        match = _ALIAS_RE.match(masked)
+        if match and match.group(2).strip('"').lower() not in _NOT_ALIASES and _balanced(masked[:match.end(1)]):
+            head = masked[:match.end(1)].rstrip()
+            # "expr alias" needs the expression to end like an operand, not an operator
+            if re.search(r"[\w)\]\"']$", head) and not re.search(r"\bCASE\b(?!.*\bEND\b)", head, re.IGNORECASE | re.DOTALL):
+                self.expression = text[:match.end(1)].strip()
+                self.alias = match.group(2).strip('"')
+
+    @property
+    def name(self) -> str:
+        """Output column name SQLite gives the item when the query is read as a subquery"""
+        if self.alias:
+            return self.alias
+        column = COLUMN_RE.match(self.expression)
+        return column.group(1) if column else self.expression
+
+class Clauses:
+    """Top-level clauses of a single SELECT statement"""
+
+    def __init__(self, query: str):
+        query = query.strip().rstrip(";").strip()
+        masked = mask_literals(query)
+        if _UNSUPPORTED_RE.search(masked):
+            raise UnsupportedSQL("set operations, CTEs, window functions and FILTER are not supported")
+        if len(re.findall(r"\bSELECT\b", masked, re.IGNORECASE)) != 1:
+            raise UnsupportedSQL("subqueries are not supported")
+        depths = paren_depths(masked)
+        marks = [(m.start(), m.end(), re.sub(r"\s+", " ", m.group(1).upper()))
+                 for m in _CLAUSE_RE.finditer(masked) if depths[m.start()] == 0]
+        if not marks or marks[0][2] != "SELECT" or marks[0][0] != 0:
+            raise UnsupportedSQL("not a SELECT statement")
+        names = [name for _, _, name in marks]
+        if len(set(names)) != len(names):
+            raise UnsupportedSQL("repeated clause")
+        self.parts: Dict[str, str] = {}
+        self.masked: Dict[str, str] = {}
+        for i, (_, body_start, name) in enumerate(marks):
+            end = marks[i + 1][0] if i + 1 < len(marks) else len(query)
+            self.parts[name] = query[body_start:end].strip()
+            self.masked[name] = masked[body_start:end].strip()
+
+        self.distinct = False
+        select, select_masked = self.parts["SELECT"], self.masked["SELECT"]
+        prefix = re.match(r"(DISTINCT|ALL)\s+", select_masked, re.IGNORECASE)
+        if prefix:
+            self.distinct = prefix.group(1).upper() == "DISTINCT"
+            select, select_masked = select[prefix.end():], select_masked[prefix.end():]
+        self.items = [SelectItem(text) for text in split_top_level(select, select_masked)]
+        if "FROM" not in self.parts:
+            raise UnsupportedSQL("no FROM clause")
+
+    def get(self, name: str) -> Optional[str]:
+        return self.parts.get(name)
+
+def aggregate_calls(expression: str) -> Iterator[Tuple[int, int, str, str]]:
+    """(start, end, FUNCTION, argument) of each aggregate call in an expression"""
+    masked = mask_literals(expression)
+    position = 0
+    for match in AGGREGATE_RE.finditer(masked):
+        if match.start() < position:
+            continue
+        open_paren = match.end() - 1
+        depth, close = 0, None
+        for i in range(open_paren, len(masked)):
+            depth += masked[i] == "("
+            depth -= masked[i] == ")"
+            if depth == 0:
+                close = i
+                break
+        if close is None:
+            raise UnsupportedSQL("unbalanced parentheses")
+        function = match.group(1).upper()
+        inner = expression[open_paren + 1:close].strip()
+        if len(split_top_level(inner, mask_literals(inner))) > 1:
+            if function in ("MIN", "MAX"):
+                continue  # scalar min()/max() of several arguments
+            raise UnsupportedSQL(f"{function} with several arguments")
+        if AGGREGATE_RE.search(mask_literals(inner)):
+            raise UnsupportedSQL("nested aggregates")
+        yield match.start(), close + 1, function, inner
+        position = close + 1
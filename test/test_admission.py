@@ -0,0 +1,121 @@
+"""
+Admission limits: priority queues, preemption, timeouts and 429 shedding
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from src.services.admission import (
+    PRIORITIES, AdmissionController, AdmissionLimiter, AdmissionMiddleware, AdmissionRejected, parse_priority,
+)
+
+def _queue_in_thread(limiter, priority):
+    """Start a caller that queues for a slot; returns (thread, outcome list)"""
+    outcome = []
+
+    def run():
+        try:
+            outcome.append(limiter.acquire(priority))
+        except AdmissionRejected as e:
+            outcome.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, outcome
+
+def _wait_queued(limiter, count):
+    for _ in range(500):
+        if limiter.stats()["queued"] == count:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"{limiter.stats()} never had {count} queued")
+
+def test_higher_priority_preempts_queued_caller():
+    limiter = AdmissionLimiter("test", limit=1, queue_size=1, timeout=5)
+    held = limiter.acquire(PRIORITIES["default"])
+    batch, batch_outcome = _queue_in_thread(limiter, PRIORITIES["batch"])
+    _wait_queued(limiter, 1)
+
+    interactive, interactive_outcome = _queue_in_thread(limiter, PRIORITIES["interactive"])
+    batch.join(5)
+    assert isinstance(batch_outcome[0], AdmissionRejected) and batch_outcome[0].reason == "preempted"
+    _wait_queued(limiter, 1)
+
+    # The slot goes to the interactive caller once it is released
+    limiter.release(held)
+    interactive.join(5)
+    assert isinstance(interactive_outcome[0], float)
+    assert limiter.stats() == {"limit": 1, "active": 1, "queued": 0, "queue_size": 1}
+    limiter.release(interactive_outcome[0])
+    assert limiter.stats()["active"] == 0
+
+def test_full_queue_sheds_equal_or_lower_priority():
+    limiter = AdmissionLimiter("test", limit=1, queue_size=1, timeout=5)
+    held = limiter.acquire()
+    waiter, outcome = _queue_in_thread(limiter, PRIORITIES["interactive"])
+    _wait_queued(limiter, 1)
+    for priority in (PRIORITIES["interactive"], PRIORITIES["batch"]):
+        with pytest.raises(AdmissionRejected) as rejected:
+            limiter.acquire(priority)
+        assert rejected.value.reason == "queue_full" and rejected.value.retry_after >= 1
+    limiter.release(held)
+    waiter.join(5)
+    limiter.release(outcome[0])
+
+def test_queue_timeout_sheds_waiter():
+    limiter = AdmissionLimiter("test", limit=1, queue_size=2, timeout=0.05)
+    held = limiter.acquire()
+    with pytest.raises(AdmissionRejected) as rejected:
+        limiter.acquire()
+    assert rejected.value.reason == "timeout"
+    assert limiter.stats()["queued"] == 0
+    limiter.release(held)
+    assert limiter.stats()["active"] == 0
+
+def test_clients_may_only_lower_their_priority():
+    assert parse_priority("batch") == PRIORITIES["batch"]
+    assert parse_priority("interactive") == PRIORITIES["default"]
+    assert parse_priority(None) == PRIORITIES["default"]
+
+def test_middleware_answers_429_with_retry_after():
+    controller = AdmissionController({"/ask": (1, 0)}, {}, timeout=5)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def app(scope, receive, send):
+            await release.wait()
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"ok"})
+
+        middleware = AdmissionMiddleware(app, controller)
+
+        async def request(path):
+            messages = []
+
+            async def send(message):
+                messages.append(message)
+
+            async def receive():
+                return {"type": "http.request", "body": b""}
+
+            await middleware({"type": "http", "path": path, "headers": []}, receive, send)
+            return messages
+
+        first = asyncio.ensure_future(request("/ask"))
+        while controller.endpoints["/ask"].stats()["active"] == 0:
+            await asyncio.sleep(0.001)
+        shed = await request("/ask")
+        # Paths without a limit are not held up
+        other = asyncio.ensure_future(request("/health"))
+        release.set()
+        return await first, shed, await other
+
+    first, shed, other = asyncio.run(scenario())
+    assert first[0]["status"] == 200 and other[0]["status"] == 200
+    assert shed[0]["status"] == 429
+    headers = dict(shed[0]["headers"])
+    assert int(headers[b"retry-after"]) >= 1
+    assert controller.endpoints["/ask"].stats()["active"] == 0
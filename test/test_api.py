@@ -1 +1,52 @@
 # Tests for API endpoints
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from src.services.cache import cache
+from src.services.results import QueryRows
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(cache, "enabled", False)
+    monkeypatch.setattr("app.pipeline.ask_llm", lambda question: "SELECT item_id, clicks FROM ad_sales_metrics")
+    monkeypatch.setattr("app.pipeline.execute_sql_query", lambda sql: QueryRows([{"item_id": 1, "clicks": 3}]))
+    monkeypatch.setattr("app.pipeline.visualizer.generate_visualization",
+                        lambda rows, question, chart_type: {"chart_type": chart_type})
+    return TestClient(app)
+
+def _fail(message):
+    def raise_error(*args):
+        raise RuntimeError(message)
+    return raise_error
+
+def test_ask_answers_question(client):
+    response = client.post("/ask", json={"question": "clicks per item", "chart_type": "bar"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["answer"] == [{"item_id": 1, "clicks": 3}] and body["visualization"] == {"chart_type": "bar"}
+    assert "error" not in body
+
+def test_ask_reports_llm_failure_in_body(client, monkeypatch):
+    monkeypatch.setattr("app.pipeline.ask_llm", _fail("GEMINI_API_KEY not set in environment variables"))
+    response = client.post("/ask", json={"question": "clicks per item"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["answer"] == "Error from LLM: GEMINI_API_KEY not set in environment variables"
+    assert body["stage"] == "llm" and body["sql_query"] is None and body["visualization"] is None
+
+def test_ask_reports_execution_failure_in_body(client, monkeypatch):
+    monkeypatch.setattr("app.pipeline.execute_sql_query", _fail("disk I/O error"))
+    body = client.post("/ask", json={"question": "clicks per item"}).json()
+    assert body["answer"] == "SQL Execution Error: disk I/O error"
+    assert body["error"] == "disk I/O error" and body["stage"] == "execute"
+
+def test_visualize_reports_failure_in_body(client, monkeypatch):
+    monkeypatch.setattr("app.pipeline.visualizer.generate_visualization", _fail("unknown chart type"))
+    response = client.get("/visualize/radar", params={"question": "clicks per item"})
+    assert response.status_code == 200
+    assert response.json()["stage"] == "visualize" and response.json()["data"] == "SQL Execution Error: unknown chart type"
+
+def test_visualize_without_rows_is_rejected(client, monkeypatch):
+    monkeypatch.setattr("app.pipeline.execute_sql_query", lambda sql: QueryRows([]))
+    assert client.get("/visualize/bar", params={"question": "clicks per item"}).status_code == 400
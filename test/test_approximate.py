@@ -0,0 +1,84 @@
+"""
+Sampled estimates must land near the exact answer, within their error bounds
+"""
+import random
+import sqlite3
+
+import pytest
+
+from src.services.approximate import (
+    ApproximationUnsupported, build_samples, estimate_on, load_catalog, plan_estimate,
+)
+from src.services.partitions import INTERNAL_TABLE_RE
+
+ITEMS = 200
+ROWS_PER_ITEM = 500
+
+@pytest.fixture(scope="module")
+def conn(tmp_path_factory):
+    conn = sqlite3.connect(str(tmp_path_factory.mktemp("approximate") / "data.db"))
+    conn.execute("CREATE TABLE ad_sales_metrics (date TEXT, item_id INTEGER, ad_sales REAL, ad_spend REAL, clicks INTEGER)")
+    rng = random.Random(7)
+    rows = []
+    for item_id in range(1, ITEMS + 1):
+        scale = rng.uniform(1, 100)
+        for day in range(ROWS_PER_ITEM):
+            spend = rng.uniform(0, scale)
+            rows.append((f"2025-{day % 12 + 1:02d}-01", item_id, spend * rng.uniform(0.5, 4), spend, rng.randint(0, 50)))
+    conn.executemany("INSERT INTO ad_sales_metrics VALUES (?, ?, ?, ?, ?)", rows)
+    build_samples(conn, rate=0.02, replicates=10)
+    yield conn
+    conn.close()
+
+@pytest.mark.parametrize("query", [
+    "SELECT SUM(ad_sales), AVG(clicks), TOTAL(ad_spend) FROM ad_sales_metrics",
+    "SELECT date, SUM(ad_sales) / SUM(ad_spend) AS roas FROM ad_sales_metrics GROUP BY date ORDER BY date",
+    "SELECT COUNT(clicks) AS busy FROM ad_sales_metrics m WHERE m.clicks > 40",
+    "SELECT m.date, max(clicks), sum(clicks)  *  2 FROM ad_sales_metrics m GROUP BY m.date",
+])
+def test_estimates_within_bounds(conn, query):
+    estimate = estimate_on(conn, query, min_rows=0)
+    exact = conn.execute(query).fetchall()
+    assert estimate.columns == [d[0] for d in conn.execute(query).description]
+    assert len(estimate.rows) == len(exact)
+    for row, bounds, exact_row in zip(estimate.rows, estimate.bounds, exact):
+        for value, bound, want in zip(row, bounds, exact_row):
+            if bound is None:
+                assert value == want
+            else:
+                # Four bounds keeps the test deterministic in practice; the bound itself is the 95% interval
+                assert abs(value - want) <= 4 * bound, (query, row, exact_row)
+
+def test_estimate_never_runs_the_query_itself(conn):
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        estimate_on(conn, "SELECT date, SUM(ad_sales) FROM ad_sales_metrics GROUP BY date", min_rows=0)
+    finally:
+        conn.set_trace_callback(None)
+    assert statements and not any('FROM ad_sales_metrics' in statement for statement in statements)
+
+def test_stratified_count_is_exact(conn):
+    estimate = estimate_on(conn, "SELECT COUNT(*), MAX(item_id) FROM ad_sales_metrics", min_rows=0)
+    assert estimate.rows == [(ITEMS * ROWS_PER_ITEM, ITEMS)]
+    assert estimate.to_dict()["error_bounds"] == [{"COUNT(*)": 0.0}]
+    assert estimate.sample_rows == ITEMS * ROWS_PER_ITEM // 50
+
+@pytest.mark.parametrize("query", [
+    "SELECT item_id, ad_sales FROM ad_sales_metrics LIMIT 5",
+    "SELECT COUNT(DISTINCT item_id) FROM ad_sales_metrics",
+    "SELECT SUM(ad_sales) FROM ad_sales_metrics WHERE clicks > (SELECT AVG(clicks) FROM ad_sales_metrics)",
+    "SELECT COUNT(*) FROM ad_sales_metrics a JOIN eligibility_table e ON a.item_id = e.item_id",
+    "SELECT COUNT(*) FROM eligibility_table",
+])
+def test_unsupported_queries(conn, query):
+    with pytest.raises(ApproximationUnsupported):
+        plan_estimate(query, load_catalog(conn))
+    assert estimate_on(conn, query, min_rows=0) is None
+
+def test_small_tables_are_not_estimated(conn):
+    assert estimate_on(conn, "SELECT SUM(ad_sales) FROM ad_sales_metrics", min_rows=ITEMS * ROWS_PER_ITEM + 1) is None
+
+def test_samples_are_internal(conn):
+    names = [name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    assert [name for name in names if not INTERNAL_TABLE_RE.match(name)] == ["ad_sales_metrics"]
@@ -0,0 +1,128 @@
+"""
+Every cache backend honours the same contract
+"""
+import threading
+
+import pytest
+
+from config.settings import settings
+from src.services.cache import (
+    Cache, InProcessCacheBackend, NetworkCacheBackend, SQLiteCacheBackend, database_scope, make_cache_server,
+)
+from src.services.results import QueryRows
+
+LIMITS = {"llm": (3, 0), "results": (100, 1), "charts": (0, 0)}
+
+@pytest.fixture(params=["memory", "sqlite", "network"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        yield InProcessCacheBackend(LIMITS)
+    elif request.param == "sqlite":
+        backend = SQLiteCacheBackend(str(tmp_path / "cache.db"), LIMITS)
+        yield backend
+        backend.close()
+    else:
+        server = make_cache_server(InProcessCacheBackend(LIMITS))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        yield NetworkCacheBackend(f"http://127.0.0.1:{server.server_address[1]}")
+        server.shutdown()
+        server.server_close()
+
+def test_get_set_by_generation(backend):
+    backend.set("llm", "k", "db", 1, b"SELECT 1")
+    assert backend.get("llm", "k", 1) == b"SELECT 1"
+    assert backend.get("llm", "k", 2) is None
+    assert backend.get("llm", "other", 1) is None
+    backend.set("llm", "other-db", "elsewhere", 1, b"SELECT 2")
+    assert backend.invalidate("db", 2) == 1
+    assert backend.get("llm", "other-db", 1) == b"SELECT 2"
+    assert backend.get("llm", "k", 1) is None
+
+def test_entry_limit_evicts_least_recently_used(backend):
+    for key in "abc":
+        backend.set("llm", key, "db", 1, key.encode())
+    backend.get("llm", "a", 1)
+    backend.set("llm", "d", "db", 1, b"d")
+    assert backend.get("llm", "b", 1) is None
+    assert [backend.get("llm", key, 1) for key in "acd"] == [b"a", b"c", b"d"]
+    assert backend.stats()["llm"] == {"entries": 3, "bytes": 3}
+
+def test_byte_limit_and_disabled_namespace(backend):
+    half = b"x" * (512 * 1024 + 1)
+    backend.set("results", "a", "db", 1, half)
+    backend.set("results", "b", "db", 1, half)
+    assert backend.get("results", "a", 1) is None
+    assert backend.get("results", "b", 1) == half
+    backend.set("results", "huge", "db", 1, b"x" * (2 * 1024 * 1024))
+    assert backend.get("results", "huge", 1) is None
+    backend.set("charts", "a", "db", 1, b"chart")
+    assert backend.get("charts", "a", 1) is None
+
+def test_clear(backend):
+    backend.set("llm", "a", "db", 1, b"a")
+    backend.set("results", "a", "db", 1, b"a")
+    backend.clear("llm")
+    assert backend.get("llm", "a", 1) is None
+    assert backend.get("results", "a", 1) == b"a"
+    backend.clear()
+    assert backend.get("results", "a", 1) is None
+
+def test_workers_share_sqlite_file(tmp_path):
+    first = SQLiteCacheBackend(str(tmp_path / "cache.db"), LIMITS)
+    second = SQLiteCacheBackend(str(tmp_path / "cache.db"), LIMITS)
+    first.set("llm", "k", "db", 1, b"SELECT 1")
+    assert second.get("llm", "k", 1) == b"SELECT 1"
+
+def test_cache_round_trips_values(monkeypatch):
+    monkeypatch.setattr("src.services.cache.current_generation", lambda: 7)
+    cache = Cache(InProcessCacheBackend(LIMITS), limits=LIMITS, scope="db")
+    cache.set("results", "SELECT 1", QueryRows([{"a": 1, "b": None}]))
+    rows = cache.get("results", "SELECT 1")
+    assert isinstance(rows, QueryRows) and rows == [{"a": 1, "b": None}] and not rows.info.truncated
+    cache.set("llm", "question", "SELECT 1")
+    assert cache.get("llm", "question") == "SELECT 1"
+    assert cache.get("charts", "anything") is None
+
+def test_generation_change_invalidates(monkeypatch):
+    generation = [1]
+    monkeypatch.setattr("src.services.cache.current_generation", lambda: generation[0])
+    cache = Cache(InProcessCacheBackend(LIMITS), limits=LIMITS)
+    cache.set("llm", "q", "SELECT 1")
+    generation[0] = 2
+    assert cache.get("llm", "q") is None
+    assert cache.stats()["llm"]["entries"] == 0
+
+def test_backend_errors_are_misses(monkeypatch):
+    class Broken(InProcessCacheBackend):
+        def get(self, *args):
+            raise ConnectionError("down")
+
+        def set(self, *args):
+            raise ConnectionError("down")
+
+    monkeypatch.setattr("src.services.cache.current_generation", lambda: 1)
+    cache = Cache(Broken(LIMITS), limits=LIMITS)
+    cache.set("llm", "q", "SELECT 1")
+    assert cache.get("llm", "q") is None
+
+def test_databases_sharing_a_file_stay_apart(tmp_path, monkeypatch):
+    generation = [0]
+    monkeypatch.setattr("src.services.cache.current_generation", lambda: generation[0])
+    path = str(tmp_path / "cache.db")
+    first = Cache(SQLiteCacheBackend(path, LIMITS), limits=LIMITS, scope=database_scope())
+    monkeypatch.setattr(settings, "DB_GENERATIONS_DIR", str(tmp_path / "other" / "generations"))
+    monkeypatch.setattr(settings, "DB_PATH", str(tmp_path / "other" / "data.db"))
+    second = Cache(SQLiteCacheBackend(path, LIMITS), limits=LIMITS, scope=database_scope())
+    assert first.scope != second.scope
+
+    # Same SQL at the same generation number, different data
+    first.set("results", "SELECT SUM(total_sales) FROM total_sales_metrics", [{"sum": 1}])
+    assert second.get("results", "SELECT SUM(total_sales) FROM total_sales_metrics") is None
+    second.set("results", "SELECT SUM(total_sales) FROM total_sales_metrics", [{"sum": 2}])
+    assert first.get("results", "SELECT SUM(total_sales) FROM total_sales_metrics") == [{"sum": 1}]
+
+    # A new generation of one database leaves the other's entries alone
+    generation[0] = 1
+    assert second.get("results", "SELECT SUM(total_sales) FROM total_sales_metrics") is None
+    generation[0] = 0
+    assert first.get("results", "SELECT SUM(total_sales) FROM total_sales_metrics") == [{"sum": 1}]
@@ -0,0 +1,33 @@
+"""
+Connection pool accounting
+"""
+import sqlite3
+import threading
+
+from app.db import ConnectionPool
+from src.services.generations import Generation
+
+class _BrokenConnection:
+    def rollback(self):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    def close(self):
+        pass
+
+def test_waiter_wakes_when_a_connection_is_discarded(tmp_path):
+    path = str(tmp_path / "data.db")
+    sqlite3.connect(path).close()
+    pool = ConnectionPool(path, size=1)
+    generation = Generation(0, path)
+    held = pool._acquire(generation)
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool._acquire(generation)), daemon=True)
+    waiter.start()
+    waiter.join(0.2)
+    assert not acquired
+
+    # The borrowed connection fails its rollback and is closed instead of returned
+    held.close()
+    pool._release(generation, _BrokenConnection())
+    waiter.join(5)
+    assert acquired and acquired[0].execute("SELECT 1").fetchone() == (1,)
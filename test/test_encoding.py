@@ -0,0 +1,21 @@
+"""
+Result encodings must accept whatever column types SQLite returns
+"""
+import pytest
+
+from app.encoding import encode_payload, to_arrow_ipc
+
+pa = pytest.importorskip("pyarrow")
+
+def _read(data: bytes):
+    return pa.ipc.open_stream(data).read_all()
+
+def test_arrow_mixed_type_column_becomes_strings():
+    table = _read(to_arrow_ipc([{"a": 1, "b": 2.5}, {"a": "N/A", "b": None}, {"a": None, "b": 3}]))
+    assert table.column("a").to_pylist() == ["1", "N/A", None]
+    assert table.column("b").to_pylist() == [2.5, None, 3.0]
+
+def test_arrow_payload_with_mixed_types():
+    payload = {"question": "q", "answer": [{"a": 1}, {"a": "x"}]}
+    table = _read(encode_payload(payload, "arrow"))
+    assert table.column("a").to_pylist() == ["1", "x"]
@@ -0,0 +1,75 @@
+"""
+CSV/Parquet export of stored results
+"""
+import csv
+import gzip
+import io
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from src.services.results import ResultStore, collect_rows
+
+COLUMNS = ["i", "label"]
+
+def _batches(count, size=100):
+    rows = [(i, f"item-{i}") for i in range(count)]
+    for start in range(0, count, size):
+        yield rows[start:start + size]
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = ResultStore(str(tmp_path / "results"), ttl=60)
+    for module in ("src.services.results", "app.main", "app.export"):
+        monkeypatch.setattr(f"{module}.result_store", store)
+    return store
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+def test_export_marks_incomplete_results(store, client):
+    _, complete = collect_rows(COLUMNS, _batches(500), cap=100, max_spill_rows=1000, store=store)
+    _, partial = collect_rows(COLUMNS, _batches(500), cap=100, max_spill_rows=300, store=store)
+
+    response = client.get(f"/export/{complete.handle}")
+    assert response.headers["x-result-complete"] == "true" and response.headers["x-total-rows"] == "500"
+    assert len(response.text.splitlines()) == 501
+
+    response = client.get(f"/export/{partial.handle}")
+    assert response.headers["x-result-complete"] == "false" and response.headers["x-total-rows"] == "300"
+    assert len(response.text.splitlines()) == 301
+    # A later (ranged) download of the kept file says the same
+    response = client.get(f"/export/{partial.handle}", headers={"Range": "bytes=0-9"})
+    assert response.status_code == 206 and response.headers["x-result-complete"] == "false"
+
+def test_gzip_csv_round_trips(store, client):
+    _, info = collect_rows(COLUMNS, _batches(2500), cap=100, max_spill_rows=5000, store=store)
+    response = client.get(f"/export/{info.handle}", params={"compression": "gzip"})
+    assert response.status_code == 200 and response.headers["content-type"] == "application/gzip"
+    # The client does not undo the gzip: it is the file's own encoding, not a transfer encoding
+    rows = list(csv.reader(io.StringIO(gzip.decompress(response.content).decode("utf-8"))))
+    assert rows[0] == COLUMNS and rows[1:] == [[str(i), f"item-{i}"] for i in range(2500)]
+
+def test_range_resumes_the_kept_file(store, client):
+    _, info = collect_rows(COLUMNS, _batches(2500), cap=100, max_spill_rows=5000, store=store)
+    # A Range request before anything was exported builds the file first
+    head = client.get(f"/export/{info.handle}", params={"compression": "gzip"}, headers={"Range": "bytes=0-99"})
+    assert head.status_code == 206 and len(head.content) == 100
+    total = int(head.headers["content-range"].split("/")[1])
+
+    tail = client.get(f"/export/{info.handle}", params={"compression": "gzip"}, headers={"Range": "bytes=100-"})
+    assert tail.status_code == 206 and len(tail.content) == total - 100
+    whole = client.get(f"/export/{info.handle}", params={"compression": "gzip"})
+    assert head.content + tail.content == whole.content
+    assert gzip.decompress(whole.content).decode("utf-8").splitlines()[-1] == "2499,item-2499"
+
+def test_parquet_export_matches_rows(store, client):
+    pq = pytest.importorskip("pyarrow.parquet")
+    _, info = collect_rows(COLUMNS, _batches(1200), cap=100, max_spill_rows=5000, store=store)
+    response = client.get(f"/export/{info.handle}", params={"format": "parquet", "compression": "zstd"})
+    table = pq.read_table(io.BytesIO(response.content))
+    assert table.column_names == COLUMNS and table.num_rows == 1200
+    assert table.column("i").to_pylist() == list(range(1200))
+    assert client.get(f"/export/{info.handle}", params={"format": "xlsx"}).status_code == 400
@@ -0,0 +1,68 @@
+"""
+Build-and-swap database generations and draining of in-flight readers
+"""
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from app.db import ConnectionPool
+from src.services.generations import GenerationTracker, build_generation
+
+def _write_csv(directory, rows):
+    directory.mkdir(exist_ok=True)
+    lines = ["date,item_id,ad_sales,ad_spend,clicks"] + [f"2025-06-{day:02d},{item},{sales},1.0,2"
+                                                         for day, item, sales in rows]
+    (directory / "ad_sales_metrics.csv").write_text("\n".join(lines) + "\n")
+
+@pytest.fixture
+def tracker(tmp_path, monkeypatch):
+    fallback = str(tmp_path / "data.db")
+    sqlite3.connect(fallback).close()
+    tracker = GenerationTracker(str(tmp_path / "generations"), fallback, retain=0)
+    monkeypatch.setattr("app.db.generations", tracker)
+    return tracker
+
+def _publish(tracker, data_dir, rows):
+    _write_csv(data_dir, rows)
+    generation = build_generation(str(data_dir), tracker=tracker)
+    tracker.publish(generation)
+    return generation
+
+def test_build_generation_is_validated_and_indexed(tracker, tmp_path):
+    generation = _publish(tracker, tmp_path / "csv", [(1, 7, 10.0), (2, 8, 20.0)])
+    assert tracker.current().number == generation.number == 1
+    conn = sqlite3.connect(generation.path)
+    try:
+        assert conn.execute("SELECT COUNT(*), SUM(ad_sales) FROM ad_sales_metrics").fetchone() == (2, 30.0)
+        indexes = [name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+        assert "idx_ad_sales_metrics_date_item_id" in indexes
+    finally:
+        conn.close()
+    assert not list(tracker.directory.glob("*.building"))
+
+def test_swap_waits_for_checked_out_connections(tracker, tmp_path):
+    pool = ConnectionPool(size=2)
+    first = _publish(tracker, tmp_path / "csv", [(1, 7, 10.0)])
+
+    with pool.connection() as conn:
+        assert tracker.in_flight() == {first.number: 1}
+        second = _publish(tracker, tmp_path / "csv", [(1, 7, 10.0), (2, 7, 5.0)])
+        assert tracker.current().number == second.number
+        # The superseded file stays while a query still reads it
+        assert conn.execute("SELECT SUM(ad_sales) FROM ad_sales_metrics").fetchone() == (10.0,)
+        assert tracker.cleanup() == [] and Path(first.path).exists()
+
+    # The last reader leaving drains the old generation and deletes it
+    assert tracker.in_flight() == {}
+    assert not Path(first.path).exists()
+    with pool.connection() as conn:
+        assert conn.execute("SELECT SUM(ad_sales) FROM ad_sales_metrics").fetchone() == (15.0,)
+
+def test_failed_build_leaves_nothing_behind(tracker, tmp_path):
+    data_dir = tmp_path / "csv"
+    data_dir.mkdir()
+    with pytest.raises(ValueError):
+        build_generation(str(data_dir), tracker=tracker)
+    assert list(tracker.directory.iterdir()) == []
+    assert tracker.current().number == 0
@@ -1 +1,66 @@
 # Tests for LLM-SQL translation
+import pytest
+
+from app import llm_interface
+from app.llm_interface import ask_llm, build_prompt, clean_sql
+from src.services.cache import Cache, InProcessCacheBackend
+from src.services.metrics import SQL_CLEANING_FAILURES
+
+class _Response:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+@pytest.fixture
+def llm(monkeypatch):
+    """A private LLM cache and a stand-in for the Gemini endpoint; returns the prompts it was sent"""
+    prompts = []
+    replies = {"text": "```sql\nSELECT SUM(total_sales) FROM total_sales_metrics\n```"}
+
+    def post(url, headers=None, json=None):
+        prompts.append(json["contents"][0]["parts"][0]["text"])
+        if "text" not in replies:
+            return _Response({"error": {"code": 429, "message": "quota"}})
+        return _Response({"candidates": [{"content": {"parts": [{"text": replies["text"]}]}}]})
+
+    monkeypatch.setattr(llm_interface, "cache", Cache(InProcessCacheBackend({"llm": (10, 0)}), scope="test"))
+    monkeypatch.setattr(llm_interface, "GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(llm_interface.requests, "post", post)
+    return prompts, replies
+
+@pytest.mark.parametrize("raw, sql, reason", [
+    ("```sql\nSELECT 1\n```", "SELECT 1", None),
+    ("  WITH t AS (SELECT 1) SELECT * FROM t ", "WITH t AS (SELECT 1) SELECT * FROM t", None),
+    ("```\n```", "", "empty"),
+    ("Sorry, I cannot answer that.", "Sorry, I cannot answer that.", "not_select"),
+    ("Error from LLM: {'error': 'quota'}", "Error from LLM: {'error': 'quota'}", "llm_error"),
+])
+def test_clean_sql(raw, sql, reason):
+    before = {r: SQL_CLEANING_FAILURES.value(reason=r) for r in ("empty", "not_select", "llm_error")}
+    assert clean_sql(raw) == sql
+    for name, count in before.items():
+        assert SQL_CLEANING_FAILURES.value(reason=name) == count + (name == reason)
+
+def test_responses_are_cached_by_question(llm):
+    prompts, _ = llm
+    question = "What is the total sales?"
+    assert clean_sql(ask_llm(question)) == "SELECT SUM(total_sales) FROM total_sales_metrics"
+    # Whitespace differences hit the same entry
+    assert ask_llm("What  is the total\nsales?") == ask_llm(question)
+    assert len(prompts) == 1 and prompts[0] == build_prompt(question)
+
+def test_llm_errors_are_returned_but_not_cached(llm):
+    prompts, replies = llm
+    del replies["text"]
+    assert ask_llm("Which item had the highest CPC?").startswith("Error from LLM:")
+    replies["text"] = "SELECT item_id FROM ad_sales_metrics"
+    assert ask_llm("Which item had the highest CPC?") == "SELECT item_id FROM ad_sales_metrics"
+    assert len(prompts) == 2
+
+def test_missing_api_key_raises(llm, monkeypatch):
+    monkeypatch.setattr(llm_interface, "GEMINI_API_KEY", None)
+    with pytest.raises(ValueError):
+        ask_llm("What is the total sales?")
+    assert not llm[0]
@@ -0,0 +1,70 @@
+"""
+Partition routing must read only the months a query can match, and return the same rows
+"""
+import re
+import sqlite3
+
+import pytest
+
+from src.services.partitions import PartitionRouter, partition_table
+
+MONTHS = ["2025-04", "2025-05", "2025-06", "2025-07"]
+
+@pytest.fixture(scope="module")
+def conn():
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.execute("CREATE TABLE ad_sales_metrics (date TEXT, item_id INTEGER, ad_sales REAL, clicks INTEGER)")
+    rows = [(f"{month}-{day:02d}", item_id, item_id * day * 1.5, (item_id + day) % 7)
+            for month in MONTHS for day in (1, 15, 28) for item_id in range(1, 6)]
+    conn.executemany("INSERT INTO ad_sales_metrics VALUES (?, ?, ?, ?)", rows + [(None, 9, 1.0, 1)])
+    partition_table(conn, "ad_sales_metrics")
+    conn.execute("CREATE TABLE eligibility (item_id INTEGER, date TEXT)")
+    yield conn
+    conn.close()
+
+def _months(sql):
+    """Months a routed query reads; None when it still reads the whole view"""
+    if not re.search(r"ad_sales_metrics_p", sql):
+        return None
+    return sorted(f"{m[:4]}-{m[4:]}" for m in re.findall(r"ad_sales_metrics_p(\d{6})", sql))
+
+@pytest.mark.parametrize("query, months", [
+    ("SELECT SUM(ad_sales) FROM ad_sales_metrics WHERE date >= '2025-06-01'", ["2025-06", "2025-07"]),
+    ("SELECT COUNT(*) FROM ad_sales_metrics m WHERE m.date BETWEEN '2025-05-10' AND '2025-06-02' AND clicks > 2",
+     ["2025-05", "2025-06"]),
+    ("SELECT item_id FROM ad_sales_metrics WHERE '2025-05-01' > date ORDER BY item_id", ["2025-04"]),
+    ("SELECT COUNT(*) FROM ad_sales_metrics WHERE strftime('%Y-%m', date) = '2025-07'", ["2025-07"]),
+    ("SELECT COUNT(*) FROM ad_sales_metrics WHERE date IN ('2025-04-15', '2025-07-01')", ["2025-04", "2025-07"]),
+    # Either side of an OR may hold, so no partition can be skipped
+    ("SELECT COUNT(*) FROM ad_sales_metrics WHERE date >= '2025-07-01' OR clicks = 3", None),
+    ("SELECT COUNT(*) FROM ad_sales_metrics WHERE date = '2025-04-01' OR date = '2025-07-01'", None),
+    # Negated predicates match the other months
+    ("SELECT COUNT(*) FROM ad_sales_metrics WHERE NOT date >= '2025-06-01'", None),
+    ("SELECT COUNT(*) FROM ad_sales_metrics WHERE NOT (date < '2025-06-01') AND clicks > 1", None),
+    ("SELECT COUNT(*) FROM ad_sales_metrics WHERE date NOT BETWEEN '2025-05-01' AND '2025-06-30'", None),
+    # Predicates of another scope do not restrict the outer reference
+    ("SELECT COUNT(*) FROM ad_sales_metrics WHERE item_id IN "
+     "(SELECT item_id FROM eligibility WHERE date >= '2025-07-01')", None),
+])
+def test_routes_to_matching_months(conn, query, months):
+    routed = PartitionRouter().route(conn, query)
+    assert _months(routed) == months
+    assert conn.execute(routed).fetchall() == conn.execute(query).fetchall()
+
+@pytest.mark.parametrize("query", [
+    "SELECT COUNT(*), SUM(ad_sales) FROM ad_sales_metrics WHERE date >= '2030-01-01'",
+    "SELECT item_id FROM ad_sales_metrics WHERE date < '2020-01-01' AND item_id = 1",
+    "SELECT COUNT(*) FROM ad_sales_metrics WHERE date LIKE '2024-%'",
+])
+def test_out_of_range_reads_no_partition(conn, query):
+    routed = PartitionRouter().route(conn, query)
+    assert "WHERE 0" in routed
+    assert conn.execute(routed).fetchall() == conn.execute(query).fetchall()
+
+def test_null_dates_only_without_date_predicates(conn):
+    router = PartitionRouter()
+    assert router.route(conn, "SELECT COUNT(*) FROM ad_sales_metrics WHERE item_id = 9") == \
+        "SELECT COUNT(*) FROM ad_sales_metrics WHERE item_id = 9"
+    routed = router.route(conn, "SELECT COUNT(*) FROM ad_sales_metrics WHERE date > '2025-01-01'")
+    assert "p_null" not in routed and "pnull" not in routed
+    assert conn.execute(routed).fetchone() == (len(MONTHS) * 3 * 5,)
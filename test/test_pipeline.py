@@ -0,0 +1,108 @@
+"""
+Pipeline stages, hooks and the order stream() reports them in
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.pipeline import PipelineError, QueryContext, QueryPipeline
+from src.services.cache import cache
+from src.services.results import QueryRows
+
+ROWS = [{"date": "2025-06-01", "sales": 10.0}, {"date": "2025-06-02", "sales": 12.5}]
+
+class Stages:
+    """Stand-ins for the LLM, the database, the sampler and the chart renderer"""
+
+    def __init__(self):
+        self.exact_done = threading.Event()
+        self.estimate_done = threading.Event()
+        self.execute = lambda sql: QueryRows(ROWS)
+        self.estimate = lambda sql: None
+
+@pytest.fixture
+def stages(monkeypatch):
+    stages = Stages()
+    monkeypatch.setattr(cache, "enabled", False)
+    monkeypatch.setattr("app.pipeline.ask_llm", lambda question: "```sql\nSELECT date, sales FROM daily\n```")
+    monkeypatch.setattr("app.pipeline.execute_sql_query", lambda sql: stages.execute(sql))
+    monkeypatch.setattr("app.pipeline.estimate_query", lambda sql: stages.estimate(sql))
+    monkeypatch.setattr("app.pipeline.visualizer.generate_visualization",
+                        lambda rows, question, chart_type: {"chart_type": chart_type or "line"})
+    yield stages
+    # Let stand-ins still blocked in worker threads finish
+    stages.exact_done.set()
+    stages.estimate_done.set()
+
+def _stream(pipeline, context, on_event=None):
+    async def collect():
+        events = []
+        async for event in pipeline.stream(context):
+            events.append(event)
+            if on_event:
+                on_event(event)
+        return events
+    return asyncio.run(collect())
+
+def test_run_calls_hooks_in_stage_order(stages):
+    pipeline, calls = QueryPipeline(), []
+    for event in ("before", "after"):
+        for stage in ("llm", "clean", "execute", "visualize"):
+            pipeline.add_hook(event, stage, lambda stage, context, event=event: calls.append(f"{event}:{stage}"))
+    context = pipeline.run(QueryContext("daily sales", chart_type="bar"))
+
+    assert calls == ["before:llm", "after:llm", "before:clean", "after:clean",
+                     "before:execute", "after:execute", "before:visualize", "after:visualize"]
+    assert context.sql_query == "SELECT date, sales FROM daily"
+    assert context.answer == ROWS and context.visualization == {"chart_type": "bar"}
+    assert set(context.timings) == {"llm", "clean", "execute", "visualize"}
+    with pytest.raises(ValueError):
+        pipeline.add_hook("before", "render", lambda stage, context: None)
+
+def test_failed_stage_raises_pipeline_error(stages):
+    pipeline, failed = QueryPipeline(), []
+    pipeline.add_hook("error", "execute", lambda stage, context: failed.append(str(context.error)))
+
+    def broken(sql):
+        raise RuntimeError("database is locked")
+
+    stages.execute = broken
+    with pytest.raises(PipelineError) as raised:
+        pipeline.run(QueryContext("daily sales"))
+    assert raised.value.stage == "execute" and failed == ["database is locked"]
+
+def test_stream_reports_estimate_before_result(stages):
+    # The exact answer waits until the client has seen the estimate
+    stages.estimate = lambda sql: object()
+    stages.execute = lambda sql: (stages.exact_done.wait(5), QueryRows(ROWS))[1]
+    context = QueryContext("daily sales")
+
+    def on_event(event):
+        if event == "estimate":
+            stages.exact_done.set()
+
+    events = _stream(QueryPipeline(), context, on_event)
+    assert events == ["llm", "execute", "estimate", "visualize", "result", "visualization"]
+    assert context.answer == ROWS and context.visualization is not None
+
+def test_stream_does_not_wait_for_a_slow_estimate(stages):
+    stages.estimate = lambda sql: (stages.estimate_done.wait(5), object())[1]
+    context = QueryContext("daily sales", include_visualization=False)
+
+    start, arrived = time.perf_counter(), {}
+
+    def on_event(event):
+        arrived[event] = time.perf_counter() - start
+        if event == "result":
+            stages.estimate_done.set()
+
+    events = _stream(QueryPipeline(), context, on_event)
+    assert arrived["result"] < 2
+    assert events == ["llm", "execute", "result"]
+    assert context.answer == ROWS
+
+def test_stream_without_rows_skips_the_chart(stages):
+    stages.execute = lambda sql: "SQL Execution Error: no such table: daily"
+    assert _stream(QueryPipeline(), QueryContext("daily sales")) == ["llm", "execute", "result"]
@@ -0,0 +1,30 @@
+"""
+Request profiles that overlap must not share tracemalloc
+"""
+import tracemalloc
+
+from src.services.profiling import RequestProfile
+
+def test_only_one_profile_traces_memory():
+    first, second = RequestProfile("return"), RequestProfile("return")
+    first.start()
+    second.start()
+    try:
+        with first.stage("execute"), second.stage("execute"):
+            data = [bytes(1024) for _ in range(100)]
+    finally:
+        second.stop()
+        assert tracemalloc.is_tracing()
+        first.stop()
+    assert not tracemalloc.is_tracing() and len(data) == 100
+
+    assert first.report()["memory"]["traced"] and first.stages[0]["allocated_bytes"] > 0
+    memory = second.report()["memory"]
+    assert not memory["traced"] and memory["peak_traced_bytes"] is None and memory["top_allocations"] == []
+    assert second.stages[0]["allocated_bytes"] is None
+
+    # Released once the first profile stops
+    third = RequestProfile("return")
+    third.start()
+    third.stop()
+    assert third.traces_memory
@@ -0,0 +1,144 @@
+"""
+Capped, spilled and paged query results
+"""
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import db
+from app.main import app
+from config.settings import settings
+from src.services.results import ResultStore, collect_rows, spill_rows
+
+COLUMNS = ["i", "label"]
+
+def _rows(count):
+    return [(i, f"item-{i}") for i in range(count)]
+
+def _batches(rows, size=100):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = ResultStore(str(tmp_path / "results"), ttl=60)
+    monkeypatch.setattr("src.services.results.result_store", store)
+    monkeypatch.setattr("app.main.result_store", store)
+    return store
+
+def test_small_result_stays_inline(store):
+    rows, info = collect_rows(COLUMNS, _batches(_rows(250)), cap=250, max_spill_rows=1000, store=store)
+    assert rows == _rows(250)
+    assert not info.truncated and info.total_rows == 250 and not info.spilled
+
+def test_cap_spills_whole_result(store):
+    rows, info = collect_rows(COLUMNS, _batches(_rows(1050)), cap=250, max_spill_rows=5000, store=store)
+    assert rows == _rows(250)
+    assert info.truncated and info.spilled and info.total_rows == 1050 and not info.limit_reached
+
+    result = store.open(info.handle)
+    assert result.columns == COLUMNS and result.total_rows == 1050 and result.complete
+    assert [row for batch in result.batches(batch_size=64) for row in batch] == _rows(1050)
+    assert result.page(1000, 100) == _rows(1050)[1000:]
+
+def test_spill_limit_marks_result_incomplete(store):
+    rows, info = collect_rows(COLUMNS, _batches(_rows(1050)), cap=250, max_spill_rows=600, store=store)
+    assert len(rows) == 250
+    assert info.limit_reached and info.total_rows == 600
+    result = store.open(info.handle)
+    assert not result.complete and result.page(0, 1000) == _rows(600)
+
+def test_spill_limit_below_cap_keeps_first_rows(store):
+    rows, info = collect_rows(COLUMNS, _batches(_rows(1050)), cap=250, max_spill_rows=120, store=store)
+    assert rows == _rows(250)
+    assert info.limit_reached and info.total_rows == 120
+    assert store.open(info.handle).page(0, 1000) == _rows(120)
+
+def test_no_spill_truncates_at_cap(store):
+    rows, info = collect_rows(COLUMNS, _batches(_rows(1050)), cap=250, max_spill_rows=0, store=store)
+    assert rows == _rows(250)
+    assert info.truncated and not info.spilled and info.total_rows is None
+    assert not list(store.directory.glob("*.db"))
+
+def test_spill_rows_writes_small_results(store):
+    info = spill_rows(COLUMNS, _batches(_rows(10)), store=store)
+    assert store.open(info.handle).page(0, 100) == _rows(10)
+
+def test_results_expire_after_ttl(store):
+    _, info = collect_rows(COLUMNS, _batches(_rows(500)), cap=100, max_spill_rows=1000, store=store)
+    path = store.directory / f"{info.handle}.db"
+    expired = time.time() - store.ttl - 1
+    os.utime(path, (expired, expired))
+    assert store.open(info.handle) is None
+    assert store.cleanup() == 1 and not path.exists()
+    assert store.open("not-a-handle") is None
+
+def test_pages_through_results_endpoint(store, monkeypatch):
+    monkeypatch.setattr(settings, "RESULT_PAGE_SIZE", 400)
+    _, info = collect_rows(COLUMNS, _batches(_rows(1050)), cap=100, max_spill_rows=5000, store=store)
+    client = TestClient(app)
+
+    received, offset = [], 0
+    while offset is not None:
+        page = client.get(f"/results/{info.handle}", params={"offset": offset}).json()
+        assert page["total_rows"] == 1050 and page["complete"] and page["columns"] == COLUMNS
+        received.extend(page["data"])
+        offset = page["next_offset"]
+    assert received == [{"i": i, "label": label} for i, label in _rows(1050)]
+
+    assert client.get(f"/results/{info.handle}", params={"limit": 0}).status_code == 400
+    assert client.get(f"/results/{'0' * 32}").status_code == 404
+
+def test_execute_sql_query_caps_and_spills(store, tmp_path, monkeypatch):
+    path = str(tmp_path / "data.db")
+    sqlite3.connect(path).close()
+    monkeypatch.setattr(db, "pool", db.ConnectionPool(path, size=1))
+    monkeypatch.setattr(settings, "RESULT_ROW_CAP", 100)
+    answer = db.execute_sql_query(
+        "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 1000) SELECT i FROM n"
+    )
+    assert len(answer) == 100 and answer.info.total_rows == 1000
+    assert [row for batch in store.open(answer.info.handle).batches() for (row,) in batch] == list(range(1, 1001))
+
+_CHILD = """
+import json, resource, sys
+import pandas
+from app import db
+db.pool = db.ConnectionPool(sys.argv[1], size=1)
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+answer = db.execute_sql_query(
+    "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < %d) "
+    "SELECT i, i * 0.5 AS half, 'item-' || i AS label, date('2024-01-01', '+' || (i %% 365) || ' days') AS day FROM n"
+    % int(sys.argv[2])
+)
+assert not isinstance(answer, str), answer
+print(json.dumps({"rows": len(answer), "growth_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024}))
+"""
+
+def _peak_growth(tmp_path, rows, cap):
+    path = str(tmp_path / "data.db")
+    sqlite3.connect(path).close()
+    env = dict(os.environ, RESULT_ROW_CAP=str(cap), RESULT_SPILL_DIR=str(tmp_path / "spill"),
+               WARMUP_ENABLED="false", DB_BACKEND="sqlite",
+               PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                           os.environ.get("PYTHONPATH", "")]))
+    output = subprocess.run([sys.executable, "-c", _CHILD, path, str(rows)], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+@pytest.mark.skipif(sys.platform == "win32", reason="needs resource.getrusage")
+def test_capped_memory_does_not_grow_with_result_size(tmp_path):
+    small = _peak_growth(tmp_path, 20_000, cap=1000)
+    large = _peak_growth(tmp_path, 400_000, cap=1000)
+    uncapped = _peak_growth(tmp_path, 400_000, cap=0)
+    assert small["rows"] == large["rows"] == 1000 and uncapped["rows"] == 400_000
+    # 20x the rows may not cost more than a few MB of peak RSS once capped...
+    assert large["growth_mb"] - small["growth_mb"] < 10, (small, large)
+    # ...while the same result held in memory clearly does
+    assert uncapped["growth_mb"] > large["growth_mb"] + 50, (large, uncapped)
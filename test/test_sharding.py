@@ -0,0 +1,192 @@
+"""
+Sharded query results must match the unsharded database
+"""
+import math
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from src.services.database import ShardedBackend
+from src.services.results import ResultStore, collect_rows
+from src.services.sharding import (
+    LocalShard, RemoteShard, ShardCoordinator, ShardingUnsupported, build_shards, make_worker, plan_query, shard_for,
+)
+
+DB_PATH = os.path.join(os.path.dirname(__file__), "../data.db")
+SHARD_COUNT = 3
+
+pytestmark = pytest.mark.skipif(not os.path.exists(DB_PATH), reason="data.db not found")
+
+QUERIES = [
+    "SELECT SUM(total_sales) FROM total_sales_metrics",
+    "SELECT COUNT(*), COUNT(DISTINCT item_id) FROM ad_sales_metrics",
+    "SELECT SUM(ad_sales) / SUM(ad_spend) AS roas FROM ad_sales_metrics",
+    "SELECT date, SUM(ad_sales) / SUM(ad_spend) AS roas FROM ad_sales_metrics GROUP BY date ORDER BY date",
+    "SELECT item_id, SUM(ad_spend) / SUM(clicks) AS cpc FROM ad_sales_metrics WHERE clicks > 0 "
+    "GROUP BY item_id ORDER BY cpc DESC, item_id LIMIT 10",
+    "SELECT date, SUM(total_sales) AS sales, AVG(total_units_ordered) FROM total_sales_metrics GROUP BY 1 ORDER BY 1",
+    "SELECT MIN(date), MAX(date), MAX(ad_sales), TOTAL(impressions) FROM ad_sales_metrics",
+    "SELECT item_id, SUM(total_sales) AS sales FROM total_sales_metrics GROUP BY item_id "
+    "HAVING SUM(total_sales) > 100 ORDER BY sales DESC, item_id LIMIT 5 OFFSET 2",
+    "SELECT t.date, SUM(a.ad_sales) / SUM(t.total_sales) AS ad_share FROM total_sales_metrics t "
+    "JOIN ad_sales_metrics a ON a.item_id = t.item_id AND a.date = t.date GROUP BY t.date ORDER BY t.date",
+    "SELECT item_id, date, ad_sales FROM ad_sales_metrics ORDER BY ad_sales DESC, item_id, date LIMIT 20",
+    "SELECT DISTINCT date FROM total_sales_metrics ORDER BY date",
+    "SELECT * FROM total_sales_metrics WHERE total_units_ordered > 5 ORDER BY total_sales DESC, item_id, date LIMIT 15",
+    "SELECT item_id, ad_sales FROM ad_sales_metrics WHERE item_id = 12 ORDER BY date",
+    "SELECT COUNT(*), SUM(ad_sales) FROM ad_sales_metrics WHERE NOT item_id = 12",
+    "SELECT COUNT(*) FROM ad_sales_metrics WHERE clicks > 0 AND NOT (12 = item_id)",
+    "SELECT a.item_id, a.date, a.ad_sales FROM ad_sales_metrics a JOIN total_sales_metrics t ON a.item_id = t.item_id "
+    "ORDER BY t.date DESC, a.item_id, a.date LIMIT 20",
+    "SELECT COUNT(*) FROM eligibility_table WHERE eligibility = 0",
+]
+
+@pytest.fixture(scope="module")
+def shard_dir(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("shards")
+    build_shards(DB_PATH, str(directory), SHARD_COUNT)
+    return directory
+
+@pytest.fixture(scope="module")
+def unsharded():
+    conn = sqlite3.connect(f"file:{os.path.abspath(DB_PATH)}?mode=ro", uri=True, check_same_thread=False)
+    yield conn
+    conn.close()
+
+def _shards(directory):
+    return [LocalShard(str(directory / f"shard-{i:03d}.db")) for i in range(SHARD_COUNT)]
+
+def _assert_same(actual, expected):
+    assert len(actual) == len(expected)
+    for got, want in zip(actual, expected):
+        assert len(got) == len(want)
+        for a, b in zip(got, want):
+            if isinstance(b, float):
+                assert math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9), (got, want)
+            else:
+                assert a == b, (got, want)
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_matches_unsharded(shard_dir, unsharded, query):
+    coordinator = ShardCoordinator(_shards(shard_dir))
+    columns, rows = coordinator.execute(query)
+    cursor = unsharded.execute(query)
+    assert columns == [d[0] for d in cursor.description]
+    _assert_same(rows, cursor.fetchall())
+
+def test_rows_partitioned_by_item(shard_dir, unsharded):
+    total = 0
+    for index, shard in enumerate(_shards(shard_dir)):
+        _, rows = shard.execute("SELECT DISTINCT item_id FROM ad_sales_metrics")
+        assert all(shard_for(item_id, SHARD_COUNT) == index for (item_id,) in rows)
+        total += shard.execute("SELECT COUNT(*) FROM ad_sales_metrics")[1][0][0]
+    assert total == unsharded.execute("SELECT COUNT(*) FROM ad_sales_metrics").fetchone()[0]
+
+def test_item_filter_targets_one_shard():
+    plan = plan_query("SELECT SUM(ad_sales) FROM ad_sales_metrics WHERE item_id = 7 AND clicks > 0", SHARD_COUNT)
+    assert plan.targets == [shard_for(7, SHARD_COUNT)]
+    assert plan_query("SELECT * FROM ad_sales_metrics WHERE item_id = 7 OR clicks > 0", SHARD_COUNT).targets is None
+    assert plan_query("SELECT * FROM ad_sales_metrics WHERE NOT item_id = 7", SHARD_COUNT).targets is None
+    assert plan_query("SELECT * FROM ad_sales_metrics WHERE NOT (item_id = 7)", SHARD_COUNT).targets is None
+    plan = plan_query("SELECT * FROM ad_sales_metrics WHERE NOT item_id = 7 AND item_id = 8", SHARD_COUNT)
+    assert plan.targets == [shard_for(8, SHARD_COUNT)]
+
+def test_aggregate_runs_once_per_shard(shard_dir):
+    queries = []
+
+    class Counting(LocalShard):
+        def fetch(self, query, batch_size=None):
+            queries.append(query)
+            return super().fetch(query, batch_size)
+
+    coordinator = ShardCoordinator([Counting(shard.path) for shard in _shards(shard_dir)])
+    columns, _ = coordinator.execute("SELECT date, SUM(ad_sales), AVG(clicks) AS clicks FROM ad_sales_metrics GROUP BY date")
+    assert columns == ["date", "SUM(ad_sales)", "clicks"]
+    assert len(queries) == SHARD_COUNT and len(set(queries)) == 1
+
+@pytest.mark.parametrize("query", [
+    "SELECT item_id FROM ad_sales_metrics WHERE ad_sales > (SELECT AVG(ad_sales) FROM ad_sales_metrics)",
+    "SELECT COUNT(DISTINCT date) FROM ad_sales_metrics",
+    "SELECT date, SUM(ad_sales) OVER (ORDER BY date) FROM ad_sales_metrics",
+    "SELECT a.date FROM ad_sales_metrics a JOIN total_sales_metrics t ON a.date = t.date",
+])
+def test_unsupported_falls_back(shard_dir, unsharded, query):
+    with pytest.raises(ShardingUnsupported):
+        plan_query(query, SHARD_COUNT)
+
+    class Unsharded:
+        def execute(self, sql):
+            cursor = unsharded.execute(sql)
+            return [d[0] for d in cursor.description], cursor.fetchall()
+
+    coordinator = ShardCoordinator(_shards(shard_dir), fallback=Unsharded())
+    _, rows = coordinator.execute(query + " LIMIT 50")
+    _assert_same(rows, unsharded.execute(query + " LIMIT 50").fetchall())
+
+def test_remote_workers(shard_dir, unsharded, monkeypatch):
+    monkeypatch.setattr("src.services.sharding.settings.RESULT_FETCH_BATCH", 100)
+    servers = [make_worker(shard.path) for shard in _shards(shard_dir)]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        coordinator = ShardCoordinator([RemoteShard(f"http://127.0.0.1:{s.server_address[1]}") for s in servers])
+        query = QUERIES[3]
+        _, rows = coordinator.execute(query)
+        _assert_same(rows, unsharded.execute(query).fetchall())
+        query = "SELECT item_id, date, ad_sales FROM ad_sales_metrics ORDER BY date, item_id"
+        _, rows = coordinator.execute(query)
+        _assert_same(rows, unsharded.execute(query).fetchall())
+        with pytest.raises(sqlite3.OperationalError):
+            coordinator.execute("SELECT SUM(missing_column) FROM ad_sales_metrics")
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+def test_fetch_streams_merged_rows(shard_dir, unsharded, monkeypatch, tmp_path):
+    monkeypatch.setattr("src.services.sharding.settings.RESULT_FETCH_BATCH", 100)
+    query = "SELECT item_id, date, ad_sales FROM ad_sales_metrics ORDER BY date, item_id"
+    expected = unsharded.execute(query).fetchall()
+    coordinator = ShardCoordinator(_shards(shard_dir))
+    with coordinator.fetch(query) as (columns, batches):
+        sizes, rows = [], []
+        for batch in batches:
+            sizes.append(len(batch))
+            rows.extend(batch)
+    assert columns == ["item_id", "date", "ad_sales"]
+    assert max(sizes) <= 100 and len(sizes) > 1
+    _assert_same(rows, expected)
+
+    backend = ShardedBackend(str(shard_dir), nodes=[], fallback=False, db_path=DB_PATH)
+    store = ResultStore(str(tmp_path / "results"), ttl=60)
+    with backend.fetch(query) as (columns, batches):
+        inline, info = collect_rows(columns, batches, cap=50, max_spill_rows=len(expected), store=store)
+    assert len(inline) == 50 and info.spilled and info.total_rows == len(expected)
+    _assert_same([row for batch in store.open(info.handle).batches() for row in batch], expected)
+
+def test_stale_shards_are_not_used(shard_dir, unsharded, tmp_path):
+    newer = tmp_path / "data-000002.db"
+    target = sqlite3.connect(str(newer))
+    unsharded.backup(target)
+    target.execute("DELETE FROM total_sales_metrics WHERE item_id % 2 = 0")
+    target.commit()
+    target.close()
+    query = "SELECT SUM(total_sales) FROM total_sales_metrics"
+
+    # The served database moved on: queries read it instead of the old shards
+    backend = ShardedBackend(str(shard_dir), nodes=[], fallback=True, db_path=str(newer))
+    assert backend._current() is None
+    expected = sqlite3.connect(str(newer)).execute(query).fetchall()
+    _assert_same(backend.execute(query)[1], expected)
+    strict = ShardedBackend(str(shard_dir), nodes=[], fallback=False, db_path=str(newer))
+    with pytest.raises(ShardingUnsupported):
+        strict.execute(query)
+
+    # Rebuilt shards are picked up without reopening the backend
+    rebuilt = tmp_path / "rebuilt"
+    build_shards(str(newer), str(rebuilt), SHARD_COUNT)
+    backend.shard_dir = str(rebuilt)
+    assert backend._current() is not None
+    _assert_same(backend.execute(query)[1], expected)
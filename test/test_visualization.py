@@ -0,0 +1,34 @@
+"""
+Result profiling shared by chart selection and the renderers
+"""
+from app.visualization import profile_data, visualizer
+from src.services.metrics import DATAFRAME_BUILD
+from src.services.results import query_rows, to_records
+
+COLUMNS = ["date", "code", "sales"]
+ROWS = [("2025-06-01", "2024", 10.5), ("2025-06-02", "2025", None), ("2025-06-03", "2026", 7.0)]
+
+def _builds():
+    return DATAFRAME_BUILD.count(source="visualization")
+
+def test_profile_reuses_the_result_frame():
+    rows = query_rows(COLUMNS, ROWS)
+    assert repr(list(rows)) == repr(to_records(COLUMNS, ROWS))
+
+    before = _builds()
+    profile = profile_data(rows)
+    chart = visualizer.generate_visualization(rows, "sales over time")
+    assert profile.df is rows.frame and _builds() == before
+    assert chart["type"] == "line"
+
+    # Plain records (e.g. from the cache) are converted once
+    assert profile_data(list(rows)).df is not rows.frame and _builds() == before + 1
+
+def test_profile_columns():
+    profile = profile_data(query_rows(COLUMNS, ROWS))
+    assert profile.date_columns == ["date"] and profile.numeric_columns == ["sales"]
+    # Four-digit codes parse as ISO 8601 years but are not dates
+    assert profile.text_columns == ["date", "code"]
+    sales = profile.columns[2]
+    assert (sales.minimum, sales.maximum, sales.null_count) == (7.0, 10.5, 1)
+    assert profile.columns[0].minimum == "2025-06-01T00:00:00"